@@ -1,31 +1,26 @@
 import os
 import cv2
+import time
+import queue
+import threading
 import numpy as np
+from segement.saliency import salient_mask
 
 INPUT_DIR = "documents/input_images"
 OUTPUT_DIR = "documents/segments"
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+VALID_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
 
 
-def extract_salient_region(img):
+def extract_salient_region(img, detector=None):
     """
     Computes saliency map using OpenCV's StaticSaliencySpectralResidual
     and returns a cropped salient region.
-    """
-
-    # Initialize saliency detector
-    saliency = cv2.saliency.StaticSaliencySpectralResidual_create()
-
-    # Compute saliency map (float32 between 0 and 1)
-    success, saliency_map = saliency.computeSaliency(img)
-    if not success:
-        raise RuntimeError("Saliency computation failed.")
 
-    # Convert saliency to 0–255 for thresholding
-    saliency_uint8 = (saliency_map * 255).astype("uint8")
+    The detector is reused per thread unless one is passed in.
+    """
 
-    # Threshold (Otsu automatically finds best threshold)
-    _, mask = cv2.threshold(saliency_uint8, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # Saliency map (0–255) and its Otsu threshold
+    saliency_uint8, mask = salient_mask(img, detector)
 
     # Find bounding box of salient region
     coords = cv2.findNonZero(mask)
@@ -41,8 +36,9 @@ def extract_salient_region(img):
 
 
 def process_all_images():
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
     for filename in os.listdir(INPUT_DIR):
-        if not filename.lower().endswith((".png", ".jpg", ".jpeg", ".bmp")):
+        if not filename.lower().endswith(VALID_EXTENSIONS):
             continue
 
         path = os.path.join(INPUT_DIR, filename)
@@ -71,5 +67,124 @@ def process_all_images():
         print(f"Processed {filename}")
 
 
+def _run_stage(target, count, name):
+    threads = [threading.Thread(target=target, name=f"{name}-{i}", daemon=True) for i in range(count)]
+    for t in threads:
+        t.start()
+    return threads
+
+
+def process_all_images_parallel(input_dir=INPUT_DIR, output_dir=OUTPUT_DIR, num_threads=None,
+                                num_decoders=2, num_writers=2, queue_size=32, save_debug=True):
+    """
+    Parallel version of process_all_images.
+
+    decode threads → bounded queue → saliency threads (one detector each) → bounded
+    queue → writer threads. OpenCV releases the GIL in imread, computeSaliency and
+    imwrite, so the stages run truly in parallel; the bounded queues keep memory flat
+    on large folders. With save_debug=False only the segment PNG is written (no
+    saliency/mask images).
+    """
+    num_threads = num_threads or os.cpu_count() or 1
+    os.makedirs(output_dir, exist_ok=True)
+    filenames = [f for f in os.listdir(input_dir) if f.lower().endswith(VALID_EXTENSIONS)]
+
+    names = queue.Queue()
+    for filename in filenames:
+        names.put(filename)
+    decoded = queue.Queue(maxsize=queue_size)
+    to_write = queue.Queue(maxsize=queue_size)
+    counts = {"processed": 0, "failed": 0, "write_failed": 0}
+    lock = threading.Lock()
+
+    # image-level parallelism; avoid oversubscribing cores with OpenCV's own threads
+    cv_threads = cv2.getNumThreads()
+    cv2.setNumThreads(1)
+
+    def decode():
+        while True:
+            try:
+                filename = names.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                img = cv2.imread(os.path.join(input_dir, filename))
+            except Exception as e:
+                print(f"Error reading {filename}: {e}")
+                img = None
+            if img is None:
+                print(f"Skipping unreadable file: {filename}")
+                continue
+            decoded.put((filename, img))
+
+    def extract():
+        while True:
+            item = decoded.get()
+            if item is None:
+                return
+            filename, img = item
+            try:
+                result = extract_salient_region(img)
+            except Exception as e:
+                print(f"Error processing {filename}: {e}")
+                with lock:
+                    counts["failed"] += 1
+                continue
+            base = os.path.splitext(filename)[0]
+            if result is None:
+                print(f"No salient region for {filename}")
+                continue
+            saliency_map, mask, cropped = result
+            if save_debug:
+                to_write.put((os.path.join(output_dir, f"{base}_saliency.png"), saliency_map))
+                to_write.put((os.path.join(output_dir, f"{base}_mask.png"), mask))
+            to_write.put((os.path.join(output_dir, f"{base}_segment.png"), cropped))
+            with lock:
+                counts["processed"] += 1
+
+    def write():
+        while True:
+            item = to_write.get()
+            if item is None:
+                return
+            path, image = item
+            try:
+                if not cv2.imwrite(path, image):
+                    raise IOError("cv2.imwrite returned False")
+            except Exception as e:
+                # keep draining: a stalled writer would block the saliency threads on the full queue
+                print(f"Error writing {path}: {e}")
+                with lock:
+                    counts["write_failed"] += 1
+
+    start = time.perf_counter()
+    decoders, extractors, writers = [], [], []
+    try:
+        decoders = _run_stage(decode, num_decoders, "decode")
+        extractors = _run_stage(extract, num_threads, "saliency")
+        writers = _run_stage(write, num_writers, "write")
+
+        for t in decoders:
+            t.join()
+    finally:
+        # the downstream stages are always told to stop and drained, even if a stage raised
+        try:
+            for _ in extractors:
+                decoded.put(None)
+            for t in extractors:
+                t.join()
+        finally:
+            for _ in writers:
+                to_write.put(None)
+            for t in writers:
+                t.join()
+            cv2.setNumThreads(cv_threads)
+
+    elapsed = time.perf_counter() - start
+    print(f"Processed {counts['processed']} of {len(filenames)} images in {elapsed:.1f}s "
+          f"({num_threads} threads, {counts['failed']} failed, {counts['write_failed']} writes failed)")
+    return counts
+
+
 if __name__ == "__main__":
-    process_all_images()
+    process_all_images_parallel()
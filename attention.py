@@ -3,7 +3,9 @@ import cv2
 import torch
 import numpy as np
 from segment_anything import sam_model_registry, SamAutomaticMaskGenerator
+from segment_anything.modeling.image_encoder import add_decomposed_rel_pos
 from segment_anything.utils.transforms import ResizeLongestSide
+from segement.mask_scoring import rank_masks
 
 # -------------------
 # CONFIG
@@ -33,38 +35,85 @@ transform = ResizeLongestSide(sam.image_encoder.img_size)
 # -------------------
 # ATTENTION MAP FUNC
 # -------------------
-def get_attention_map(sam_model, image_np, layer=-1, head=0):
-
-    img_resized = transform.apply_image(image_np)
-    img_tensor = torch.as_tensor(img_resized).permute(2,0,1).contiguous().float()[None] / 255
-    img_tensor = sam_model.preprocess(img_tensor).to(device)
-
-    features = {}
-
-    def hook_fn(module, inp, out):
-        # out is (B, heads, tokens, tokens)
-        features["attn"] = out[1]
-
+def register_attention_hook(sam_model, features, layer=-1, head=0):
+    """
+    Hook a global-attention block of the SAM image encoder.
+
+    SAM's Attention module never exposes its softmax weights, so the hook takes the
+    tokens entering the block's attention and recomputes q·k for the selected head
+    only (cheap next to the full encoder). The map stored in features["attn"] is the
+    mean attention every patch receives, on the encoder's 64x64 token grid.
+    Only the first forward is kept, i.e. the full-image crop of the mask generator.
+    """
     if layer == -1:
         layer_idx = len(sam_model.image_encoder.blocks) - 1
     else:
         layer_idx = layer
 
-    h = sam_model.image_encoder.blocks[layer_idx].attn.attn_drop.register_forward_hook(hook_fn)
+    block = sam_model.image_encoder.blocks[layer_idx]
+    if block.window_size > 0:
+        raise ValueError(f"Block {layer_idx} uses windowed attention; pick a global attention block")
+
+    def hook_fn(module, inp, out):
+        if "attn" in features:
+            return
+        x = inp[0]                                                  # (B, H, W, C)
+        B, H, W, _ = x.shape
+        qkv = module.qkv(x[:1]).reshape(1, H * W, 3, module.num_heads, -1).permute(2, 0, 3, 1, 4)
+        q, k = qkv[0, :, head], qkv[1, :, head]                     # (1, tokens, C)
+
+        attn = (q * module.scale) @ k.transpose(-2, -1)
+        if module.use_rel_pos:
+            attn = add_decomposed_rel_pos(attn, q, module.rel_pos_h, module.rel_pos_w, (H, W), (H, W))
+        attn = attn.softmax(dim=-1)[0]                              # (tokens, tokens)
+
+        features["attn"] = attn.mean(dim=0).reshape(H, W).float().cpu().numpy()
+
+    return block.attn.register_forward_hook(hook_fn)
+
+
+def crop_attention_map(sam_model, attn_map, image_shape):
+    """Drop the token rows/cols that only cover the encoder's zero padding."""
+    H, W = image_shape[:2]
+    new_h, new_w = ResizeLongestSide.get_preprocess_shape(H, W, sam_model.image_encoder.img_size)
+    patch = sam_model.image_encoder.img_size // attn_map.shape[0]
+    return attn_map[:int(np.ceil(new_h / patch)), :int(np.ceil(new_w / patch))]
+
+
+def get_attention_map(sam_model, image_np, layer=-1, head=0):
+    """Run the image encoder once just to capture the attention map."""
+
+    img_resized = transform.apply_image(image_np)
+    img_tensor = torch.as_tensor(img_resized).permute(2,0,1).contiguous().float()[None]
+    img_tensor = sam_model.preprocess(img_tensor.to(device))
+
+    features = {}
+    h = register_attention_hook(sam_model, features, layer, head)
 
     with torch.no_grad():
         sam_model.image_encoder(img_tensor)
 
     h.remove()
 
-    attn = features["attn"][0]               # (heads, tokens, tokens)
-    attn = attn[head]                        # (tokens, tokens)
-    attn = attn[0, 1:]                       # CLS → patches
+    return crop_attention_map(sam_model, features["attn"], image_np.shape)
+
 
-    side = int(np.sqrt(attn.shape[0]))
-    attn_map = attn.reshape(side, side).cpu().numpy()
+def generate_with_attention(mask_generator, image_np, layer=-1, head=0):
+    """
+    Generate SAM masks and capture the attention map from the same encoder forward.
+
+    Returns:
+        (masks, attn_map): the generator's masks and the attention map on the token grid.
+    """
+    sam_model = mask_generator.predictor.model
+    features = {}
+    h = register_attention_hook(sam_model, features, layer, head)
+    try:
+        masks = mask_generator.generate(image_np)
+    finally:
+        h.remove()
 
-    return attn_map
+    return masks, crop_attention_map(sam_model, features["attn"], image_np.shape)
 
 
 
@@ -90,26 +139,15 @@ for filename in os.listdir(input_folder):
     H,W = image.shape[:2]
 
 
-    # --- SAM masks ---
-    masks = mask_generator.generate(image_rgb)
-
-
-    # --- attention ---
-    attn_map = get_attention_map(sam, image_rgb)
+    # --- SAM masks + attention (single encoder pass) ---
+    masks, attn_map = generate_with_attention(mask_generator, image_rgb)
 
     attn_map = cv2.resize(attn_map, (W,H))
     attn_map = (attn_map - attn_map.min())/(attn_map.max()-attn_map.min())
 
 
-    # --- score masks ---
-    scored=[]
-    for m in masks:
-        msk = m["segmentation"]
-        score = attn_map[msk].mean() * m["area"]
-        scored.append((score,m))
-
-    scored.sort(key=lambda x:x[0], reverse=True)
-    top = [m for _,m in scored[:N]]
+    # --- score masks (vectorized) ---
+    top = [m for _,m in rank_masks(masks, attn_map, N)]
 
     base = os.path.splitext(filename)[0]
 
@@ -220,25 +220,49 @@ class VisionTransformer(nn.Module):
         self.ln_post = LayerNorm(width)
         self.proj = nn.Parameter(scale * torch.randn(width, output_dim))
 
-    def forward(self, x: torch.Tensor):
+    def positional_embedding_for(self, grid: Tuple[int, int]):
+        """Positional embedding for a grid of patches, bicubically interpolated when it is not the trained grid."""
+        trained = int((self.positional_embedding.shape[0] - 1) ** 0.5)
+        if tuple(grid) == (trained, trained):
+            return self.positional_embedding
+        patch_embedding = self.positional_embedding[1:].float().reshape(1, trained, trained, -1).permute(0, 3, 1, 2)
+        patch_embedding = F.interpolate(patch_embedding, size=tuple(grid), mode="bicubic", align_corners=False)
+        patch_embedding = patch_embedding.permute(0, 2, 3, 1).reshape(grid[0] * grid[1], -1)
+        return torch.cat([self.positional_embedding[:1], patch_embedding.to(self.positional_embedding.dtype)])
+
+    def tokens(self, x: torch.Tensor):
         x = self.conv1(x)  # shape = [*, width, grid, grid]
+        grid = x.shape[-2:]  # smaller than the trained grid for inputs below input_resolution
         x = x.reshape(x.shape[0], x.shape[1], -1)  # shape = [*, width, grid ** 2]
         x = x.permute(0, 2, 1)  # shape = [*, grid ** 2, width]
         x = torch.cat([self.class_embedding.to(x.dtype) + torch.zeros(x.shape[0], 1, x.shape[-1], dtype=x.dtype, device=x.device), x], dim=1)  # shape = [*, grid ** 2 + 1, width]
-        x = x + self.positional_embedding.to(x.dtype)
+        x = x + self.positional_embedding_for(grid).to(x.dtype)
         x = self.ln_pre(x)
 
         x = x.permute(1, 0, 2)  # NLD -> LND
         x = self.transformer(x)
         x = x.permute(1, 0, 2)  # LND -> NLD
+        return x
 
-        x = self.ln_post(x[:, 0, :])
+    def forward(self, x: torch.Tensor):
+        x = self.ln_post(self.tokens(x)[:, 0, :])
 
         if self.proj is not None:
             x = x @ self.proj
 
         return x
 
+    def forward_patches(self, x: torch.Tensor):
+        """Class token and patch tokens, all through ln_post/proj: ([*, output_dim], [*, grid_h, grid_w, output_dim])."""
+        patch_size = self.conv1.kernel_size[0]
+        grid = (x.shape[-2] // patch_size, x.shape[-1] // patch_size)
+        x = self.ln_post(self.tokens(x))
+
+        if self.proj is not None:
+            x = x @ self.proj
+
+        return x[:, 0, :], x[:, 1:, :].reshape(x.shape[0], *grid, x.shape[-1])
+
 
 class CLIP(nn.Module):
     def __init__(self,
@@ -340,6 +364,11 @@ class CLIP(nn.Module):
     def encode_image(self, image):
         return self.visual(image.type(self.dtype))
 
+    def encode_image_patches(self, image):
+        if not isinstance(self.visual, VisionTransformer):
+            raise NotImplementedError("patch features are only available for ViT image encoders")
+        return self.visual.forward_patches(image.type(self.dtype))
+
     def encode_text(self, text):
         x = self.token_embedding(text).type(self.dtype)  # [batch_size, n_ctx, d_model]
 
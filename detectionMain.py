@@ -3,6 +3,7 @@ import cv2
 import torch
 import numpy as np
 from segment_anything import sam_model_registry, SamAutomaticMaskGenerator
+from segement.mask_scoring import rank_masks
 
 # -------------------
 # CONFIG
@@ -69,18 +70,10 @@ for filename in os.listdir(input_folder):
         saliency = np.ones(image.shape[:2], dtype=np.float32)
     saliency = cv2.normalize(saliency, None, 0, 1, cv2.NORM_MINMAX)
 
-    # Score masks
-    scored = []
-    for m in masks:
-        mask = m["segmentation"]
-        score = saliency[mask].mean() * m["area"]
-        scored.append((score, mask))
+    # Score masks (vectorized) and keep top N
+    top = [(score, m["segmentation"]) for score, m in rank_masks(masks, saliency, N)]
     del masks
 
-    # Sort and keep top N
-    scored.sort(key=lambda x: x[0], reverse=True)
-    top = scored[:N]
-
     base = os.path.splitext(filename)[0]
 
     for i, (_, mask) in enumerate(top):
@@ -105,7 +98,6 @@ for filename in os.listdir(input_folder):
         del mask
 
     # Free memory
-    del scored
     del top
     del image
     del image_rgb
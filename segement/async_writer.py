@@ -0,0 +1,97 @@
+import time
+import queue
+import threading
+import cv2
+
+
+class AsyncImageWriter:
+    """
+    Bounded background writer for RGB crops.
+
+    PNG encoding and the file write run on a small thread pool (cv2.imwrite releases
+    the GIL), so the thread driving SAM only pays for a queue put. When the queue is
+    full, submit() blocks; that time is accumulated in blocked_seconds so a slow disk
+    shows up in the run report instead of silently stalling compute.
+
+    Paths stay pending until their write has finished (or failed); wait() blocks on
+    specific paths, e.g. before reusing crops that may still be in the queue.
+
+    Usage:
+        writer = AsyncImageWriter()
+        writer.submit(path, crop_rgb)
+        writer.wait([path])      # the file is complete (if it could be written)
+        stats = writer.close()   # flushes everything still queued
+    """
+
+    def __init__(self, num_threads: int = 2, queue_size: int = 64, png_compression: int = 3):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.params = [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+        self.blocked_seconds = 0.0
+        self.submitted = 0
+        self.failed = 0
+        self.failed_paths = []
+        self._lock = threading.Lock()
+        self._pending = {}  # path -> number of queued writes
+        self._written = threading.Condition(self._lock)
+        self._threads = [threading.Thread(target=self._work, name=f"crop-writer-{i}", daemon=True)
+                         for i in range(num_threads)]
+        for t in self._threads:
+            t.start()
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            path, image_rgb = item
+            try:
+                if not cv2.imwrite(path, cv2.cvtColor(image_rgb, cv2.COLOR_RGB2BGR), self.params):
+                    raise IOError("cv2.imwrite returned False")
+            except Exception as e:
+                print(f"⚠️ Failed to save {path}: {e}")
+                with self._lock:
+                    self.failed += 1
+                    self.failed_paths.append(path)
+            finally:
+                with self._written:
+                    self._pending[path] -= 1
+                    if not self._pending[path]:
+                        del self._pending[path]
+                    self._written.notify_all()
+
+    def submit(self, path: str, image_rgb):
+        """Queue an RGB image for writing; blocks only while the queue is full."""
+        with self._lock:
+            self._pending[path] = self._pending.get(path, 0) + 1
+        start = time.perf_counter()
+        self.queue.put((path, image_rgb))
+        self.blocked_seconds += time.perf_counter() - start
+        self.submitted += 1
+
+    def wait(self, paths):
+        """Block until none of the given paths has a queued or in-progress write."""
+        with self._written:
+            self._written.wait_for(lambda: not any(path in self._pending for path in paths))
+
+    def close(self) -> dict:
+        """
+        Flush the queue, stop the threads and return the writer statistics.
+
+        failed_paths lists the crops that could not be written, so callers can drop them
+        from their records (see object_extract.drop_unwritten_segments).
+        """
+        start = time.perf_counter()
+        for _ in self._threads:
+            self.queue.put(None)
+        for t in self._threads:
+            t.join()
+        stats = {
+            "written": self.submitted - self.failed,
+            "failed": self.failed,
+            "failed_paths": list(self.failed_paths),
+            "blocked_seconds": round(self.blocked_seconds, 3),
+            "flush_seconds": round(time.perf_counter() - start, 3),
+        }
+        print(f"💾 Writer: {stats['written']} crops ({stats['failed']} failed), "
+              f"{stats['blocked_seconds']:.2f}s blocked on the queue, {stats['flush_seconds']:.2f}s final flush")
+        return stats
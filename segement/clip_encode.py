@@ -0,0 +1,241 @@
+import re
+import time
+import torch
+from PIL import Image
+from torch.utils.data import Dataset, DataLoader
+from clip.clip import _transform
+from .embedding_cache import EmbeddingCache, cache_name, content_key, encode_with_cache
+
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_NUM_WORKERS = 2
+RESOLUTION_BUCKETS = (96, 128, 160, 224)  # multiples of the ViT-B/32 patch size
+
+
+class ImageFileDataset(Dataset):
+    """Image files decoded and preprocessed on demand (in DataLoader worker processes)."""
+
+    def __init__(self, paths: list, preprocess):
+        self.paths = list(paths)
+        self.preprocess = preprocess
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        with Image.open(self.paths[index]) as image:
+            return self.preprocess(image)
+
+
+def encode_images(paths: list, model, preprocess, device, batch_size: int = DEFAULT_BATCH_SIZE,
+                  num_workers: int = DEFAULT_NUM_WORKERS) -> torch.Tensor:
+    """
+    Encode image files with CLIP in batches while worker processes decode and preprocess ahead.
+
+    Args:
+        paths (list): Image file paths.
+        model: CLIP model.
+        preprocess: CLIP preprocess transform.
+        device: Device of the model.
+        batch_size (int): Images per encode_image call.
+        num_workers (int): DataLoader workers for decoding + preprocessing (0 = main thread).
+
+    Returns:
+        torch.Tensor: (N, D) L2-normalized image features, in the order of paths.
+    """
+    if not paths:
+        return torch.empty(0, model.visual.output_dim, device=device)
+
+    loader = DataLoader(
+        ImageFileDataset(paths, preprocess),
+        batch_size=batch_size,
+        num_workers=num_workers,
+        pin_memory=str(device).startswith("cuda"),
+        prefetch_factor=2 if num_workers > 0 else None,
+    )
+    features = []
+    with torch.no_grad():
+        for batch in loader:
+            batch_features = model.encode_image(batch.to(device, non_blocking=True))
+            batch_features /= batch_features.norm(dim=-1, keepdim=True)
+            features.append(batch_features)
+    return torch.cat(features)
+
+
+def resolution_bucket(size: tuple, buckets: tuple = RESOLUTION_BUCKETS) -> int:
+    """
+    Encoding resolution for a crop of size (width, height): the smallest bucket covering
+    its shorter side (the side _transform resizes to the model resolution), else the largest.
+    """
+    shorter = min(size)
+    return next((n_px for n_px in sorted(buckets) if n_px >= shorter), max(buckets))
+
+
+def encode_images_adaptive(paths: list, model, device, batch_size: int = DEFAULT_BATCH_SIZE,
+                           num_workers: int = DEFAULT_NUM_WORKERS, buckets: tuple = RESOLUTION_BUCKETS) -> torch.Tensor:
+    """
+    Like encode_images, but small crops are encoded at a smaller resolution instead of
+    being upsampled to the model's input_resolution.
+
+    Crops are grouped by resolution_bucket and each group is batched separately; the
+    ViT interpolates its positional embedding to the smaller patch grid, so a 96 px crop
+    costs a 3 × 3 grid instead of 7 × 7 (ViT-B/32).
+
+    Returns:
+        torch.Tensor: (N, D) L2-normalized image features, in the order of paths.
+    """
+    patch_size = model.visual.conv1.kernel_size[0]
+    buckets = tuple(n_px for n_px in buckets if n_px <= model.visual.input_resolution) or (model.visual.input_resolution,)
+    if any(n_px % patch_size for n_px in buckets):
+        raise ValueError(f"resolution buckets {buckets} must be multiples of the patch size {patch_size}")
+    if not paths:
+        return torch.empty(0, model.visual.output_dim, device=device)
+
+    groups = {}
+    for index, path in enumerate(paths):
+        with Image.open(path) as image:
+            groups.setdefault(resolution_bucket(image.size, buckets), []).append(index)
+
+    features = [None] * len(paths)
+    for n_px, indices in sorted(groups.items()):
+        encoded = encode_images([paths[i] for i in indices], model, _transform(n_px), device, batch_size, num_workers)
+        for index, feature in zip(indices, encoded):
+            features[index] = feature
+    return torch.stack(features)
+
+
+def preprocess_signature(preprocess) -> str:
+    """Short stable hash of a preprocess pipeline (resolution, crop, normalization)."""
+    description = re.sub(r" at 0x[0-9a-fA-F]+", "", repr(preprocess))  # drop object addresses
+    return content_key(description)[:12]
+
+
+def open_image_cache(cache_dir: str, model_name: str, preprocess, resolution_buckets: tuple = None) -> EmbeddingCache:
+    """Image-embedding cache for one CLIP model and preprocess configuration (and resolution buckets)."""
+    signature = preprocess_signature(preprocess)
+    if resolution_buckets:
+        signature += "-px" + "-".join(str(n_px) for n_px in sorted(resolution_buckets))
+    return EmbeddingCache(cache_dir, cache_name("image", f"{model_name}-{signature}"))
+
+
+def file_key(path: str) -> str:
+    """Content hash of a crop file (renamed or re-run crops with identical bytes hit the cache)."""
+    with open(path, "rb") as f:
+        return content_key(f.read())
+
+
+def encode_images_cached(paths: list, model, preprocess, device, cache: EmbeddingCache,
+                         batch_size: int = DEFAULT_BATCH_SIZE, num_workers: int = DEFAULT_NUM_WORKERS,
+                         save: bool = True, resolution_buckets: tuple = None) -> torch.Tensor:
+    """
+    Like encode_images, but only crops missing from the cache (open_image_cache) are encoded.
+
+    With save=False, new vectors stay staged until cache.save() (one write per book
+    instead of one per main image). With resolution_buckets, misses are encoded with
+    encode_images_adaptive (the cache must then be opened with the same buckets).
+    """
+    if not paths:
+        return torch.empty(0, model.visual.output_dim, device=device, dtype=model.dtype)
+
+    def encode(indices):
+        if resolution_buckets:
+            features = encode_images_adaptive([paths[i] for i in indices], model, device, batch_size, num_workers,
+                                              resolution_buckets)
+        else:
+            features = encode_images([paths[i] for i in indices], model, preprocess, device, batch_size, num_workers)
+        return features.float().cpu().numpy()
+
+    features = encode_with_cache(cache, [file_key(p) for p in paths], encode, save=save)
+    return torch.from_numpy(features).to(device=device, dtype=model.dtype)
+
+
+def benchmark_batch_sizes(paths: list, model, preprocess, device="cpu", batch_sizes=(1, 16, 64),
+                          num_workers: int = DEFAULT_NUM_WORKERS) -> dict:
+    """
+    Compare CLIP image-encoding throughput for several batch sizes.
+
+    Returns:
+        dict: {batch_size: images_per_second}
+    """
+    results = {}
+    for batch_size in batch_sizes:
+        start = time.perf_counter()
+        encode_images(paths, model, preprocess, device, batch_size, num_workers)
+        elapsed = time.perf_counter() - start
+        results[batch_size] = len(paths) / elapsed if elapsed > 0 else 0.0
+
+    baseline = results.get(batch_sizes[0])
+    print(f"\n📊 CLIP image encoding on {device} ({len(paths)} images, {num_workers} loader workers)")
+    for batch_size, images_per_second in results.items():
+        speedup = f" ({images_per_second / baseline:.2f}x)" if baseline else ""
+        print(f"   batch {batch_size:>3}: {images_per_second:.1f} images/s{speedup}")
+    return results
+
+
+def benchmark_resolutions(paths: list, model, preprocess, device="cpu", text_features: torch.Tensor = None,
+                          buckets: tuple = RESOLUTION_BUCKETS, batch_size: int = DEFAULT_BATCH_SIZE,
+                          num_workers: int = DEFAULT_NUM_WORKERS) -> dict:
+    """
+    Accuracy/speed trade-off of resolution-adaptive encoding against the fixed resolution.
+
+    Accuracy is the cosine similarity between the adaptive and the fixed-resolution
+    feature of each crop and, with text_features (e.g. a book's paragraphs), the share
+    of crops whose best paragraph stays the same.
+
+    Returns:
+        dict: images/s of both modes, speedup, crops per bucket, mean/min cosine and top-1 agreement.
+    """
+    start = time.perf_counter()
+    fixed = encode_images(paths, model, preprocess, device, batch_size, num_workers).float()
+    fixed_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    adaptive = encode_images_adaptive(paths, model, device, batch_size, num_workers, buckets).float()
+    adaptive_seconds = time.perf_counter() - start
+
+    bucket_counts = {}
+    for path in paths:
+        with Image.open(path) as image:
+            n_px = resolution_bucket(image.size, buckets)
+            bucket_counts[n_px] = bucket_counts.get(n_px, 0) + 1
+
+    cosine = (fixed * adaptive).sum(dim=-1)
+    results = {
+        "images": len(paths),
+        "buckets": dict(sorted(bucket_counts.items())),
+        "fixed_images_per_second": round(len(paths) / fixed_seconds, 1) if fixed_seconds > 0 else 0.0,
+        "adaptive_images_per_second": round(len(paths) / adaptive_seconds, 1) if adaptive_seconds > 0 else 0.0,
+        "speedup": round(fixed_seconds / adaptive_seconds, 2) if adaptive_seconds > 0 else None,
+        "mean_cosine": round(float(cosine.mean()), 4),
+        "min_cosine": round(float(cosine.min()), 4),
+    }
+    if text_features is not None:
+        text_features = text_features.float().to(fixed.device)
+        same = (fixed @ text_features.T).argmax(dim=1) == (adaptive @ text_features.T).argmax(dim=1)
+        results["top1_agreement"] = round(float(same.float().mean()), 4)
+
+    print(f"\n📊 Resolution-adaptive CLIP encoding on {device} ({len(paths)} crops, buckets {results['buckets']})")
+    print(f"   fixed {model.visual.input_resolution}px: {results['fixed_images_per_second']} images/s, "
+          f"adaptive: {results['adaptive_images_per_second']} images/s ({results['speedup']}x)")
+    print(f"   cosine to fixed features: mean {results['mean_cosine']}, min {results['min_cosine']}"
+          + (f", best paragraph unchanged for {results['top1_agreement']:.1%}" if text_features is not None else ""))
+    return results
+
+
+# ------------------------------
+# Example usage
+# ------------------------------
+if __name__ == "__main__":
+    import clip
+    from glob import glob
+
+    dir = "/home/melahi/code/image/segment-anything/documents/"
+    model, preprocess = clip.load("ViT-B/32", device="cpu")
+    crops = sorted(glob(dir + "segmented_objects/*.png"))
+    benchmark_batch_sizes(crops, model, preprocess, device="cpu", batch_sizes=(1, 16, 64))
+
+    # accuracy/speed of resolution-adaptive encoding on the test PDF's crops and paragraphs
+    from .main import encode_paragraph_texts, load_paragraphs
+    book = "book_Bruggen_Israels_Machtelt_Piero_del"
+    paragraphs = load_paragraphs(dir + f"output/{book}.json")
+    text_features = encode_paragraph_texts([p[3] for p in paragraphs], model, "cpu")
+    benchmark_resolutions(sorted(glob(dir + f"segmented_objects/*{book}*.png")), model, preprocess, device="cpu",
+                          text_features=text_features)
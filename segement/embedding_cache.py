@@ -0,0 +1,108 @@
+import os
+import re
+import json
+import hashlib
+import numpy as np
+
+
+def content_key(data) -> str:
+    """sha1 hex digest of a string (UTF-8) or bytes."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha1(data).hexdigest()
+
+
+def cache_name(kind: str, model_name: str) -> str:
+    """File-system safe cache name per embedding kind and model, e.g. 'text_ViT-B-32'."""
+    return f"{kind}_{re.sub(r'[^A-Za-z0-9]+', '-', model_name).strip('-')}"
+
+
+class EmbeddingCache:
+    """
+    Persistent embedding store: float16 rows in <name>.npy (memory-mapped when loaded)
+    plus a JSON index {key: row} in <name>.json.
+
+    New rows are kept in memory until save(); vectors come back as float32. Embeddings
+    are always served from the float16 copy, so a first run and a cached rerun rank
+    with exactly the same values.
+    """
+
+    def __init__(self, cache_dir: str, name: str):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.vectors_path = os.path.join(cache_dir, f"{name}.npy")
+        self.index_path = os.path.join(cache_dir, f"{name}.json")
+        self.index = {}
+        self.vectors = None
+        if os.path.exists(self.vectors_path) and os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                self.index = json.load(f)
+            self.vectors = np.load(self.vectors_path, mmap_mode="r")
+        self._pending = {}
+
+    def __len__(self):
+        return len(self.index) + len(self._pending)
+
+    def __contains__(self, key: str):
+        return key in self.index or key in self._pending
+
+    def get(self, keys: list) -> np.ndarray:
+        """Vectors of the given (present) keys as a float32 (N, D) array."""
+        rows = [self.vectors[self.index[k]] if k in self.index else self._pending[k] for k in keys]
+        return np.asarray(rows, dtype=np.float32)
+
+    def add(self, keys: list, vectors: np.ndarray):
+        """Stage new vectors (written on save)."""
+        for key, vector in zip(keys, np.asarray(vectors, dtype=np.float16)):
+            if key not in self:
+                self._pending[key] = vector
+
+    def save(self):
+        """Write staged vectors to disk (atomically replacing the previous files)."""
+        if not self._pending:
+            return
+        new = np.stack(list(self._pending.values()))
+        vectors = new if self.vectors is None else np.concatenate([np.asarray(self.vectors), new])
+        offset = len(self.index)
+        index = dict(self.index)
+        index.update({key: offset + i for i, key in enumerate(self._pending)})
+
+        tmp_vectors, tmp_index = self.vectors_path + ".tmp.npy", self.index_path + ".tmp"
+        np.save(tmp_vectors, vectors)
+        with open(tmp_index, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        self.vectors = None  # release the old memory map before replacing the file
+        os.replace(tmp_vectors, self.vectors_path)
+        os.replace(tmp_index, self.index_path)
+
+        self.index = index
+        self.vectors = np.load(self.vectors_path, mmap_mode="r")
+        self._pending = {}
+        print(f"🗄️ Embedding cache {os.path.basename(self.vectors_path)}: {len(self.index)} vectors")
+
+
+def encode_with_cache(cache: EmbeddingCache, keys: list, encode_fn, save: bool = True) -> np.ndarray:
+    """
+    Return the embeddings of all keys, calling encode_fn only for the cache misses.
+
+    Args:
+        cache (EmbeddingCache): Cache to read from and add to.
+        keys (list): One key per item.
+        encode_fn: Called with the list of item indices to encode; returns an (n, D) array.
+        save (bool): Write new vectors right away; with False the caller saves once at the end.
+
+    Returns:
+        np.ndarray: float32 (len(keys), D) embeddings.
+    """
+    missing, seen, hits = [], set(), 0
+    for i, key in enumerate(keys):
+        if key in cache:
+            hits += 1
+        elif key not in seen:
+            missing.append(i)
+            seen.add(key)
+    if missing:
+        cache.add([keys[i] for i in missing], encode_fn(missing))
+        if save:
+            cache.save()
+    print(f"   🗄️ {hits}/{len(keys)} embeddings from cache, {len(missing)} encoded")
+    return cache.get(keys)
@@ -1,4 +1,5 @@
 import os
+import re
 import glob
 from collections import defaultdict
 
@@ -47,6 +48,23 @@ def find_subimages_for_images(main_images, subimage_folder):
     return dict(mapping)
 
 
+def parse_image_name(image_path):
+    """
+    Split an extracted image or segment filename into (book, page, image number).
+
+    Example:
+        'input_book_X_page10_img2.jpeg' or 'book_X_page10_img2_object_003.png' → ('book_X', 10, 2)
+
+    Returns:
+        tuple[str, int, int] | None: None if the name does not follow the pattern.
+    """
+    name = os.path.basename(image_path)
+    match = re.match(r"(?:input_)?(.+)_page(\d+)_img(\d+)", name)
+    if not match:
+        return None
+    return match.group(1), int(match.group(2)), int(match.group(3))
+
+
 # Example usage:
 if __name__ == "__main__":
     main_folder = "/home/melahi/code/image/segment/documents/output/"
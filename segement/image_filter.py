@@ -0,0 +1,64 @@
+import cv2
+import numpy as np
+
+# Images below these limits are not worth a full SAM grid
+MIN_SIDE = 128
+MIN_COLOR_STD = 6.0
+MIN_EDGE_DENSITY = 0.005
+ANALYSIS_SIDE = 256
+
+
+def downscale_for_analysis(image: np.ndarray, side: int = ANALYSIS_SIDE) -> np.ndarray:
+    """Shrink an image so its longest side is at most `side` pixels (for cheap statistics)."""
+    h, w = image.shape[:2]
+    scale = side / max(h, w)
+    if scale >= 1:
+        return image
+    return cv2.resize(image, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+
+
+def edge_density(image: np.ndarray) -> float:
+    """Fraction of Canny edge pixels of an RGB image."""
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    edges = cv2.Canny(gray, 50, 150)
+    return np.count_nonzero(edges) / edges.size
+
+
+def classify_trivial_image(image: np.ndarray,
+                           min_side: int = MIN_SIDE,
+                           min_color_std: float = MIN_COLOR_STD,
+                           min_edge_density: float = MIN_EDGE_DENSITY):
+    """
+    Cheap pre-classifier for images that SAM would only split into one or two masks.
+
+    Checks, in order: pixel dimensions, colour variance and Canny edge density
+    (the last two on a copy downscaled to ANALYSIS_SIDE, so the cost is negligible).
+
+    Args:
+        image (np.ndarray): RGB image.
+
+    Returns:
+        str | None: 'small', 'uniform' or 'few_edges' if the image is trivial, else None.
+    """
+    h, w = image.shape[:2]
+    if min(h, w) < min_side:
+        return "small"
+
+    image = downscale_for_analysis(image)
+    if image.reshape(-1, image.shape[-1]).std(axis=0).max() < min_color_std:
+        return "uniform"
+
+    if edge_density(image) < min_edge_density:
+        return "few_edges"
+
+    return None
+
+
+def whole_image_mask(image: np.ndarray) -> list:
+    """A single SAM-style mask record covering the whole image."""
+    h, w = image.shape[:2]
+    return [{
+        "segmentation": np.ones((h, w), dtype=bool),
+        "area": h * w,
+        "bbox": [0, 0, w - 1, h - 1],
+    }]
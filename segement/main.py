@@ -1,4 +1,5 @@
 import torch
+import numpy as np
 from PIL import Image
 import clip
 import json
@@ -8,7 +9,7 @@ from typing import Dict, Tuple
 import re
 from typing import List
 import spacy
-from .find_best_paragraphs import find_best_paragraphs, save_results, load_json, print_results
+from .find_best_paragraphs import find_best_paragraphs, save_results, print_results
 from .aggregate_most_fre_para import find_most_frequent_paragraphs
 from arch.highlight_para_1 import highlight_paragraphs
 from arch.highlight_image import extract_page_and_image,highlight_image
@@ -18,6 +19,15 @@ from .paragraph import is_valid_paragraph
 from .marge_json import  add_rects_to_image_json
 import os
 from .object_extract import process_folder
+from .clip_encode import (DEFAULT_BATCH_SIZE, DEFAULT_NUM_WORKERS, encode_images, encode_images_adaptive,
+                          encode_images_cached, open_image_cache)
+from .embedding_cache import EmbeddingCache, cache_name, content_key, encode_with_cache
+from .ranking import rank_paragraphs
+from .match_matrix import match_book, match_book_blocked, match_book_windowed
+from .patch_pooling import encode_segments_pooled
+
+CLIP_MODEL_NAME = "ViT-B/32"
+TEXT_BATCH_SIZE = 256  # paragraphs per encode_text call
 
 nlp = spacy.load("en_core_web_sm")
 
@@ -43,7 +53,7 @@ def clean_text(text):
 
 def load_clip_model(device="cuda"):
     """Load CLIP model + preprocess function"""
-    model, preprocess = clip.load("ViT-B/32", device=device)
+    model, preprocess = clip.load(CLIP_MODEL_NAME, device=device)
     return model, preprocess
 
 def get_image_files(image_directory, valid_extensions):
@@ -65,6 +75,33 @@ def tokenize_with_truncate(texts, device):
 
 
 
+def encode_paragraph_texts(cleaned_texts, model, device, cache_dir=None):
+    """
+    L2-normalized CLIP text features of the cleaned paragraphs, in TEXT_BATCH_SIZE chunks.
+
+    With cache_dir, features are kept in a persistent cache keyed by sha1(cleaned text)
+    per CLIP_MODEL_NAME, so reruns and books sharing text skip the text encoder.
+    """
+    def encode(indices):
+        features = []
+        for start in range(0, len(indices), TEXT_BATCH_SIZE):
+            texts = [cleaned_texts[i] for i in indices[start:start + TEXT_BATCH_SIZE]]
+            with torch.no_grad():
+                batch = model.encode_text(tokenize_with_truncate(texts, device))
+                batch /= batch.norm(dim=-1, keepdim=True)
+            features.append(batch.float().cpu().numpy())
+        return np.concatenate(features)
+
+    if not cleaned_texts:
+        return torch.empty(0, model.text_projection.shape[1], device=device, dtype=model.dtype)
+    if cache_dir is None:
+        features = encode(list(range(len(cleaned_texts))))
+    else:
+        cache = EmbeddingCache(cache_dir, cache_name("text", CLIP_MODEL_NAME))
+        features = encode_with_cache(cache, [content_key(t) for t in cleaned_texts], encode)
+    return torch.from_numpy(features).to(device=device, dtype=model.dtype)
+
+
 def list_book_images_by_page(folder_path: str, book_id: str) -> Dict[int, List[Tuple[int, int, str]]]:
     """
     Find and group all segmented images for a given book, organized by page number.
@@ -122,36 +159,46 @@ def find_images_for_book_page(folder_path: str, book_id: str, page_number: int)
 
     return matching_files
 
-def process_images_and_paragraphs(main_img, sub_imgs, segment_dir,paragraphs, model, preprocess, device, output_dir,page_num,book):
-    """Compute image ↔ paragraph similarities and save all results to one JSON file."""
-
-    # Unpack cleaned texts for CLIP
-    cleaned_texts = [p[3] for p in paragraphs]
-    tokenized_texts = tokenize_with_truncate(cleaned_texts, device)
+def process_images_and_paragraphs(main_img, sub_imgs, segment_dir,paragraphs, model, preprocess, device, output_dir,page_num,book,
+                                  batch_size=DEFAULT_BATCH_SIZE, num_workers=DEFAULT_NUM_WORKERS, text_features=None,
+                                  image_cache=None, top_k=None, image_features=None):
+    """
+    Compute image ↔ paragraph similarities and save all results to one JSON file.
+
+    Sub-images are encoded in batches of batch_size while num_workers loader processes
+    decode and preprocess the next ones (see clip_encode.encode_images).
+    text_features: the document's paragraph features (encode_paragraph_texts), computed
+    here only if not given.
+    image_cache: optional EmbeddingCache (clip_encode.open_image_cache); only crops
+    missing from it are encoded. New vectors are staged, the caller saves the cache.
+    top_k: keep only the K best valid paragraphs per sub-image (torch.topk) instead of
+    the full ranking; the best paragraph found downstream is the same.
+    image_features: the sub-images' features when already encoded (main() encodes the whole
+    document with one DataLoader instead of starting loader workers per main image).
+    """
 
-    with torch.no_grad():
-        text_features = model.encode_text(tokenized_texts)
-        text_features /= text_features.norm(dim=-1, keepdim=True)
+    if text_features is None:
+        # Unpack cleaned texts for CLIP
+        text_features = encode_paragraph_texts([p[3] for p in paragraphs], model, device)
 
     global_results = []  # 🧩 collect ALL results here
     all_results = []  # 🧩 store all image results
 
+    if image_features is None:
+        if image_cache is not None:
+            image_features = encode_images_cached(sub_imgs, model, preprocess, device, image_cache, batch_size,
+                                                  num_workers, save=False)
+        else:
+            image_features = encode_images(sub_imgs, model, preprocess, device, batch_size, num_workers)
+    with torch.no_grad():
+        all_sims = image_features @ text_features.T
+
+    # Attach metadata: (page, para_index, original_text, cleaned_text, similarity)
+    all_ranked = rank_paragraphs(all_sims, paragraphs, top_k)
+
     # Print results
-    for fileName in sub_imgs:
+    for fileName, ranked in zip(sub_imgs, all_ranked):
         print(f"\n📷 Processing Image: {fileName}")
-        #file_path = os.path.join(segment_dir, fileName)
-        image = preprocess(Image.open(fileName)).unsqueeze(0).to(device)
-        with torch.no_grad():
-            image_features = model.encode_image(image)
-            image_features /= image_features.norm(dim=-1, keepdim=True)
-            sims = (image_features @ text_features.T).squeeze(0).cpu().numpy()
-
-        # Attach metadata: (page, para_index, original_text, cleaned_text, similarity)
-        ranked = sorted(
-            [(para[0], para[1], para[2], para[3], float(sims[i])) for i, para in enumerate(paragraphs)],
-            key=lambda x: x[4],
-            reverse=True
-        )
 
         # Print top-5
         for page, para_index, orig_text, cleaned_text, score in ranked[:5]:
@@ -159,7 +206,7 @@ def process_images_and_paragraphs(main_img, sub_imgs, segment_dir,paragraphs, mo
             print(f"Similarity: {score:.4f}")
             print(f"Paragraph: {orig_text}\n")
 
-        # Store all results
+        # Store all (or the top-k) results
         all_results.append({
             "Image": fileName,
             "Ranked Paragraphs": [
@@ -178,19 +225,8 @@ def process_images_and_paragraphs(main_img, sub_imgs, segment_dir,paragraphs, mo
 
 
 
-def main(segment_dir,output_dir,prefix,paragraph_json):
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    model, preprocess = load_clip_model(device)
-
-    # read the json files
-    json_path = os.path.join(output_dir, f"{prefix}.json")
-    print(json_path)
-
-    if not os.path.exists(json_path):
-        print(f"❌ JSON file not found: {json_path}")
-        return
-
-    global_results = []  # 🧩 collect ALL results here
+def load_paragraphs(json_path):
+    """Valid paragraphs of a document as (page, para_index, para, cleaned_text) tuples."""
     paragraphs = []
 
     paragraphs_by_page = read_paragraphs_from_json(json_path)
@@ -208,46 +244,167 @@ def main(segment_dir,output_dir,prefix,paragraph_json):
             index=index+1
 
     print(f"✅ Loaded {len(paragraphs)} cleaned paragraphs "+str(index))
+    return paragraphs
+
+
+def main(segment_dir,output_dir,prefix,paragraph_json,batch_size=DEFAULT_BATCH_SIZE,num_workers=DEFAULT_NUM_WORKERS,
+         cache_dir=None,top_k=None):
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model, preprocess = load_clip_model(device)
+
+    # read the json files
+    json_path = os.path.join(output_dir, f"{prefix}.json")
+    print(json_path)
+
+    if not os.path.exists(json_path):
+        print(f"❌ JSON file not found: {json_path}")
+        return
+
+    global_results = []  # 🧩 collect ALL results here
+    paragraphs = load_paragraphs(json_path)
+    page_number = paragraphs[-1][0] if paragraphs else None
+
+    # Encode the paragraphs once for the whole document
+    text_features = encode_paragraph_texts([p[3] for p in paragraphs], model, device, cache_dir)
+    image_cache = open_image_cache(cache_dir, CLIP_MODEL_NAME, preprocess) if cache_dir else None
+
     # Find main images
     main_images = find_images(output_dir, prefix)
 
     # Find subimages corresponding to each main image
     image_to_subimages = find_subimages_for_images(main_images, segment_dir)
 
+    # Encode every sub-image of the document in one pass (one set of DataLoader workers)
+    sub_imgs = [sub_img for subs in image_to_subimages.values() for sub_img in subs]
+    if image_cache is not None:
+        image_features = encode_images_cached(sub_imgs, model, preprocess, device, image_cache, batch_size,
+                                              num_workers, save=False)
+    else:
+        image_features = encode_images(sub_imgs, model, preprocess, device, batch_size, num_workers)
+
     # Print results
+    offset = 0
     for main_img, sub_imgs in image_to_subimages.items():
         print(f"\nMain image: {os.path.basename(main_img)}")
         all_results = process_images_and_paragraphs(main_img, sub_imgs,segment_dir,paragraphs, model, preprocess, device,
-                                                     output_dir, page_number, prefix)
+                                                     output_dir, page_number, prefix, batch_size, num_workers,
+                                                     text_features, image_cache, top_k,
+                                                     image_features[offset:offset + len(sub_imgs)])
+        offset += len(sub_imgs)
         global_results.append({
             "main_image": main_img,
             "Images": all_results
         })
+    if image_cache is not None:
+        image_cache.save()
     return global_results
 
-def find_best(all_similarities_json,best_similarities_json,final_summary_json,final_output_json,
-                     global_results, paragraph_json):
 
-    with open(all_similarities_json, "w", encoding="utf-8") as json_file:
-        json.dump(global_results, json_file, ensure_ascii=False, indent=4)
+def match_document_matrix(segment_dir, output_dir, prefix, batch_size=DEFAULT_BATCH_SIZE,
+                          num_workers=DEFAULT_NUM_WORKERS, cache_dir=None, page_window=None, widen_below=None,
+                          similarity_memory_mb=None, segment_features="crops", resolution_buckets=None):
+    """
+    Whole-document matching: encode every segment of the book, compute one
+    (segments × paragraphs) similarity matrix and pick best matches and majority votes
+    with numpy (match_matrix.match_book).
+
+    With page_window, a segment is only scored against paragraphs within ±page_window
+    pages of its image; with widen_below, segments whose best in-window similarity is
+    lower get a progressively wider window (match_matrix.match_book_windowed).
 
+    With similarity_memory_mb, the similarity matrix is never built: segments and
+    paragraphs are scored in tiles sized to that budget (match_matrix.match_book_blocked),
+    for books or corpora whose full matrix does not fit in memory. Results are identical.
 
-    data = load_json(all_similarities_json)
-    results = find_best_paragraphs(data)
+    segment_features="patches" encodes each main image once and pools its patch features
+    inside every SAM mask (patch_pooling.encode_segments_pooled) instead of encoding
+    every crop ("crops"). With resolution_buckets, small crops are encoded at a smaller
+    resolution instead of being upsampled (clip_encode.encode_images_adaptive).
+
+    Returns:
+        Tuple[list, list]: the records find_best_paragraphs and find_most_frequent_paragraphs
+        would produce from main()'s similarity JSON, or None if the document JSON is missing.
+    """
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model, preprocess = load_clip_model(device)
+
+    json_path = os.path.join(output_dir, f"{prefix}.json")
+    if not os.path.exists(json_path):
+        print(f"❌ JSON file not found: {json_path}")
+        return None
+
+    paragraphs = load_paragraphs(json_path)
+    text_features = encode_paragraph_texts([p[3] for p in paragraphs], model, device, cache_dir)
+
+    image_to_subimages = find_subimages_for_images(find_images(output_dir, prefix), segment_dir)
+    sub_imgs = [sub_img for subs in image_to_subimages.values() for sub_img in subs]
+    if segment_features == "patches":
+        image_features = encode_segments_pooled(image_to_subimages, os.path.join(segment_dir, "segmentation_manifest.json"),
+                                                model, preprocess, device, batch_size, num_workers)
+    elif cache_dir:
+        image_cache = open_image_cache(cache_dir, CLIP_MODEL_NAME, preprocess, resolution_buckets)
+        image_features = encode_images_cached(sub_imgs, model, preprocess, device, image_cache, batch_size,
+                                              num_workers, resolution_buckets=resolution_buckets)
+    elif resolution_buckets:
+        image_features = encode_images_adaptive(sub_imgs, model, device, batch_size, num_workers, resolution_buckets)
+    else:
+        image_features = encode_images(sub_imgs, model, preprocess, device, batch_size, num_workers)
+
+    if page_window is not None:
+        return match_book_windowed(image_to_subimages, image_features.float().cpu().numpy(),
+                                   text_features.float().cpu().numpy(), paragraphs, page_window, widen_below)
+
+    if similarity_memory_mb is not None:
+        print(f"🧱 Blocked similarity: {len(sub_imgs)} segments × {len(paragraphs)} paragraphs "
+              f"in tiles for {similarity_memory_mb} MB")
+        return match_book_blocked(image_to_subimages, image_features.float().cpu().numpy(),
+                                  text_features.float().cpu().numpy(), paragraphs,
+                                  memory_budget_mb=similarity_memory_mb)
+
+    with torch.no_grad():
+        similarities = (image_features @ text_features.T).float().cpu().numpy()
+    print(f"🧮 Similarity matrix: {len(sub_imgs)} segments × {len(paragraphs)} paragraphs")
+    return match_book(image_to_subimages, similarities, paragraphs)
+
+def find_best(all_similarities_json,best_similarities_json,final_summary_json,final_output_json,
+                     global_results, paragraph_json, persist_intermediate=False):
+    """
+    Best paragraph per segment → most frequent paragraph per main image → merged rects.
+
+    The stages pass Python objects to each other; only the small final JSONs read by the
+    highlighting step are written. persist_intermediate also dumps the per-segment
+    similarities and best matches (debugging only, they get large on big books).
+    """
+    if persist_intermediate:
+        with open(all_similarities_json, "w", encoding="utf-8") as json_file:
+            json.dump(global_results, json_file, ensure_ascii=False, indent=4)
+
+    results = find_best_paragraphs(global_results)
     print_results(results)
+    return summarize_best(results, best_similarities_json, final_summary_json, final_output_json, paragraph_json,
+                          persist_intermediate=persist_intermediate)
+
+
+def summarize_best(results, best_similarities_json, final_summary_json, final_output_json, paragraph_json,
+                   summary=None, persist_intermediate=False):
+    """
+    Majority vote per main image (unless summary is given) and rect merge, in memory.
 
-    if best_similarities_json:
+    Writes final_summary_json and final_output_json, the inputs of the highlighting step.
+
+    Returns:
+        list: The final entries with rects.
+    """
+    if persist_intermediate and best_similarities_json:
         save_results(results, best_similarities_json)
         print(f"\n✅ Results saved to: {best_similarities_json}")
 
-
-    data = load_json(best_similarities_json)
-    results = find_most_frequent_paragraphs(data)
-    save_results(results, final_summary_json)
+    if summary is None:
+        summary = find_most_frequent_paragraphs(results)
+    save_results(summary, final_summary_json)
     print(f"✅ Results saved to {final_summary_json}")
 
-
-    add_rects_to_image_json(final_summary_json, paragraph_json, final_output_json)
+    return add_rects_to_image_json(final_summary_json, paragraph_json, final_output_json, summary_data=summary)
 
 
 if __name__ == "__main__":
@@ -260,6 +417,28 @@ if __name__ == "__main__":
 
     # --- Add menu option ---
     menu = 1
+    num_workers = 1  # >1 runs SAM in a process pool, one core slice per worker
+    memory_budget_mb = None  # e.g. 12000: adapt points_per_batch / resolution to stay below it
+    bypass_trivial = False  # opt-in: send thumbnails / near-uniform scans to CLIP as one whole-image segment
+    hash_index_path = dir + "phash_index.json"  # reuse segments of reproductions seen in earlier books
+    prompt_density = "fixed"  # 32x32 grid; "adaptive" or "sparse" (salient regions only) prompt fewer points
+    segmenter = "auto"  # "auto" (SAM grid), "prompted" (saliency prompts + SamPredictor) or "saliency" (no SAM)
+    async_write = True  # encode/write crops on a background pool so SAM never waits on disk
+    time_budget_s = None  # opt-in, e.g. 180 s per image: then lower resolution → fewer prompts → whole image
+    share_weights = True  # with num_workers > 1: load SAM once, workers share it read-only (fork)
+    sam_runtime = "torch"  # "onnx": encoder/decoder in ONNX Runtime (export + parity check: onnx_sam.py)
+    onnx_options = {"graph_optimization": "all", "inter_op_threads": 1}
+    clip_batch_size = 32  # segment crops per CLIP encode_image call
+    clip_loader_workers = 2  # processes decoding/preprocessing crops ahead of CLIP
+    embedding_cache_dir = dir + "embedding_cache/"  # persistent CLIP embeddings (None = always encode)
+    top_k = 10  # paragraphs kept per segment in the similarity JSON (None = full ranking)
+    matching_engine = "matrix"  # "matrix": one similarity matmul per book; "loop": per-image similarity JSON
+    page_window = None  # e.g. 2: match segments only against paragraphs within ±2 pages (matrix engine)
+    widen_below = 0.25  # with page_window: widen the window when the best in-window similarity is lower
+    similarity_memory_mb = None  # e.g. 512: score in tiles instead of one full similarity matrix (matrix engine)
+    segment_features = "crops"  # "patches": one CLIP pass per main image, pooled inside each mask (matrix engine)
+    resolution_buckets = None  # e.g. (96, 128, 160, 224): encode small crops at a smaller resolution (matrix engine)
+    debug_json = False  # also write the (large) per-segment similarity / best-match JSONs
 
     # --- Step 5: Log processed PDF files ---
     os.makedirs(process_log_dir, exist_ok=True)  # Ensure folder exists
@@ -286,33 +465,54 @@ if __name__ == "__main__":
                     input_folder=output_dir,
                     output_dir=segment_dir,
                     checkpoint_path=dir + "sam_vit_h_4b8939.pth",
-                    model_type="vit_h"
+                    model_type="vit_h",
+                    num_workers=num_workers,
+                    memory_budget_mb=memory_budget_mb,
+                    bypass_trivial=bypass_trivial,
+                    hash_index_path=hash_index_path,
+                    prompt_density=prompt_density,
+                    backend=segmenter,
+                    async_write=async_write,
+                    time_budget_s=time_budget_s,
+                    share_weights=share_weights,
+                    runtime=sam_runtime,
+                    onnx_options=onnx_options
                 )
             else:
                 print("\n⏭️ Skipping process_folder.")
-            # --- Step 3: Run CLIP similarity and highlight best paragraphs ---
-            global_results = main(segment_dir, output_dir, prefix, paragraph_json)
-            # --- Step 4: highlight the
-            # 📝 Write everything to ONE big JSON file
             all_similarities_json = os.path.join(output_dir, f"{prefix}_similarities.json")
             best_similarities_json = all_similarities_json.replace("similarities", "best")
             final_summary_json = all_similarities_json.replace("similarities", "final")
             final_output_json = final_summary_json.replace("final", "final_image_text")
             output_pdf="outlined_output_" + prefix + ".pdf"
             output_image_pdf = "outlined_output_image_" + prefix + ".pdf"
-            find_best(all_similarities_json,best_similarities_json,final_summary_json,final_output_json,
-                       global_results,  paragraph_json)
+            # --- Step 3: Run CLIP similarity and highlight best paragraphs ---
+            if matching_engine == "matrix":
+                best_results, final_results = match_document_matrix(
+                    segment_dir, output_dir, prefix, batch_size=clip_batch_size,
+                    num_workers=clip_loader_workers, cache_dir=embedding_cache_dir,
+                    page_window=page_window, widen_below=widen_below,
+                    similarity_memory_mb=similarity_memory_mb, segment_features=segment_features,
+                    resolution_buckets=resolution_buckets)
+                final_entries = summarize_best(best_results, best_similarities_json, final_summary_json, final_output_json,
+                               paragraph_json, summary=final_results, persist_intermediate=debug_json)
+            else:
+                global_results = main(segment_dir, output_dir, prefix, paragraph_json,
+                                      batch_size=clip_batch_size, num_workers=clip_loader_workers,
+                                      cache_dir=embedding_cache_dir, top_k=top_k)
+                # --- Step 4: highlight the
+                # 📝 Write everything to ONE big JSON file
+                final_entries = find_best(all_similarities_json,best_similarities_json,final_summary_json,
+                                          final_output_json, global_results, paragraph_json,
+                                          persist_intermediate=debug_json)
 
             highlight_paragraphs(
                 pdf_path=image_dir + pdf_file,
                 json_path=final_summary_json,
                 output_path=output_dir + output_pdf
             )
-            with open(final_output_json, "r") as f:
-                data = json.load(f)
-
             # --- Extract info ---
-            for entry in data:
+            for entry in final_entries:
                 main_image = entry["Main Image"]
                 page_number, image_number = extract_page_and_image(main_image)
                 print(f"🔹 Found: Page {page_number}, Image {image_number}")
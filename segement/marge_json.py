@@ -1,7 +1,25 @@
 import json
 import os
 
-def add_rects_to_image_json(summary_json_path, details_json_path, output_path):
+def merge_rects(summary_data, details_data):
+    """
+    Return copies of the summary entries with the rects of their main image attached.
+
+    Args:
+        summary_data (list): Entries with a "Main Image" key.
+        details_data (dict): Document JSON with "images" entries holding "file" and "rects".
+    """
+    # --- Build quick lookup for image rects ---
+    rect_lookup = {
+        img["file"]: img.get("rects", [])
+        for img in details_data.get("images", [])
+    }
+
+    # --- Merge rects into summary entries (fallback [] if image not found) ---
+    return [{**entry, "rects": rect_lookup.get(entry.get("Main Image"), [])} for entry in summary_data]
+
+
+def add_rects_to_image_json(summary_json_path, details_json_path, output_path, summary_data=None):
     """
     Merge image rectangles (rects) from the detailed JSON into the main image summary JSON.
 
@@ -9,33 +27,27 @@ def add_rects_to_image_json(summary_json_path, details_json_path, output_path):
         summary_json_path (str): Path to JSON containing "Main Image" entries.
         details_json_path (str): Path to JSON containing "images" with "rects".
         output_path (str): Where to save the merged JSON.
+        summary_data (list): The summary entries, if already in memory (summary_json_path is then not read).
+
+    Returns:
+        list: The merged entries.
     """
     # --- Load both JSON files ---
-    with open(summary_json_path, "r", encoding="utf-8") as f:
-        summary_data = json.load(f)
+    if summary_data is None:
+        with open(summary_json_path, "r", encoding="utf-8") as f:
+            summary_data = json.load(f)
 
     with open(details_json_path, "r", encoding="utf-8") as f:
         details_data = json.load(f)
 
-    # --- Build quick lookup for image rects ---
-    rect_lookup = {
-        img["file"]: img.get("rects", [])
-        for img in details_data.get("images", [])
-    }
-
-    # --- Merge rects into summary entries ---
-    for entry in summary_data:
-        main_img = entry.get("Main Image")
-        if main_img in rect_lookup:
-            entry["rects"] = rect_lookup[main_img]
-        else:
-            entry["rects"] = []  # fallback if image not found
+    merged = merge_rects(summary_data, details_data)
 
     # --- Save merged output ---
     with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(summary_data, f, indent=2, ensure_ascii=False)
+        json.dump(merged, f, indent=2, ensure_ascii=False)
 
     print(f"✅ Merged JSON saved to: {output_path}")
+    return merged
 
 
 # ----------------- Example usage -----------------
@@ -0,0 +1,76 @@
+import numpy as np
+from typing import List, Tuple
+
+
+def pack_masks(masks: List[dict], shape: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pack SAM masks into a sparse (CSR-like) representation.
+
+    Only the pixels inside each mask's bbox are scanned, so packing costs
+    O(sum of bbox areas) instead of O(masks × pixels).
+
+    Args:
+        masks (List[dict]): SAM mask records with 'segmentation' and optionally 'bbox' (x, y, w, h).
+        shape (Tuple[int, int]): (H, W) of the image the masks belong to.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]:
+            flat pixel indices of all masks concatenated, and the mask id of every index.
+    """
+    width = shape[1]
+    indices, labels = [], []
+    for label, m in enumerate(masks):
+        seg = m["segmentation"]
+        if "bbox" in m:
+            x, y, w, h = (int(v) for v in m["bbox"])
+            ys, xs = np.nonzero(seg[y:y + h + 1, x:x + w + 1])
+            flat = (ys + y) * width + (xs + x)
+        else:
+            flat = np.flatnonzero(seg)
+        indices.append(flat)
+        labels.append(np.full(flat.size, label, dtype=np.int32))
+
+    if not indices:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32)
+    return np.concatenate(indices), np.concatenate(labels)
+
+
+def score_masks(masks: List[dict], weight_map: np.ndarray) -> np.ndarray:
+    """
+    Score every mask as mean(weight_map[mask]) * area in one vectorized pass.
+
+    This is the same score as the per-mask loop `weight_map[mask].mean() * m["area"]`
+    used by detectionMain.py and attention.py; empty masks score 0.
+
+    Args:
+        masks (List[dict]): SAM mask records.
+        weight_map (np.ndarray): (H, W) saliency or attention map.
+
+    Returns:
+        np.ndarray: One float score per mask, in input order.
+    """
+    if not masks:
+        return np.empty(0, dtype=np.float64)
+
+    indices, labels = pack_masks(masks, weight_map.shape[:2])
+    weights = weight_map.reshape(-1)[indices].astype(np.float64)
+    sums = np.bincount(labels, weights=weights, minlength=len(masks))
+    counts = np.bincount(labels, minlength=len(masks))
+
+    areas = np.array([m.get("area", c) for m, c in zip(masks, counts)], dtype=np.float64)
+    means = np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
+    return means * areas
+
+
+def rank_masks(masks: List[dict], weight_map: np.ndarray, top_n: int = None) -> List[Tuple[float, dict]]:
+    """
+    Rank masks by their weighted score (highest first) and keep the top_n.
+
+    Returns:
+        List[Tuple[float, dict]]: (score, mask record) pairs; ties keep the input order.
+    """
+    scores = score_masks(masks, weight_map)
+    order = np.argsort(-scores, kind="stable")
+    if top_n is not None:
+        order = order[:top_n]
+    return [(float(scores[i]), masks[i]) for i in order]
@@ -0,0 +1,276 @@
+import numpy as np
+from .fileUtils import parse_image_name
+from .memory_budget import available_memory_mb
+from .ranking import valid_paragraph_mask
+
+
+def best_paragraph_indices(similarities: np.ndarray, valid: np.ndarray) -> np.ndarray:
+    """
+    Index of the best valid paragraph for every segment (row), -1 if no paragraph is valid.
+
+    np.argmax returns the first maximum, i.e. the lowest paragraph index among equal
+    scores, the same paragraph find_best_paragraphs picks from the stable-sorted ranking.
+    """
+    if not valid.any():
+        return np.full(similarities.shape[0], -1, dtype=np.int64)
+    masked = np.where(valid[None, :], similarities, -np.inf)
+    return masked.argmax(axis=1)
+
+
+def majority_vote(best: np.ndarray, num_paragraphs: int):
+    """
+    Most frequent paragraph among the best matches of one main image's segments.
+
+    Ties go to the paragraph whose first vote comes earliest, like Counter.most_common(1).
+
+    Returns:
+        Tuple[int, int]: (paragraph index, number of votes)
+    """
+    counts = np.bincount(best, minlength=num_paragraphs)
+    frequency = counts.max()
+    winner = best[np.argmax(counts[best] == frequency)]
+    return int(winner), int(frequency)
+
+
+def best_in_page_window(image_features: np.ndarray, text_features: np.ndarray, segment_pages: np.ndarray,
+                        paragraph_pages: np.ndarray, valid: np.ndarray, window: int, widen_below: float = None):
+    """
+    Best valid paragraph per segment, scoring only paragraphs within ±window pages of the segment.
+
+    Segments are grouped by page and each group is multiplied only with its candidate
+    paragraphs, so the work grows with the book length instead of its square. Segments
+    without a valid candidate, or (with widen_below) whose best in-window score is lower,
+    are rescored with the window doubled, until it spans the whole book. Segments with an
+    unknown page (< 0) are scored against the whole book.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: best paragraph index (-1 if none), its score,
+        and the window it was found in, per segment.
+    """
+    num_segments = len(image_features)
+    best = np.full(num_segments, -1, dtype=np.int64)
+    scores = np.full(num_segments, -np.inf, dtype=np.float32)
+    windows = np.full(num_segments, -1, dtype=np.int64)
+    if num_segments == 0 or not valid.any():
+        return best, scores, windows
+
+    known = segment_pages[segment_pages >= 0]
+    full_window = int(max(np.abs(paragraph_pages.max() - known).max(), np.abs(known - paragraph_pages.min()).max())) \
+        if len(known) else 0
+    pending, current = np.arange(num_segments), window
+    while len(pending):
+        for page in np.unique(segment_pages[pending]):
+            rows = pending[segment_pages[pending] == page]
+            in_window = valid if page < 0 else valid & (np.abs(paragraph_pages - page) <= current)
+            cols = np.flatnonzero(in_window)
+            if len(cols) == 0:
+                continue
+            sims = image_features[rows] @ text_features[cols].T
+            arg = sims.argmax(axis=1)
+            best[rows] = cols[arg]
+            scores[rows] = sims[np.arange(len(rows)), arg]
+            windows[rows] = current if page >= 0 else full_window
+
+        if current >= full_window:
+            break
+        retry = best[pending] < 0
+        if widen_below is not None:
+            retry |= scores[pending] < widen_below
+        pending = pending[retry & (segment_pages[pending] >= 0)]
+        current = min(max(1, current * 2), full_window)
+    return best, scores, windows
+
+
+def choose_tile_size(memory_budget_mb: float = None, max_tile: int = 16384, k: int = 1) -> int:
+    """
+    Side of the (segments × paragraphs) tiles for blocked_top_k.
+
+    With k=1 a tile costs ~4 bytes per element (the float32 scores, reduced by argmax);
+    with k > 1 ~16 (scores, the partitioned copy, int32 tie ranks and boolean masks).
+    Without a budget a quarter of the available memory is used.
+    """
+    if memory_budget_mb is None:
+        memory_budget_mb = available_memory_mb() / 4
+    bytes_per_element = 4 if k == 1 else 16
+    return int(max(64, min(max_tile, np.sqrt(memory_budget_mb * 2 ** 20 / bytes_per_element))))
+
+
+def block_top_k(block: np.ndarray, cols: np.ndarray, k: int):
+    """
+    The k best columns of every row of a score block, the lower column first among equal scores.
+
+    np.partition finds each row's k-th best score; every higher score is kept and, of the
+    scores equal to it, only the first ones, so ties resolve exactly like a stable sort
+    without sorting the block.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (rows, k) scores and paragraph indices, in column order.
+    """
+    num_cols = block.shape[1]
+    if num_cols <= k:
+        return block, np.broadcast_to(cols, block.shape)
+    kth = np.partition(block, num_cols - k, axis=1)[:, num_cols - k, None]
+    above = block > kth
+    ties = block == kth
+    needed = k - above.sum(axis=1, keepdims=True)
+    keep = above | (ties & (np.cumsum(ties, axis=1, dtype=np.int32) <= needed))
+    positions = np.nonzero(keep)[1].reshape(len(block), k)  # exactly k per row, row-major
+    return np.take_along_axis(block, positions, axis=1), cols[positions]
+
+
+def blocked_top_k(image_features: np.ndarray, text_features: np.ndarray, k: int, valid: np.ndarray = None,
+                  tile_size: int = None, memory_budget_mb: float = None):
+    """
+    Top-k paragraphs per segment without ever holding the full similarity matrix.
+
+    Segment features are streamed in tiles (np.memmap inputs, e.g. an EmbeddingCache, are
+    never loaded whole) and every segment tile is scored against the paragraph tiles one
+    by one, merging each block into a running top-k. Invalid paragraphs are skipped.
+    The result equals dense scoring followed by a stable sort: highest score first and
+    the lower paragraph index first among equal scores. With k=1 each block is reduced
+    by argmax; otherwise only its k best (block_top_k) are merged, so no sort ever
+    covers more than 2k columns.
+
+    Args:
+        image_features (np.ndarray): (S, D) segment features.
+        text_features (np.ndarray): (P, D) paragraph features.
+        k (int): Paragraphs kept per segment.
+        valid (np.ndarray): Optional (P,) mask of paragraphs that may be matched.
+        tile_size (int): Tile side; by default chosen from memory_budget_mb (choose_tile_size).
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (S, k') scores and paragraph indices, k' = min(k, valid paragraphs);
+        -inf / -1 where a segment has fewer candidates.
+    """
+    num_segments, num_paragraphs = len(image_features), len(text_features)
+    valid = np.ones(num_paragraphs, dtype=bool) if valid is None else np.asarray(valid, dtype=bool)
+    k = min(k, int(valid.sum()))
+    tile_size = tile_size or choose_tile_size(memory_budget_mb, k=k)
+
+    top_scores = np.full((num_segments, k), -np.inf, dtype=np.float32)
+    top_indices = np.full((num_segments, k), -1, dtype=np.int64)
+    if k == 0:
+        return top_scores, top_indices
+
+    for s0 in range(0, num_segments, tile_size):
+        segments = np.asarray(image_features[s0:s0 + tile_size], dtype=np.float32)
+        scores, indices = top_scores[s0:s0 + tile_size], top_indices[s0:s0 + tile_size]
+        rows = np.arange(len(segments))
+        for p0 in range(0, num_paragraphs, tile_size):
+            cols = np.arange(p0, min(p0 + tile_size, num_paragraphs))
+            cols = cols[valid[cols]]
+            if len(cols) == 0:
+                continue
+            block = segments @ np.asarray(text_features[cols], dtype=np.float32).T
+
+            if k == 1:
+                # argmax keeps the first maximum; an earlier block keeps equal scores
+                arg = block.argmax(axis=1)
+                best = block[rows, arg]
+                better = best > scores[:, 0]
+                scores[better, 0], indices[better, 0] = best[better], cols[arg[better]]
+                continue
+
+            # running top-k (sorted, lower indices) first, then the block's k best in index
+            # order: a stable sort on the score keeps equal scores in paragraph order
+            block_scores, block_indices = block_top_k(block, cols, k)
+            candidates = np.concatenate([scores, block_scores], axis=1)
+            candidate_indices = np.concatenate([indices, block_indices], axis=1)
+            order = np.argsort(-candidates, axis=1, kind="stable")[:, :k]
+            scores[:] = np.take_along_axis(candidates, order, axis=1)
+            indices[:] = np.take_along_axis(candidate_indices, order, axis=1)
+    return top_scores, top_indices
+
+
+def match_book_blocked(image_to_subimages: dict, image_features: np.ndarray, text_features: np.ndarray,
+                       paragraphs: list, tile_size: int = None, memory_budget_mb: float = None):
+    """match_book for books whose similarity matrix does not fit in memory (blocked_top_k with k=1)."""
+    valid = valid_paragraph_mask([p[3] for p in paragraphs]).numpy()
+    scores, indices = blocked_top_k(image_features, text_features, 1, valid, tile_size, memory_budget_mb)
+    if indices.shape[1] == 0:
+        return [], []
+    return build_match_results(image_to_subimages, indices[:, 0], scores[:, 0], paragraphs)
+
+
+def build_match_results(image_to_subimages: dict, best: np.ndarray, scores: np.ndarray, paragraphs: list):
+    """
+    Turn best paragraph indices (-1 = no valid paragraph, segment skipped) and their
+    scores into find_best_paragraphs / find_most_frequent_paragraphs records.
+
+    Returns:
+        Tuple[list, list]: best-paragraph records per segment and most-frequent records per main image.
+    """
+    best_results, summary_results = [], []
+    offset = 0
+    for main_img, sub_imgs in image_to_subimages.items():
+        rows = np.arange(offset, offset + len(sub_imgs))
+        rows = rows[best[rows] >= 0]
+        for row in rows:
+            page, para_index, para, cleaned = paragraphs[best[row]]
+            best_results.append({
+                "Main Image": main_img,
+                "Image": sub_imgs[row - offset],
+                "Best Paragraph Page": int(page),
+                "Best Paragraph Number": int(para_index),
+                "Best Paragraph Text": str(cleaned),
+                "Best Paragraph Original Text": str(para),
+                "Similarity": float(scores[row])
+            })
+        offset += len(sub_imgs)
+        if len(rows) == 0:
+            continue
+
+        winner, frequency = majority_vote(best[rows], len(paragraphs))
+        page, para_index, para, cleaned = paragraphs[winner]
+        summary_results.append({
+            "Main Image": main_img,
+            "Most Frequent Page": int(page),
+            "Most Frequent Paragraph": int(para_index),
+            "Frequency": frequency,
+            "Representative Text": str(cleaned),
+            "Representative Original Text": str(para)
+        })
+    return best_results, summary_results
+
+
+def match_book(image_to_subimages: dict, similarities: np.ndarray, paragraphs: list):
+    """
+    Best paragraph per segment and majority vote per main image for a whole book at once.
+
+    Produces exactly what find_best_paragraphs and find_most_frequent_paragraphs compute
+    from the per-image similarity JSON, without building per-segment ranked lists.
+
+    Args:
+        image_to_subimages (dict): main image → list of segment files (find_subimages_for_images).
+        similarities (np.ndarray): (S, P) segment × paragraph similarities (one matmul of the
+            stacked segment features, in dict order, with all paragraph features).
+        paragraphs (list): (page, para_index, para, cleaned_text) tuples.
+
+    Returns:
+        Tuple[list, list]: best-paragraph records per segment and most-frequent records per main image.
+    """
+    valid = valid_paragraph_mask([p[3] for p in paragraphs]).numpy()
+    best = best_paragraph_indices(similarities, valid)
+    scores = similarities[np.arange(len(best)), np.maximum(best, 0)] if similarities.size else np.zeros(len(best))
+    return build_match_results(image_to_subimages, best, scores, paragraphs)
+
+
+def match_book_windowed(image_to_subimages: dict, image_features: np.ndarray, text_features: np.ndarray,
+                        paragraphs: list, window: int, widen_below: float = None):
+    """
+    match_book restricted to paragraphs within ±window pages of each segment's page
+    (parsed from names like '..._page10_img2_object_003.png'); see best_in_page_window.
+
+    With a window spanning the whole book the result equals match_book.
+    """
+    segment_pages = np.array([(parse_image_name(sub_img) or (None, -1))[1]
+                              for sub_imgs in image_to_subimages.values() for sub_img in sub_imgs], dtype=np.int64)
+    paragraph_pages = np.array([p[0] for p in paragraphs], dtype=np.int64)
+    valid = valid_paragraph_mask([p[3] for p in paragraphs]).numpy()
+
+    best, scores, windows = best_in_page_window(image_features.astype(np.float32),
+                                                text_features.astype(np.float32), segment_pages,
+                                                paragraph_pages, valid, window, widen_below)
+    widened = int(np.sum((windows > window) & (segment_pages >= 0)))
+    print(f"📖 Page window ±{window}: {len(best) - widened} segments matched in window, {widened} widened")
+    return build_match_results(image_to_subimages, best, scores, paragraphs)
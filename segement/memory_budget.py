@@ -0,0 +1,171 @@
+import gc
+import os
+import resource
+import threading
+import torch
+
+# SamAutomaticMaskGenerator defaults plus the working resolution (None = native size)
+DEFAULT_SETTINGS = {"points_per_batch": 64, "max_side": None}
+MIN_POINTS_PER_BATCH = 8
+MIN_SIDE = 512
+
+
+def current_rss_mb() -> float:
+    """Return the resident set size of this process in MB."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        # ru_maxrss is the lifetime peak (KB on Linux), the best we have without /proc
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def available_memory_mb() -> float:
+    """MemAvailable from /proc/meminfo in MB (total physical memory if /proc is unavailable)."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 2 ** 20
+
+
+def rss_breakdown_mb() -> dict:
+    """
+    RSS of this process split into private (anon), file-backed and shared-memory pages, in MB.
+
+    Model weights placed in shared memory show up under 'shmem' and are counted once for
+    the machine even though every worker's 'rss' includes them.
+    """
+    fields = {"VmRSS": "rss", "RssAnon": "anon", "RssFile": "file", "RssShmem": "shmem"}
+    breakdown = {}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in fields:
+                    breakdown[fields[key]] = round(int(value.split()[0]) / 1024, 1)
+    except OSError:
+        breakdown["rss"] = round(current_rss_mb(), 1)
+    return breakdown
+
+
+class PeakMemoryMonitor:
+    """
+    Context manager that samples the process RSS in a background thread and keeps the peak.
+
+    On CUDA the peak allocated device memory is tracked as well.
+
+    Usage:
+        with PeakMemoryMonitor() as monitor:
+            masks = generate_masks(image, sam_model)
+        print(monitor.peak_mb)
+    """
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak_mb = 0.0
+        self.cuda_peak_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+    def __enter__(self):
+        self.peak_mb = current_rss_mb()
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, current_rss_mb())
+        if torch.cuda.is_available():
+            self.cuda_peak_mb = torch.cuda.max_memory_allocated() / 2 ** 20
+        return False
+
+
+def is_out_of_memory(exc: BaseException) -> bool:
+    """True if the exception is a (CPU or CUDA) allocation failure."""
+    if isinstance(exc, MemoryError):
+        return True
+    if hasattr(torch, "OutOfMemoryError") and isinstance(exc, torch.OutOfMemoryError):
+        return True
+    message = str(exc).lower()
+    return isinstance(exc, RuntimeError) and (
+        "out of memory" in message or "not enough memory" in message or "failed to allocate" in message
+    )
+
+
+def free_memory():
+    """Release what can be released after a failed or finished image."""
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def reduce_settings(settings: dict, image_shape=None) -> dict:
+    """
+    Return the next cheaper generation settings, or None if nothing is left to reduce.
+
+    points_per_batch is halved first (down to MIN_POINTS_PER_BATCH), then the working
+    resolution is halved (down to MIN_SIDE).
+    """
+    reduced = dict(settings)
+    if reduced["points_per_batch"] > MIN_POINTS_PER_BATCH:
+        reduced["points_per_batch"] = max(MIN_POINTS_PER_BATCH, reduced["points_per_batch"] // 2)
+        return reduced
+
+    side = reduced["max_side"] or (max(image_shape[:2]) if image_shape is not None else None)
+    if side is not None and side // 2 >= MIN_SIDE:
+        reduced["max_side"] = side // 2
+        return reduced
+    return None
+
+
+def oom_retry_settings(settings: dict, image_shape=None) -> dict:
+    """
+    Settings for retrying an image after an allocation failure, or None if nothing is left.
+
+    Unlike reduce_settings, every memory-heavy knob is lowered at once (crop layers off,
+    points_per_batch and working resolution halved), so a failing image needs few retries.
+    """
+    reduced = dict(settings)
+    if reduced.get("crop_n_layers"):
+        reduced["crop_n_layers"] = 0
+    reduced["points_per_batch"] = max(MIN_POINTS_PER_BATCH, reduced["points_per_batch"] // 2)
+    side = reduced["max_side"] or (max(image_shape[:2]) if image_shape is not None else None)
+    if side is not None and side // 2 >= MIN_SIDE:
+        reduced["max_side"] = side // 2
+    return reduced if reduced != settings else None
+
+
+def adapt_settings(settings: dict, peak_mb: float, budget_mb: float, image_shape=None) -> dict:
+    """
+    Pick the settings for the next image from the peak RSS of the last one.
+
+    Over budget → step down (reduce_settings); well below budget (< 60%) → step
+    points_per_batch and resolution back up towards DEFAULT_SETTINGS.
+    """
+    if peak_mb > budget_mb:
+        return reduce_settings(settings, image_shape) or settings
+
+    if peak_mb < 0.6 * budget_mb:
+        raised = dict(settings)
+        if raised["max_side"] is not None:
+            raised["max_side"] = raised["max_side"] * 2
+            if image_shape is not None and raised["max_side"] >= max(image_shape[:2]):
+                raised["max_side"] = DEFAULT_SETTINGS["max_side"]
+        elif raised["points_per_batch"] < DEFAULT_SETTINGS["points_per_batch"]:
+            raised["points_per_batch"] = min(DEFAULT_SETTINGS["points_per_batch"], raised["points_per_batch"] * 2)
+        return raised
+
+    return settings
@@ -1,16 +1,39 @@
 import os
 import cv2
+import json
+import time
+import shutil
 import torch
 import numpy as np
 from glob import glob
-from segment_anything import sam_model_registry, SamAutomaticMaskGenerator
+from segment_anything import sam_model_registry, SamAutomaticMaskGenerator, SamPredictor
+from segment_anything.utils.amg import mask_to_rle_pytorch
+from .memory_budget import (DEFAULT_SETTINGS, PeakMemoryMonitor, adapt_settings, free_memory,
+                            is_out_of_memory, oom_retry_settings)
+from .image_filter import classify_trivial_image, whole_image_mask
+from .fileUtils import parse_image_name
+from .phash_index import PerceptualHashIndex, config_fingerprint, phash
+from .prompt_density import count_prompts, prompt_generator_kwargs
+from .saliency import salient_components, saliency_segments
+from .async_writer import AsyncImageWriter
+from .time_budget import FALLBACK_LEVELS, DeadlineExceeded, DeadlineMaskGenerator, fallback_plan
 
 
 # ------------------------------
 # Configuration
 # ------------------------------
-def load_sam_model(checkpoint_path: str, model_type: str = "vit_h", device: str = None):
-    """Load the SAM model from a checkpoint."""
+def load_sam_model(checkpoint_path: str, model_type: str = "vit_h", device: str = None,
+                   runtime: str = "torch", onnx_options: dict = None):
+    """
+    Load the SAM model from a checkpoint.
+
+    runtime='onnx' runs the image encoder and mask decoder in ONNX Runtime on CPU
+    (exported next to the checkpoint on first use); onnx_options go to onnx_sam.create_session.
+    """
+    if runtime == "onnx":
+        from .onnx_sam import load_onnx_sam
+        return load_onnx_sam(checkpoint_path, model_type, **(onnx_options or {}))
+
     if device is None:
         device = "cuda" if torch.cuda.is_available() else "cpu"
 
@@ -36,27 +59,311 @@ def create_output_dir(output_dir: str):
     return output_dir
 
 
-def generate_masks(image: np.ndarray, sam_model) -> list:
-    """Generate masks for an image using the SAM model."""
-    mask_generator = SamAutomaticMaskGenerator(sam_model)
+def generate_masks(image: np.ndarray, sam_model, deadline: float = None, **generator_kwargs) -> list:
+    """
+    Generate masks for an image using the SAM model (kwargs go to SamAutomaticMaskGenerator).
+
+    With a deadline (a time.perf_counter() value) DeadlineExceeded is raised once it passes.
+    """
+    if deadline is not None:
+        mask_generator = DeadlineMaskGenerator(sam_model, deadline, **generator_kwargs)
+    else:
+        mask_generator = SamAutomaticMaskGenerator(sam_model, **generator_kwargs)
     masks = mask_generator.generate(image)
     return masks
 
 
-def segment_and_save_objects(image_path: str, sam_model, output_dir: str):
-    """Segment all objects in an image and save them as separate files."""
+def generate_masks_prompted(image: np.ndarray, sam_model, max_prompts: int = 5) -> list:
+    """
+    Generate masks from a handful of saliency-derived prompts instead of the automatic grid.
+
+    Each salient component (saliency.salient_components) becomes one box prompt plus a
+    positive point at its centroid; all prompts go through SamPredictor in a single
+    decoder batch. Without salient components the whole image is used as the box.
+
+    Returns:
+        list: Mask records in the SamAutomaticMaskGenerator format
+              (segmentation, area, bbox, predicted_iou).
+    """
+    h, w = image.shape[:2]
+    components = salient_components(image, max_components=max_prompts)
+    if not components:
+        components = [{"bbox": [0, 0, w - 1, h - 1], "centroid": [w / 2, h / 2]}]
+
+    predictor = SamPredictor(sam_model)
+    predictor.set_image(image)
+
+    boxes = torch.tensor([[x, y, x + bw, y + bh] for x, y, bw, bh in (c["bbox"] for c in components)],
+                         dtype=torch.float, device=predictor.device)
+    points = torch.tensor([[c["centroid"]] for c in components], dtype=torch.float, device=predictor.device)
+    labels = torch.ones(points.shape[:2], dtype=torch.int, device=predictor.device)
+
+    with torch.no_grad():
+        masks, iou_predictions, _ = predictor.predict_torch(
+            point_coords=predictor.transform.apply_coords_torch(points, (h, w)),
+            point_labels=labels,
+            boxes=predictor.transform.apply_boxes_torch(boxes, (h, w)),
+            multimask_output=False,
+        )
+
+    records = []
+    for segmentation, iou in zip(masks[:, 0].cpu().numpy(), iou_predictions[:, 0].cpu().numpy()):
+        ys, xs = np.nonzero(segmentation)
+        if len(xs) == 0:
+            continue
+        records.append({
+            "segmentation": segmentation,
+            "area": int(len(xs)),
+            "bbox": [int(xs.min()), int(ys.min()), int(xs.max() - xs.min()), int(ys.max() - ys.min())],
+            "predicted_iou": float(iou),
+        })
+    return records
+
+
+def upscale_masks(masks: list, shape: tuple) -> list:
+    """Resize masks generated on a downscaled image back to the original (H, W)."""
+    h, w = shape[:2]
+    for m in masks:
+        small_h, small_w = m["segmentation"].shape
+        sx, sy = w / small_w, h / small_h
+        m["segmentation"] = cv2.resize(m["segmentation"].astype(np.uint8), (w, h),
+                                       interpolation=cv2.INTER_NEAREST).astype(bool)
+        m["area"] = int(m["segmentation"].sum())
+        x, y, bw, bh = m["bbox"]
+        m["bbox"] = [int(x * sx), int(y * sy), int(round(bw * sx)), int(round(bh * sy))]
+    return masks
+
+
+def generate_masks_at(image: np.ndarray, sam_model, settings: dict = None, **generator_kwargs) -> list:
+    """
+    Generate masks with the given settings.
+
+    'max_side' sets the working resolution (masks are scaled back to the image size),
+    every other key, and generator_kwargs, is passed to SamAutomaticMaskGenerator.
+    """
+    settings = dict(settings or {})
+    max_side = settings.pop("max_side", None)
+    settings.update(generator_kwargs)
+    h, w = image.shape[:2]
+    if not max_side or max(h, w) <= max_side:
+        return generate_masks(image, sam_model, **settings)
+
+    scale = max_side / max(h, w)
+    small = cv2.resize(image, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+    return upscale_masks(generate_masks(small, sam_model, **settings), (h, w))
+
+
+def generate_masks_within_budget(image: np.ndarray, sam_model, settings: dict, record: dict,
+                                 **generator_kwargs) -> list:
+    """
+    Instrumented generation: measure the peak RSS of the image and, when an allocation
+    fails, free memory and retry at lower settings (see memory_budget.oom_retry_settings).
+
+    If even the lowest settings run out of memory the whole image becomes one segment
+    (fallback_level 'whole_image') instead of failing the run. The settings that
+    succeeded, the number of retries and the peak RSS are stored in the record.
+    """
+    settings = dict(settings)
+    if "crop_n_layers" in generator_kwargs:
+        # owned by the settings so that a retry can turn crop layers off
+        generator_kwargs = dict(generator_kwargs)
+        settings["crop_n_layers"] = generator_kwargs.pop("crop_n_layers")
+
+    record["oom_retries"] = 0
+    while True:
+        try:
+            with PeakMemoryMonitor() as monitor:
+                masks = generate_masks_at(image, sam_model, settings, **generator_kwargs)
+            break
+        except Exception as e:
+            if not is_out_of_memory(e):
+                raise
+        # outside the handler: the exception's traceback no longer keeps the failed attempt's tensors alive
+        free_memory()
+        reduced = oom_retry_settings(settings, image.shape)
+        if reduced is None:
+            print(f"   ❌ Out of memory even with {settings}, keeping the whole image as one segment")
+            record["settings"] = settings
+            record["fallback_level"] = "whole_image"
+            return whole_image_mask(image)
+        print(f"   ⚠️ Out of memory with {settings}, retrying with {reduced}")
+        record["oom_retries"] += 1
+        settings = reduced
+
+    record["settings"] = settings
+    record["peak_rss_mb"] = round(monitor.peak_mb, 1)
+    if monitor.cuda_peak_mb:
+        record["peak_cuda_mb"] = round(monitor.cuda_peak_mb, 1)
+    print(f"   📈 Peak RSS {monitor.peak_mb:.0f} MB with {settings}")
+    return masks
+
+
+def generate_masks_with_deadline(image: np.ndarray, sam_model, time_budget_s: float, settings: dict,
+                                 record: dict, **generator_kwargs) -> list:
+    """
+    Generate masks within a per-image time budget, degrading step by step when it runs out.
+
+    Levels (time_budget.fallback_plan): full → lower resolution → fewer prompts → the whole
+    image as one segment, so the worst case is about twice time_budget_s. The level used
+    is stored in record['fallback_level']. With settings, each attempt is also memory
+    instrumented (generate_masks_within_budget); a level's overrides (max_side,
+    crop_n_layers) only apply to this image, so they are stored as record['fallback_settings']
+    while record['settings'] keeps the memory settings the next image starts from.
+    """
+    for level, level_settings, level_kwargs, seconds in fallback_plan(settings, generator_kwargs,
+                                                                      image.shape, time_budget_s):
+        deadline = time.perf_counter() + seconds
+        try:
+            if settings is not None:
+                # records the settings that finally succeeded (after any OOM retries)
+                masks = generate_masks_within_budget(image, sam_model, level_settings, record,
+                                                     deadline=deadline, **level_kwargs)
+            else:
+                masks = generate_masks_at(image, sam_model, level_settings, deadline=deadline, **level_kwargs)
+        except DeadlineExceeded:
+            print(f"   ⏰ Time budget exceeded at level '{level}' ({seconds:.0f}s), degrading")
+            masks = None
+        if masks is None:
+            free_memory()  # after the handler, so the interrupted attempt can actually be collected
+            continue
+        record.setdefault("fallback_level", level)  # 'whole_image' if out of memory at every setting
+        if level != "full" and "settings" in record:
+            record["fallback_settings"] = record["settings"]
+            record["settings"] = dict(settings)
+        return masks
+
+    record["fallback_level"] = "whole_image"
+    return whole_image_mask(image)
+
+
+def next_image_settings(settings: dict, record: dict, memory_budget_mb: float) -> dict:
+    """
+    Memory settings for the next image, adapted from this image's peak RSS.
+
+    An image that fell back under the time budget ran with per-image overrides
+    (record['fallback_settings']), so its peak RSS says nothing about the memory
+    settings; they are passed on unchanged.
+    """
+    if settings is None or "peak_rss_mb" not in record or "fallback_settings" in record:
+        return settings
+    return adapt_settings(record["settings"], record["peak_rss_mb"], memory_budget_mb, record["size"])
+
+
+def scale_bbox(bbox: list, source_size: list, size: list) -> list:
+    """Map an [x, y, w, h] bbox from an image of source_size [h, w] to one of size [h, w] (clipped to it)."""
+    sy, sx = size[0] / source_size[0], size[1] / source_size[1]
+    x, y = min(int(round(bbox[0] * sx)), size[1] - 1), min(int(round(bbox[1] * sy)), size[0] - 1)
+    w = max(1, min(int(round(bbox[2] * sx)), size[1] - x))
+    h = max(1, min(int(round(bbox[3] * sy)), size[0] - y))
+    return [x, y, w, h]
+
+
+def reuse_duplicate_segments(entry: dict, base_name_out: str, output_dir: str, size: list = None) -> list:
+    """
+    Copy the stored segments of a known near-duplicate image under this image's names.
+
+    The bboxes are rescaled to this image's size [h, w] when the duplicate was indexed at
+    another resolution (entries indexed without a size are kept as they are).
+    """
+    source_size = entry.get("size")
+    segments = []
+    for i, segment in enumerate(entry["segments"]):
+        output_path = os.path.join(output_dir, f"{base_name_out}_object_{i + 1:03d}.png")
+        if os.path.abspath(segment["file"]) != os.path.abspath(output_path):
+            shutil.copyfile(segment["file"], output_path)
+        bbox = segment["bbox"]
+        if size is not None and source_size is not None and list(source_size) != list(size):
+            bbox = scale_bbox(bbox, source_size, size)
+        reused = {"file": output_path, "bbox": bbox}
+        if "mask" in segment:
+            reused["mask"] = segment["mask"]  # at the source resolution; consumers resize it to the bbox
+        segments.append(reused)
+    return segments
+
+
+def segment_and_save_objects(image_path: str, sam_model, output_dir: str, settings: dict = None,
+                             bypass_trivial: bool = False, hash_index: PerceptualHashIndex = None,
+                             prompt_density: str = "fixed", backend: str = "auto",
+                             writer: AsyncImageWriter = None, time_budget_s: float = None) -> dict:
+    """
+    Segment all objects in an image and save them as separate files.
+
+    The automatic generator is always instrumented (settings default to
+    memory_budget.DEFAULT_SETTINGS): the peak RSS is measured and out-of-memory errors
+    are retried at lower settings instead of aborting the batch.
+    With bypass_trivial, small or nearly uniform images (image_filter.classify_trivial_image)
+    skip SAM and are saved as a single whole-image segment for the CLIP stage.
+    With a hash_index, an image whose perceptual hash matches an already segmented
+    image (e.g. the same reproduction in another book) reuses that image's segments.
+    prompt_density selects the SAM prompt grid ('fixed', 'adaptive' or 'sparse',
+    see prompt_density.py); prompt count and SAM runtime are recorded.
+    backend 'auto' runs the automatic mask generator, 'prompted' runs SamPredictor on
+    a few saliency-derived prompts only (generate_masks_prompted), 'saliency' skips SAM
+    and saves the salient components' boxes (sam_model may then be None).
+    With a writer (AsyncImageWriter) the crops are encoded and written in the background.
+    With time_budget_s, the automatic generator degrades (lower resolution, fewer prompts,
+    whole image) instead of running past the budget; the level is recorded as fallback_level.
+
+    Returns:
+        dict: Manifest record for the image (name, saved objects with bboxes, seconds).
+    """
     base_name = os.path.splitext(os.path.basename(image_path))[0]
+    base_name_out = base_name.replace("input_", "")
     print(f"\n🔹 Processing {base_name}...")
+    start = time.perf_counter()
+    record = {"image": image_path, "objects": 0, "segments": [], "seconds": 0.0}
+    blocked_before = writer.blocked_seconds if writer is not None else 0.0
 
     # Read and convert image
     image = cv2.imread(image_path)
     if image is None:
         print(f"⚠️ Skipping {image_path} (could not read)")
-        return
+        return record
     image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    record["size"] = list(image.shape[:2])
+
+    # Reuse the segments of a near-duplicate image
+    if hash_index is not None:
+        image_hash = phash(image)
+        record["phash"] = f"{image_hash:016x}"
+        # crops of images segmented earlier in this run may still be queued in the writer
+        entry = hash_index.lookup(image_hash, wait=writer.wait if writer is not None else None)
+        if entry is not None:
+            print(f"   ♻️ Near-duplicate of {os.path.basename(entry['image'])}, reusing its segments")
+            record["duplicate_of"] = entry["image"]
+            record["segments"] = reuse_duplicate_segments(entry, base_name_out, output_dir, record["size"])
+            record["objects"] = len(record["segments"])
+            record["seconds"] = round(time.perf_counter() - start, 3)
+            return record
 
     # Generate masks
-    masks = generate_masks(image, sam_model)
+    trivial = classify_trivial_image(image) if bypass_trivial else None
+    if trivial:
+        print(f"   ⏭️ Trivial image ({trivial}), skipping SAM")
+        record["bypassed"] = trivial
+        record["prompts"] = 0
+        masks = whole_image_mask(image)
+    elif backend == "saliency":
+        masks = saliency_segments(image)
+        record["prompts"] = 0
+    elif backend == "prompted":
+        sam_start = time.perf_counter()
+        masks = generate_masks_prompted(image, sam_model)
+        record["prompts"] = len(masks)
+        record["sam_seconds"] = round(time.perf_counter() - sam_start, 3)
+        print(f"   {record['prompts']} saliency prompts, SAM took {record['sam_seconds']:.1f}s")
+    else:
+        generator_kwargs = prompt_generator_kwargs(image, prompt_density)
+        record["prompts"] = count_prompts(generator_kwargs)
+        sam_start = time.perf_counter()
+        settings = settings if settings is not None else dict(DEFAULT_SETTINGS)
+        if time_budget_s:
+            masks = generate_masks_with_deadline(image, sam_model, time_budget_s, settings, record,
+                                                 **generator_kwargs)
+        else:
+            masks = generate_masks_within_budget(image, sam_model, settings, record, **generator_kwargs)
+        record["sam_seconds"] = round(time.perf_counter() - sam_start, 3)
+        print(f"   {record['prompts']} prompts ({prompt_density}), SAM took {record['sam_seconds']:.1f}s")
     print(f"   Found {len(masks)} objects")
 
     # Save each segmented object
@@ -74,28 +381,205 @@ def segment_and_save_objects(image_path: str, sam_model, output_dir: str):
 
         # Output filename
         #base_name_out = base_name.replace("input", "output")
-        base_name_out = base_name.replace("input_", "")
         output_path = os.path.join(output_dir, f"{base_name_out}_object_{i + 1:03d}.png")
         if cropped_obj is None or cropped_obj.size == 0:
             print(f"⚠️ Skipping empty crop for {image_path}")
-            return  # or continue, depending on loop context
+            continue
 
         try:
-            cv2.imwrite(output_path, cv2.cvtColor(cropped_obj, cv2.COLOR_RGB2BGR))
+            if writer is not None:
+                writer.submit(output_path, cropped_obj)
+            elif not cv2.imwrite(output_path, cv2.cvtColor(cropped_obj, cv2.COLOR_RGB2BGR)):
+                raise IOError("cv2.imwrite returned False")
+            record["objects"] += 1
+            # the mask itself (uncompressed RLE over the bbox), so later stages need not guess it from the crop
+            rle = mask_to_rle_pytorch(torch.from_numpy(np.ascontiguousarray(mask[y_min:y_max, x_min:x_max]))[None])[0]
+            record["segments"].append({"file": output_path,
+                                       "bbox": [int(x_min), int(y_min), int(x_max - x_min), int(y_max - y_min)],
+                                       "mask": rle})
         except Exception as e:
             print(f"⚠️ Failed to save object from {image_path}: {e}")
         print(f"   💾 Saved {output_path}")
 
+    if writer is not None:
+        record["write_blocked_seconds"] = round(writer.blocked_seconds - blocked_before, 3)
+    record["seconds"] = round(time.perf_counter() - start, 3)
+    return record
+
+
+def report_throughput(records: list, elapsed: float, label: str = "single process") -> float:
+    """Print and return the images-per-minute throughput of a segmentation run."""
+    images_per_minute = 60.0 * len(records) / elapsed if elapsed > 0 else 0.0
+    print(f"⏱️ {label}: {len(records)} images in {elapsed:.1f}s → {images_per_minute:.2f} images/min")
+    return images_per_minute
+
+
+def count_bypassed_by_book(records: list) -> dict:
+    """Count, per book, how many images skipped SAM through the trivial-image bypass."""
+    avoided = {}
+    for record in records:
+        parsed = parse_image_name(record["image"])
+        book = parsed[0] if parsed else os.path.basename(record["image"])
+        avoided.setdefault(book, 0)
+        if record.get("bypassed"):
+            avoided[book] += 1
+    return avoided
+
+
+def build_summary(records: list, elapsed: float, workers: int, **options) -> dict:
+    """Run summary for the manifest: throughput, options used and SAM calls avoided per book."""
+    label = f"{workers} workers" if workers > 1 else "single process"
+    images_per_minute = report_throughput(records, elapsed, label)
+    avoided = count_bypassed_by_book(records)
+    for book, count in avoided.items():
+        if count:
+            print(f"   ⏭️ {book}: {count} SAM calls avoided")
+    summary = {"workers": workers, "seconds": round(elapsed, 3), "images_per_minute": round(images_per_minute, 2)}
+    summary.update(options)
+    summary["prompts"] = sum(r.get("prompts", 0) for r in records)
+    summary["write_blocked_seconds"] = round(sum(r.get("write_blocked_seconds", 0.0) for r in records), 3)
+    summary["sam_calls_avoided"] = avoided
+    summary["oom_retries"] = sum(r.get("oom_retries", 0) for r in records)
+    fallback_levels = [r["fallback_level"] for r in records if "fallback_level" in r]
+    if fallback_levels:
+        summary["fallback_levels"] = {level: fallback_levels.count(level) for level in FALLBACK_LEVELS}
+    # an image matching its own entry from an earlier run is a cache hit, not a duplicate pair
+    summary["duplicates"] = [[r["image"], r["duplicate_of"]] for r in records
+                             if r.get("duplicate_of") and r["duplicate_of"] != r["image"]]
+    if summary["duplicates"]:
+        print(f"   ♻️ {len(summary['duplicates'])} near-duplicate images reused stored segments")
+    return summary
+
+
+def segmentation_fingerprint(model_type: str, backend: str = "auto", prompt_density: str = "fixed",
+                             bypass_trivial: bool = False, time_budget_s: float = None) -> str:
+    """Config fingerprint of the hash index: segments are only reused under the same settings."""
+    return config_fingerprint(model_type=model_type if backend != "saliency" else None, backend=backend,
+                              prompt_density=prompt_density, bypass_trivial=bypass_trivial,
+                              time_budget_s=time_budget_s)
+
+
+def drop_unwritten_segments(records: list, failed_paths) -> int:
+    """
+    Remove the segments whose crop the background writer failed to write, so objects and
+    segments in the manifest only count files that are on disk.
+
+    Returns:
+        int: Number of segments removed (also stored per record as write_failed).
+    """
+    failed = set(failed_paths)
+    removed = 0
+    for record in records:
+        kept = [segment for segment in record["segments"] if segment["file"] not in failed]
+        if len(kept) < len(record["segments"]):
+            record["write_failed"] = len(record["segments"]) - len(kept)
+            removed += record["write_failed"]
+            record["segments"][:] = kept  # in place: hash-index entries share the list
+            record["objects"] = len(kept)
+    if removed:
+        print(f"⚠️ {removed} crops could not be written and were dropped from the manifest")
+    return removed
+
+
+def register_in_hash_index(hash_index: PerceptualHashIndex, record: dict):
+    """
+    Add a freshly segmented image to the perceptual-hash index.
+
+    Images that fell back below the full settings (time budget or out of memory) are not
+    registered, so their degraded segments are never reused.
+    """
+    if record.get("fallback_level", "full") != "full":
+        return
+    if hash_index is not None and "phash" in record and not record.get("duplicate_of"):
+        hash_index.add(int(record["phash"], 16), record["image"], record["segments"], record.get("size"))
+
+
+def append_telemetry(records: list, telemetry_path: str):
+    """
+    Append the settings each SAM image finally succeeded with to a JSON-lines log.
+
+    One line per image (size, settings, OOM retries, peak RSS, SAM seconds, fallback level);
+    the file accumulates across runs so defaults can be tuned from real books.
+    """
+    fields = ("size", "prompts", "settings", "oom_retries", "peak_rss_mb", "peak_cuda_mb", "sam_seconds",
+              "fallback_level", "fallback_settings")
+    lines = [{"image": r["image"], **{key: r[key] for key in fields if key in r}}
+             for r in records if "settings" in r]
+    if not lines:
+        return
+    with open(telemetry_path, "a", encoding="utf-8") as f:
+        for line in lines:
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+    print(f"📝 Settings telemetry for {len(lines)} images appended to {telemetry_path}")
+
+
+def write_manifest(records: list, output_dir: str, summary: dict = None) -> str:
+    """Write the per-image segmentation records (plus an optional run summary) to JSON."""
+    manifest_path = os.path.join(output_dir, "segmentation_manifest.json")
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump({"summary": summary or {}, "images": records}, f, indent=2, ensure_ascii=False)
+    print(f"🗂️ Segmentation manifest saved to {manifest_path}")
+    return manifest_path
+
 
 def process_folder(
         input_folder: str,
         output_dir: str,
         checkpoint_path: str,
-        model_type: str = "vit_h"
+        model_type: str = "vit_h",
+        num_workers: int = 1,
+        memory_budget_mb: float = None,
+        bypass_trivial: bool = False,
+        hash_index_path: str = None,
+        prompt_density: str = "fixed",
+        backend: str = "auto",
+        async_write: bool = False,
+        time_budget_s: float = None,
+        telemetry_path: str = None,
+        share_weights: bool = False,
+        runtime: str = "torch",
+        onnx_options: dict = None
 ):
-    """Main function to process all input images in a folder."""
-    # Load model
-    sam_model = load_sam_model(checkpoint_path, model_type)
+    """
+    Main function to process all input images in a folder.
+
+    With num_workers > 1 the images are split over a pool of worker processes,
+    each pinned to its own slice of CPU cores (see parallel_segment.py).
+    With memory_budget_mb, points_per_batch and the working resolution are adapted
+    per image from the measured peak RSS to stay within the budget.
+    With bypass_trivial, small/uniform images skip SAM (reported per book).
+    With hash_index_path, a persistent perceptual-hash index lets near-duplicate images
+    (across runs and books) reuse stored segments; duplicate pairs go to the manifest.
+    prompt_density: 'fixed' (32x32 grid), 'adaptive' or 'sparse' (see prompt_density.py).
+    backend: 'auto' (automatic mask generator), 'prompted' (saliency prompts + SamPredictor)
+    or 'saliency' (no SAM: salient component boxes, seconds per book on CPU).
+    With async_write, crops are written by a background pool (AsyncImageWriter) that is
+    flushed before returning; the time spent blocked on its queue is reported, and crops
+    that failed to write are dropped from the manifest.
+    With time_budget_s, an image that would take longer falls back to lower resolution,
+    fewer prompts and finally the whole image (see time_budget.py).
+    Out-of-memory errors never abort the run: the image is retried at lower resolution,
+    smaller points_per_batch and without crop layers. The settings every image finally
+    succeeded with are appended to telemetry_path (default: segmentation_telemetry.jsonl
+    in output_dir).
+    With share_weights (num_workers > 1), SAM is loaded once and shared read-only by all workers.
+    runtime: 'torch' or 'onnx' (ONNX Runtime CPU sessions, see onnx_sam.py; onnx_options sets
+    graph_optimization / intra_op_threads / inter_op_threads).
+    """
+    if num_workers > 1:
+        from .parallel_segment import process_folder_parallel
+        return process_folder_parallel(input_folder, output_dir, checkpoint_path, model_type, num_workers,
+                                       memory_budget_mb=memory_budget_mb, hash_index_path=hash_index_path,
+                                       bypass_trivial=bypass_trivial, prompt_density=prompt_density,
+                                       backend=backend, async_write=async_write,
+                                       time_budget_s=time_budget_s, telemetry_path=telemetry_path,
+                                       share_weights=share_weights,
+                                       start_method="fork" if share_weights else "spawn",
+                                       runtime=runtime, onnx_options=onnx_options)
+
+    # Load model (the saliency backend does not need SAM)
+    sam_model = load_sam_model(checkpoint_path, model_type, runtime=runtime,
+                               onnx_options=onnx_options) if backend != "saliency" else None
 
     # Get input files
     input_files = get_input_files(input_folder)
@@ -104,10 +588,38 @@ def process_folder(
     #create_output_dir(output_dir)
 
     # Process each file
+    start = time.perf_counter()
+    records = []
+    settings = dict(DEFAULT_SETTINGS) if memory_budget_mb else None
+    hash_index = PerceptualHashIndex(
+        hash_index_path,
+        config=segmentation_fingerprint(model_type, backend, prompt_density, bypass_trivial, time_budget_s)
+    ) if hash_index_path else None
+    writer = AsyncImageWriter() if async_write else None
     for image_path in input_files:
-        segment_and_save_objects(image_path, sam_model, output_dir)
+        record = segment_and_save_objects(image_path, sam_model, output_dir, settings, bypass_trivial, hash_index,
+                                          prompt_density, backend, writer, time_budget_s)
+        settings = next_image_settings(settings, record, memory_budget_mb)
+        register_in_hash_index(hash_index, record)
+        records.append(record)
+    writer_stats = writer.close() if writer is not None else None
+    if writer_stats is not None:
+        drop_unwritten_segments(records, writer_stats.pop("failed_paths"))
+    elapsed = time.perf_counter() - start
+
+    if hash_index is not None:
+        hash_index.save()
+
+    summary = build_summary(records, elapsed, workers=1, memory_budget_mb=memory_budget_mb,
+                            bypass_trivial=bypass_trivial, prompt_density=prompt_density, backend=backend,
+                            time_budget_s=time_budget_s, runtime=runtime)
+    if writer_stats is not None:
+        summary["writer"] = writer_stats
+    write_manifest(records, output_dir, summary)
+    append_telemetry(records, telemetry_path or os.path.join(output_dir, "segmentation_telemetry.jsonl"))
 
     print("\n✅ All images processed successfully!")
+    return records
 
 
 # ------------------------------
@@ -0,0 +1,315 @@
+import os
+import time
+import torch
+import numpy as np
+from torch import nn
+from segment_anything import sam_model_registry, SamPredictor
+
+# ONNX Runtime graph optimization levels by name
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+OPSET_VERSION = 17
+
+
+def onnx_paths(onnx_dir: str, model_type: str) -> dict:
+    """File names of the exported encoder/decoder graphs for a model type."""
+    return {
+        "encoder": os.path.join(onnx_dir, f"sam_{model_type}_encoder.onnx"),
+        "decoder": os.path.join(onnx_dir, f"sam_{model_type}_decoder.onnx"),
+    }
+
+
+class _MaskDecoderGraph(nn.Module):
+    """
+    Export wrapper around MaskDecoder.predict_masks.
+
+    All mask tokens are returned; the multimask slicing of MaskDecoder.forward is a
+    Python bool and is applied after ONNX Runtime (see OnnxMaskDecoder).
+    """
+
+    def __init__(self, mask_decoder):
+        super().__init__()
+        self.mask_decoder = mask_decoder
+
+    def forward(self, image_embeddings, image_pe, sparse_prompt_embeddings, dense_prompt_embeddings):
+        return self.mask_decoder.predict_masks(image_embeddings, image_pe,
+                                               sparse_prompt_embeddings, dense_prompt_embeddings)
+
+
+def export_sam_onnx(checkpoint_path: str, model_type: str = "vit_h", onnx_dir: str = None) -> dict:
+    """
+    Export SAM's image encoder and mask decoder to ONNX.
+
+    The prompt encoder and the mask post-processing stay in PyTorch (they are cheap).
+    The decoder has a dynamic prompt batch, so SamAutomaticMaskGenerator's points_per_batch
+    and SamPredictor's box batches run through the same graph. Graphs over 2 GB (vit_h
+    encoder) are written with external weight files next to the .onnx.
+
+    Returns:
+        dict: {"encoder": path, "decoder": path}
+    """
+    onnx_dir = onnx_dir or os.path.dirname(checkpoint_path)
+    os.makedirs(onnx_dir, exist_ok=True)
+    paths = onnx_paths(onnx_dir, model_type)
+
+    print(f"📦 Exporting SAM ({model_type}) to ONNX in {onnx_dir}...")
+    sam = sam_model_registry[model_type](checkpoint=checkpoint_path).eval()
+    img_size = sam.image_encoder.img_size
+
+    with torch.no_grad():
+        torch.onnx.export(
+            sam.image_encoder,
+            (torch.randn(1, 3, img_size, img_size),),
+            paths["encoder"],
+            input_names=["image"],
+            output_names=["image_embeddings"],
+            dynamic_axes={"image": {0: "batch"}, "image_embeddings": {0: "batch"}},
+            opset_version=OPSET_VERSION,
+            dynamo=False,
+        )
+    export_mask_decoder(sam.mask_decoder, sam.prompt_encoder.embed_dim, sam.prompt_encoder.image_embedding_size,
+                        paths["decoder"])
+    print(f"✅ Exported {paths['encoder']} and {paths['decoder']}")
+    return paths
+
+
+def export_mask_decoder(mask_decoder, embed_dim: int, embedding_size: tuple, path: str):
+    """
+    Export MaskDecoder.predict_masks with a dynamic prompt batch (traced with 4 prompts;
+    the parity test checks other batch sizes).
+    """
+    embed_h, embed_w = embedding_size
+    with torch.no_grad():
+        torch.onnx.export(
+            _MaskDecoderGraph(mask_decoder),
+            (
+                torch.randn(1, embed_dim, embed_h, embed_w),
+                torch.randn(1, embed_dim, embed_h, embed_w),
+                torch.randn(4, 2, embed_dim),
+                torch.randn(4, embed_dim, embed_h, embed_w),
+            ),
+            path,
+            input_names=["image_embeddings", "image_pe", "sparse_prompt_embeddings", "dense_prompt_embeddings"],
+            output_names=["masks", "iou_predictions"],
+            dynamic_axes={
+                "sparse_prompt_embeddings": {0: "prompts", 1: "tokens"},
+                "dense_prompt_embeddings": {0: "prompts"},
+                "masks": {0: "prompts"},
+                "iou_predictions": {0: "prompts"},
+            },
+            opset_version=OPSET_VERSION,
+            dynamo=False,
+        )
+
+
+def create_session(path: str, graph_optimization: str = "all", intra_op_threads: int = None,
+                   inter_op_threads: int = 1, optimized_model_path: str = None, cpu_mem_arena: bool = True):
+    """
+    Create an ONNX Runtime CPU session.
+
+    Args:
+        path (str): .onnx file.
+        graph_optimization (str): 'disable', 'basic', 'extended' or 'all'.
+        intra_op_threads (int): Threads inside one operator (None = ORT default, all cores).
+        inter_op_threads (int): Threads across independent operators (SAM is a chain, 1 is enough).
+        optimized_model_path (str): Optionally save the optimized graph for inspection.
+        cpu_mem_arena (bool): Keep ORT's memory arena. Faster, but it holds on to the encoder's
+            peak activations (GBs at 1024 px); turn it off where RSS matters more than speed.
+    """
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = getattr(ort.GraphOptimizationLevel,
+                                               GRAPH_OPTIMIZATION_LEVELS[graph_optimization])
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    if intra_op_threads:
+        options.intra_op_num_threads = intra_op_threads
+    options.inter_op_num_threads = inter_op_threads
+    options.enable_cpu_mem_arena = cpu_mem_arena
+    if optimized_model_path:
+        options.optimized_model_filepath = optimized_model_path
+    return ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+
+class OnnxImageEncoder(nn.Module):
+    """Drop-in for sam.image_encoder backed by an ONNX Runtime session (keeps img_size)."""
+
+    def __init__(self, session, img_size: int):
+        super().__init__()
+        self.session = session
+        self.img_size = img_size
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        (embeddings,) = self.session.run(["image_embeddings"],
+                                         {"image": x.detach().cpu().numpy().astype(np.float32)})
+        return torch.from_numpy(embeddings).to(x.device)
+
+
+class OnnxMaskDecoder(nn.Module):
+    """Drop-in for sam.mask_decoder backed by an ONNX Runtime session."""
+
+    def __init__(self, session):
+        super().__init__()
+        self.session = session
+
+    def forward(self, image_embeddings, image_pe, sparse_prompt_embeddings, dense_prompt_embeddings,
+                multimask_output: bool):
+        inputs = {
+            "image_embeddings": image_embeddings,
+            "image_pe": image_pe,
+            "sparse_prompt_embeddings": sparse_prompt_embeddings,
+            "dense_prompt_embeddings": dense_prompt_embeddings,
+        }
+        masks, iou_pred = self.session.run(
+            ["masks", "iou_predictions"],
+            {name: t.detach().cpu().numpy().astype(np.float32) for name, t in inputs.items()})
+        masks = torch.from_numpy(masks).to(image_embeddings.device)
+        iou_pred = torch.from_numpy(iou_pred).to(image_embeddings.device)
+
+        # same selection as MaskDecoder.forward
+        mask_slice = slice(1, None) if multimask_output else slice(0, 1)
+        return masks[:, mask_slice, :, :], iou_pred[:, mask_slice]
+
+
+def ensure_onnx_exported(checkpoint_path: str, model_type: str = "vit_h", onnx_dir: str = None) -> dict:
+    """
+    Export the graphs unless they already exist; returns onnx_paths.
+
+    Call it once before starting worker processes, so they do not all export the same files at once.
+    """
+    onnx_dir = onnx_dir or os.path.dirname(checkpoint_path)
+    paths = onnx_paths(onnx_dir, model_type)
+    if not all(os.path.exists(p) for p in paths.values()):
+        export_sam_onnx(checkpoint_path, model_type, onnx_dir)
+    return paths
+
+
+def load_onnx_sam(checkpoint_path: str, model_type: str = "vit_h", onnx_dir: str = None, **session_kwargs):
+    """
+    Load SAM with its image encoder and mask decoder running in ONNX Runtime.
+
+    The graphs are exported on first use (ensure_onnx_exported). The returned model works
+    unchanged with SamAutomaticMaskGenerator and SamPredictor; session_kwargs go to
+    create_session (graph_optimization, intra_op_threads, inter_op_threads).
+    """
+    paths = ensure_onnx_exported(checkpoint_path, model_type, onnx_dir)
+
+    print(f"🔧 Loading SAM model ({model_type}) with ONNX Runtime on cpu...")
+    sam = sam_model_registry[model_type](checkpoint=checkpoint_path).eval()
+    # replacing the modules also frees their PyTorch weights
+    sam.image_encoder = OnnxImageEncoder(create_session(paths["encoder"], **session_kwargs),
+                                         sam.image_encoder.img_size)
+    sam.mask_decoder = OnnxMaskDecoder(create_session(paths["decoder"], **session_kwargs))
+    return sam
+
+
+# ------------------------------
+# Parity check against PyTorch
+# ------------------------------
+def mask_iou(a: np.ndarray, b: np.ndarray) -> float:
+    """Intersection over union of two boolean masks (1.0 if both are empty)."""
+    union = np.logical_or(a, b).sum()
+    return float(np.logical_and(a, b).sum() / union) if union else 1.0
+
+
+def grid_points(shape, points_per_side: int = 4) -> np.ndarray:
+    """A regular grid of (x, y) point prompts in image coordinates."""
+    h, w = shape[:2]
+    offsets = (np.arange(points_per_side) + 0.5) / points_per_side
+    xs, ys = np.meshgrid(offsets * w, offsets * h)
+    return np.stack([xs.ravel(), ys.ravel()], axis=1)
+
+
+def _predict_grid(predictor: SamPredictor, image: np.ndarray, points: np.ndarray):
+    """Masks for every point prompt in one batch; returns (masks, seconds)."""
+    start = time.perf_counter()
+    predictor.set_image(image)
+    coords = torch.as_tensor(predictor.transform.apply_coords(points, image.shape[:2]),
+                             dtype=torch.float, device=predictor.device)[:, None, :]
+    labels = torch.ones(coords.shape[:2], dtype=torch.int, device=predictor.device)
+    with torch.no_grad():
+        masks, _, _ = predictor.predict_torch(coords, labels, multimask_output=False)
+    predictor.reset_image()
+    return masks[:, 0].cpu().numpy(), time.perf_counter() - start
+
+
+def check_parity(torch_sam, onnx_sam, image_paths: list, points_per_side: int = 4) -> dict:
+    """
+    Compare the masks of the PyTorch and ONNX Runtime models on the same point prompts.
+
+    Returns:
+        dict: {"images": [{image, mean_iou, min_iou, torch_seconds, onnx_seconds}], "mean_iou", "min_iou"}
+    """
+    import cv2
+
+    torch_predictor, onnx_predictor = SamPredictor(torch_sam), SamPredictor(onnx_sam)
+    results = []
+    for image_path in image_paths:
+        image = cv2.cvtColor(cv2.imread(image_path), cv2.COLOR_BGR2RGB)
+        points = grid_points(image.shape, points_per_side)
+        torch_masks, torch_seconds = _predict_grid(torch_predictor, image, points)
+        onnx_masks, onnx_seconds = _predict_grid(onnx_predictor, image, points)
+        ious = [mask_iou(a, b) for a, b in zip(torch_masks, onnx_masks)]
+        results.append({
+            "image": image_path,
+            "mean_iou": round(float(np.mean(ious)), 4),
+            "min_iou": round(float(np.min(ious)), 4),
+            "torch_seconds": round(torch_seconds, 3),
+            "onnx_seconds": round(onnx_seconds, 3),
+        })
+        print(f"   {os.path.basename(image_path)}: mean IoU {results[-1]['mean_iou']:.4f}, "
+              f"min {results[-1]['min_iou']:.4f}, torch {torch_seconds:.1f}s vs onnx {onnx_seconds:.1f}s")
+
+    return {
+        "images": results,
+        "mean_iou": round(float(np.mean([r["mean_iou"] for r in results])), 4) if results else None,
+        "min_iou": min((r["min_iou"] for r in results), default=None),
+    }
+
+
+def parity_check_pdf(pdf_path: str, work_dir: str, checkpoint_path: str, model_type: str = "vit_h",
+                     onnx_dir: str = None, min_iou: float = 0.95, **session_kwargs) -> dict:
+    """
+    Extract the images of a PDF and check that the ONNX backend reproduces the PyTorch masks.
+
+    Passes when every mask of every image has IoU >= min_iou with its PyTorch counterpart.
+    """
+    from .extract_pdf import process_pdf
+    from .object_extract import get_input_files
+
+    pdf_name = os.path.splitext(os.path.basename(pdf_path))[0]
+    process_pdf(pdf_path, work_dir, os.path.join(work_dir, f"marked_{pdf_name}.pdf"),
+                os.path.join(work_dir, f"{pdf_name}.json"))
+    image_paths = sorted(get_input_files(work_dir, f"input_{pdf_name}_*"))
+
+    torch_sam = sam_model_registry[model_type](checkpoint=checkpoint_path).eval()
+    # without the arena, ORT releases the encoder activations between images (both models are in memory)
+    onnx_sam = load_onnx_sam(checkpoint_path, model_type, onnx_dir, **{"cpu_mem_arena": False, **session_kwargs})
+    report = check_parity(torch_sam, onnx_sam, image_paths)
+    report["passed"] = report["min_iou"] is not None and report["min_iou"] >= min_iou
+    print(f"{'✅' if report['passed'] else '❌'} ONNX parity on {len(image_paths)} images: "
+          f"mean IoU {report['mean_iou']}, min IoU {report['min_iou']} (threshold {min_iou})")
+    return report
+
+
+# ------------------------------
+# Example usage
+# ------------------------------
+if __name__ == "__main__":
+    dir = "/home/melahi/code/image/segment-anything/documents/"
+    checkpoint_path = dir + "sam_vit_h_4b8939.pth"
+    model_type = "vit_h"
+
+    export_sam_onnx(checkpoint_path, model_type, onnx_dir=dir + "onnx/")
+    parity_check_pdf(
+        pdf_path="testFolder/input/book_Bruggen_Israels_Machtelt_Piero_del.pdf",
+        work_dir=dir + "onnx_parity/",
+        checkpoint_path=checkpoint_path,
+        model_type=model_type,
+        onnx_dir=dir + "onnx/",
+        graph_optimization="all",
+    )
@@ -0,0 +1,302 @@
+import os
+import queue
+import time
+import multiprocessing as mp
+from multiprocessing.util import Finalize
+import torch
+from .async_writer import AsyncImageWriter
+from .memory_budget import DEFAULT_SETTINGS, rss_breakdown_mb
+from .object_extract import (load_sam_model, get_input_files, segment_and_save_objects,
+                             build_summary, write_manifest, process_folder, register_in_hash_index,
+                             append_telemetry, segmentation_fingerprint, drop_unwritten_segments,
+                             next_image_settings)
+from .phash_index import PerceptualHashIndex
+
+# Per-process state, filled in by the pool initializer
+_worker = {}
+
+
+def available_cores() -> list:
+    """Return the CPU cores this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def partition_cores(cores: list, num_workers: int) -> list:
+    """
+    Split the available cores into num_workers contiguous, non-overlapping slices.
+
+    Leftover cores (when len(cores) is not divisible by num_workers) go to the first workers.
+    """
+    num_workers = max(1, min(num_workers, len(cores)))
+    size, extra = divmod(len(cores), num_workers)
+    slices, start = [], 0
+    for i in range(num_workers):
+        end = start + size + (1 if i < extra else 0)
+        slices.append(cores[start:end])
+        start = end
+    return slices
+
+
+def load_shared_sam(checkpoint_path: str, model_type: str = "vit_h"):
+    """
+    Load SAM once in the parent and move its weights into shared memory.
+
+    share_memory() backs every parameter and buffer with a shared-memory segment, so forked
+    workers never copy-on-write the weights (refcount updates touch the Python objects, not
+    the tensor storage) and spawned workers receive handles to the same segments instead
+    of pickled copies. (CLIP is not needed here: it only runs in the matching stage,
+    in a single process.)
+    """
+    sam_model = load_sam_model(checkpoint_path, model_type, device="cpu").eval().share_memory()
+    print(f"🔗 Loaded SAM once into shared memory (parent RSS {rss_breakdown_mb().get('rss', 0.0):.0f} MB)")
+    return sam_model
+
+
+def _init_worker(core_slices, worker_counter, checkpoint_path, model_type, memory_budget_mb=None,
+                 hash_index_path=None, segment_kwargs=None, shared_sam=None, runtime="torch",
+                 onnx_options=None, hash_config=None, writer_stats=None):
+    """
+    Pool initializer: claim a core slice, pin to it and get SAM for this worker.
+
+    With shared_sam the parent's shared-memory weights are used; otherwise every
+    worker loads its own copy of SAM (unless not needed).
+    """
+    with worker_counter.get_lock():
+        worker_id = worker_counter.value
+        worker_counter.value += 1
+    cores = core_slices[worker_id % len(core_slices)]
+
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+    torch.set_num_interop_threads(1)
+
+    print(f"🧵 Worker {worker_id} (pid {os.getpid()}) pinned to cores {cores[0]}-{cores[-1]}")
+    _worker["id"] = worker_id
+    needs_sam = (segment_kwargs or {}).get("backend", "auto") != "saliency"
+    if shared_sam is not None:
+        _worker["sam_model"] = shared_sam
+    elif needs_sam:
+        # an ONNX Runtime session gets the worker's core slice unless told otherwise
+        onnx_options = {"intra_op_threads": len(cores), **(onnx_options or {})}
+        _worker["sam_model"] = load_sam_model(checkpoint_path, model_type, device="cpu", runtime=runtime,
+                                              onnx_options=onnx_options)
+    else:
+        _worker["sam_model"] = None
+    _worker["memory_budget_mb"] = memory_budget_mb
+    _worker["settings"] = dict(DEFAULT_SETTINGS) if memory_budget_mb else None
+    _worker["segment_kwargs"] = dict(segment_kwargs or {})
+    if _worker["segment_kwargs"].pop("async_write", False):
+        # flushed when the worker process exits (the pool is closed and joined, not terminated)
+        writer = AsyncImageWriter()
+        _worker["segment_kwargs"]["writer"] = writer
+        Finalize(None, _flush_writer, args=(writer, writer_stats), exitpriority=10)
+    if hash_index_path:
+        # read-only snapshot; the parent registers this run's new images after the pool finishes
+        _worker["segment_kwargs"]["hash_index"] = PerceptualHashIndex(hash_index_path, config=hash_config)
+
+
+def _flush_writer(writer, writer_stats):
+    """Flush the worker's crop writer at exit and report its statistics to the parent."""
+    stats = writer.close()
+    if writer_stats is not None:
+        writer_stats.put({"worker": _worker["id"], **stats})
+
+
+def collect_writer_stats(writer_stats) -> list:
+    """Writer statistics the workers reported on exit (one dict per worker process)."""
+    stats = []
+    while True:
+        try:
+            stats.append(writer_stats.get_nowait())
+        except queue.Empty:
+            return sorted(stats, key=lambda s: s["worker"])
+
+
+def _segment_job(job):
+    """Segment a single image inside a worker process; outputs are written by the worker itself."""
+    image_path, output_dir = job
+    record = segment_and_save_objects(image_path, _worker["sam_model"], output_dir, _worker["settings"],
+                                      **_worker["segment_kwargs"])
+    record["worker"] = _worker["id"]
+    record["worker_memory_mb"] = rss_breakdown_mb()
+    # every worker adapts its own settings against the (per-worker) budget
+    _worker["settings"] = next_image_settings(_worker["settings"], record, _worker["memory_budget_mb"])
+    return record
+
+
+def process_folder_parallel(
+        input_folder: str,
+        output_dir: str,
+        checkpoint_path: str,
+        model_type: str = "vit_h",
+        num_workers: int = 4,
+        start_method: str = "spawn",
+        memory_budget_mb: float = None,
+        hash_index_path: str = None,
+        share_weights: bool = False,
+        runtime: str = "torch",
+        onnx_options: dict = None,
+        telemetry_path: str = None,
+        **segment_kwargs
+):
+    """
+    Segment all input images with a pool of SAM worker processes.
+
+    The cores of the machine are split into num_workers slices; every worker is pinned to
+    its slice and uses a matching torch.set_num_threads, which avoids the poor scaling of
+    torch's intra-op threading beyond ~8 cores. Workers pull images from a shared job list
+    and write their crops independently. memory_budget_mb applies to each worker; any other
+    keyword (e.g. bypass_trivial) is passed to segment_and_save_objects.
+    Workers look up duplicates in the hash index as it was at start-up, so duplicates
+    within the same run are only detected by the single-process path.
+
+    With share_weights the parent loads SAM once and the workers share its weights
+    read-only instead of loading a copy each; use
+    start_method="fork" for copy-on-write inheritance, "spawn" passes shared-memory handles.
+    Every record carries the worker's RSS breakdown (worker_memory_mb) so the saving is visible.
+    runtime='onnx' gives every worker its own ONNX Runtime sessions (sessions cannot be
+    shared across processes, so share_weights is ignored for it).
+    With async_write, every worker flushes its crop writer on exit and reports the result;
+    crops that failed to write are dropped from the records before the manifest is written.
+    """
+    input_files = get_input_files(input_folder)
+    core_slices = partition_cores(available_cores(), num_workers)
+    print(f"🔧 Starting {len(core_slices)} SAM workers with {len(core_slices[0])} threads each...")
+
+    shared_sam = None
+    if share_weights and runtime == "onnx":
+        print("⚠️ ONNX Runtime sessions are per process; loading SAM in every worker instead of sharing it.")
+        share_weights = False
+    needs_sam = segment_kwargs.get("backend", "auto") != "saliency"
+    if share_weights and not needs_sam:
+        share_weights = False  # no SAM to share
+    if runtime == "onnx" and needs_sam:
+        # export in the parent: workers that all found the graphs missing would export them concurrently
+        from .onnx_sam import ensure_onnx_exported
+        ensure_onnx_exported(checkpoint_path, model_type, (onnx_options or {}).get("onnx_dir"))
+    if share_weights:
+        shared_sam = load_shared_sam(checkpoint_path, model_type)
+        # torch's context registers the reducers that pass tensors as shared-memory handles
+        ctx = torch.multiprocessing.get_context(start_method)
+    else:
+        ctx = mp.get_context(start_method)
+    hash_config = segmentation_fingerprint(model_type, segment_kwargs.get("backend", "auto"),
+                                           segment_kwargs.get("prompt_density", "fixed"),
+                                           segment_kwargs.get("bypass_trivial", False),
+                                           segment_kwargs.get("time_budget_s"))
+    worker_counter = ctx.Value("i", 0)
+    writer_stats = ctx.Queue() if segment_kwargs.get("async_write") else None
+    jobs = [(image_path, output_dir) for image_path in input_files]
+
+    start = time.perf_counter()
+    pool = ctx.Pool(len(core_slices), initializer=_init_worker,
+                    initargs=(core_slices, worker_counter, checkpoint_path, model_type, memory_budget_mb,
+                              hash_index_path, segment_kwargs, shared_sam, runtime, onnx_options, hash_config,
+                              writer_stats))
+    try:
+        records = list(pool.imap_unordered(_segment_job, jobs, chunksize=1))
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()  # lets workers exit normally so their crop writers flush
+    elapsed = time.perf_counter() - start
+
+    worker_writers = collect_writer_stats(writer_stats) if writer_stats is not None else []
+    drop_unwritten_segments(records, [path for stats in worker_writers for path in stats.pop("failed_paths")])
+
+    if hash_index_path:
+        hash_index = PerceptualHashIndex(hash_index_path, config=hash_config)
+        for record in records:
+            register_in_hash_index(hash_index, record)
+        hash_index.save()
+
+    summary = build_summary(records, elapsed, workers=len(core_slices), memory_budget_mb=memory_budget_mb,
+                            share_weights=share_weights, runtime=runtime, **segment_kwargs)
+    summary["worker_memory_mb"] = report_worker_memory(records)
+    if worker_writers:
+        summary["writer"] = {"written": sum(w["written"] for w in worker_writers),
+                             "failed": sum(w["failed"] for w in worker_writers),
+                             "workers": worker_writers}
+    write_manifest(records, output_dir, summary)
+    append_telemetry(records, telemetry_path or os.path.join(output_dir, "segmentation_telemetry.jsonl"))
+
+    print("\n✅ All images processed successfully!")
+    return records
+
+
+def report_worker_memory(records: list) -> dict:
+    """
+    Print and return the peak RSS breakdown observed for every worker.
+
+    'rss' counts the shared weights in every worker; 'anon' is what each worker
+    really adds on top of them.
+
+    Returns:
+        dict: {worker_id: {"rss", "anon", "file", "shmem"}} (MB)
+    """
+    per_worker = {}
+    for record in records:
+        memory = record.get("worker_memory_mb")
+        if not memory:
+            continue
+        peak = per_worker.setdefault(record["worker"], {})
+        for key, value in memory.items():
+            peak[key] = max(peak.get(key, 0.0), value)
+
+    print("\n🧠 Worker memory (MB)")
+    for worker_id, memory in sorted(per_worker.items()):
+        print(f"   worker {worker_id}: rss {memory.get('rss', 0.0):.0f}, private {memory.get('anon', 0.0):.0f}, "
+              f"shared {memory.get('shmem', 0.0):.0f}")
+    return {str(worker_id): memory for worker_id, memory in sorted(per_worker.items())}
+
+
+def benchmark_workers(
+        input_folder: str,
+        output_dir: str,
+        checkpoint_path: str,
+        model_type: str = "vit_h",
+        worker_counts=(1, 4, 8)
+) -> dict:
+    """
+    Compare images per minute of the single-process baseline against worker pools.
+
+    Note that the pool timings include loading SAM in every worker.
+
+    Returns:
+        dict: {num_workers: images_per_minute}
+    """
+    results = {}
+    for num_workers in worker_counts:
+        start = time.perf_counter()
+        if num_workers == 1:
+            records = process_folder(input_folder, output_dir, checkpoint_path, model_type)
+        else:
+            records = process_folder_parallel(input_folder, output_dir, checkpoint_path, model_type, num_workers)
+        elapsed = time.perf_counter() - start
+        results[num_workers] = 60.0 * len(records) / elapsed if elapsed > 0 else 0.0
+
+    baseline = results.get(1)
+    print("\n📊 Segmentation throughput")
+    for num_workers, images_per_minute in results.items():
+        speedup = f" ({images_per_minute / baseline:.2f}x)" if baseline else ""
+        print(f"   {num_workers:>3} workers: {images_per_minute:.2f} images/min{speedup}")
+    return results
+
+
+# ------------------------------
+# Example usage
+# ------------------------------
+if __name__ == "__main__":
+    dir = "/home/melahi/code/image/segment-anything/documents/"
+    benchmark_workers(
+        input_folder=dir + "input/",
+        output_dir=dir + "segmented_objects/",
+        checkpoint_path=dir + "models/sam_vit_h_4b8939.pth",
+        model_type="vit_h",
+        worker_counts=(1, 8, 16)
+    )
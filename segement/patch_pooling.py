@@ -0,0 +1,182 @@
+import json
+import os
+import cv2
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+from segment_anything.utils.amg import rle_to_mask
+from torch.utils.data import DataLoader
+from torchvision.transforms import Compose, Resize, ToTensor, Normalize, InterpolationMode
+from .clip_encode import DEFAULT_BATCH_SIZE, DEFAULT_NUM_WORKERS, ImageFileDataset, encode_images
+
+
+def _convert_image_to_rgb(image):
+    return image.convert("RGB")
+
+
+def full_image_transform(n_px: int):
+    """
+    CLIP preprocessing without the center crop: the whole main image is resized to
+    n_px × n_px, so every SAM mask stays inside the patch grid.
+    """
+    return Compose([
+        Resize((n_px, n_px), interpolation=InterpolationMode.BICUBIC),
+        _convert_image_to_rgb,
+        ToTensor(),
+        Normalize((0.48145466, 0.4578275, 0.40821073), (0.26862954, 0.26130258, 0.27577711)),
+    ])
+
+
+def load_segment_masks(manifest_path: str) -> dict:
+    """Segment file name → (segment record {file, bbox[, mask]}, image size [h, w]) from segmentation_manifest.json."""
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        records = json.load(f)["images"]
+    segments = {}
+    for record in records:
+        for segment in record.get("segments", []):
+            if "size" in record:
+                segments[os.path.basename(segment["file"])] = (segment, record["size"])
+    return segments
+
+
+def segment_mask(segment: dict, size: list):
+    """
+    A segment's SAM mask in image coordinates, or None if its bbox lies outside the image.
+
+    The mask comes from the RLE stored with the segment; segments written before masks
+    were stored fall back to the crop's non-black pixels. Masks reused from a near-duplicate
+    at another resolution are resized to the (rescaled) bbox, and bboxes are clipped to the image.
+    """
+    x, y, w, h = segment["bbox"]
+    if "mask" in segment:
+        local = rle_to_mask(segment["mask"])
+    else:
+        with Image.open(segment["file"]) as crop:
+            local = np.asarray(crop.convert("RGB")).any(axis=2)
+    if w <= 0 or h <= 0 or local.size == 0:
+        return None
+    if local.shape != (h, w):
+        local = cv2.resize(local.astype(np.uint8), (w, h), interpolation=cv2.INTER_NEAREST).astype(bool)
+    if not local.any():
+        local = np.ones((h, w), dtype=bool)
+
+    mask = np.zeros(size, dtype=bool)
+    x0, y0, x1, y1 = max(x, 0), max(y, 0), min(x + w, size[1]), min(y + h, size[0])
+    if x0 >= x1 or y0 >= y1:
+        return None
+    mask[y0:y1, x0:x1] = local[y0 - y:y1 - y, x0 - x:x1 - x]
+    return mask
+
+
+def mask_patch_weights(mask: np.ndarray, grid: int) -> torch.Tensor:
+    """Fraction of each of the grid × grid patches covered by the mask, flattened to (grid * grid,)."""
+    mask = torch.from_numpy(mask).float()[None, None]
+    return F.interpolate(mask, size=(grid, grid), mode="area").flatten()
+
+
+def pool_patch_features(patches: torch.Tensor, weights: torch.Tensor) -> torch.Tensor:
+    """
+    Mask-weighted average of patch features, L2-normalized.
+
+    Args:
+        patches (torch.Tensor): (grid, grid, D) patch features of one main image.
+        weights (torch.Tensor): (S, grid * grid) patch coverage of S masks.
+
+    Returns:
+        torch.Tensor: (S, D) pooled features.
+    """
+    patches = patches.reshape(-1, patches.shape[-1]).float()
+    weights = weights.to(patches.device)
+    pooled = weights @ patches / weights.sum(dim=1, keepdim=True).clamp_min(1e-6)
+    return pooled / pooled.norm(dim=-1, keepdim=True)
+
+
+def encode_image_patches(paths: list, model, device, batch_size: int = DEFAULT_BATCH_SIZE,
+                         num_workers: int = DEFAULT_NUM_WORKERS) -> torch.Tensor:
+    """Patch features (N, grid, grid, D) of full main images, one ViT forward per image."""
+    loader = DataLoader(
+        ImageFileDataset(paths, full_image_transform(model.visual.input_resolution)),
+        batch_size=batch_size,
+        num_workers=num_workers,
+        pin_memory=str(device).startswith("cuda"),
+    )
+    features = []
+    with torch.no_grad():
+        for batch in loader:
+            _, patches = model.encode_image_patches(batch.to(device, non_blocking=True))
+            features.append(patches)
+    return torch.cat(features)
+
+
+def encode_segments_pooled(image_to_subimages: dict, manifest_path: str, model, preprocess, device,
+                           batch_size: int = DEFAULT_BATCH_SIZE,
+                           num_workers: int = DEFAULT_NUM_WORKERS) -> torch.Tensor:
+    """
+    Segment features from one CLIP pass per main image instead of one per segment.
+
+    Each main image is encoded once (model.encode_image_patches) and every segment's
+    feature is the average of the patch features inside its SAM mask (stored with the
+    segment in the manifest, see segment_mask). Patch tokens are less aligned with text
+    than the class token, so this trades some matching accuracy for far fewer forwards.
+    Segments missing from the manifest, or whose mask falls outside the image, are
+    encoded from their crops as before.
+
+    Args:
+        image_to_subimages (dict): main image → list of segment files (find_subimages_for_images).
+        manifest_path (str): segmentation_manifest.json of the segment folder.
+        model: CLIP model with a ViT image encoder.
+        preprocess: CLIP preprocess transform (for the fallback crops).
+        device: Device of the model.
+
+    Returns:
+        torch.Tensor: (S, D) L2-normalized features in model.dtype, segments in dict order.
+    """
+    segments = load_segment_masks(manifest_path) if os.path.exists(manifest_path) else {}
+    grid = model.visual.input_resolution // model.visual.conv1.kernel_size[0]
+    weights = {}  # only the patch coverage is kept, not the full-size masks
+    for sub_imgs in image_to_subimages.values():
+        for sub_img in sub_imgs:
+            entry = segments.get(os.path.basename(sub_img))
+            mask = segment_mask(*entry) if entry is not None else None
+            if mask is not None:
+                weights[sub_img] = mask_patch_weights(mask, grid)
+    main_images = [main_img for main_img, sub_imgs in image_to_subimages.items()
+                   if any(sub_img in weights for sub_img in sub_imgs)]
+    patches = dict(zip(main_images, encode_image_patches(main_images, model, device, batch_size, num_workers)
+                       if main_images else []))
+
+    features, fallback = [], []
+    for main_img, sub_imgs in image_to_subimages.items():
+        for sub_img in sub_imgs:
+            if sub_img not in weights:
+                fallback.append((len(features), sub_img))
+                features.append(None)
+                continue
+            features.append(pool_patch_features(patches[main_img], weights[sub_img][None])[0])
+
+    if fallback:
+        encoded = encode_images([path for _, path in fallback], model, preprocess, device, batch_size, num_workers)
+        for (index, _), feature in zip(fallback, encoded):
+            features[index] = feature.float()
+    print(f"🧩 Pooled {len(features) - len(fallback)} segments from {len(main_images)} main-image passes, "
+          f"{len(fallback)} crops encoded separately")
+    if not features:
+        return torch.empty(0, model.visual.output_dim, device=device, dtype=model.dtype)
+    # same dtype as the text features (fp16 on CUDA)
+    return torch.stack(features).to(dtype=model.dtype)
+
+
+if __name__ == "__main__":
+    import clip
+    from .fileUtils import find_images, find_subimages_for_images
+
+    # Example usage
+    dir = "/home/melahi/code/image/segment-anything/documents/"
+    segment_dir = dir + "segmented_objects/"
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model, preprocess = clip.load("ViT-B/32", device=device)
+    image_to_subimages = find_subimages_for_images(find_images(dir + "output/", "book"), segment_dir)
+    features = encode_segments_pooled(image_to_subimages, segment_dir + "segmentation_manifest.json",
+                                      model, preprocess, device)
+    print(features.shape)
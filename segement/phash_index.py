@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+import cv2
+import numpy as np
+
+# Hamming distance (out of 64 bits) up to which two images count as the same reproduction
+MAX_DISTANCE = 6
+
+
+def phash(image: np.ndarray) -> int:
+    """
+    64-bit perceptual hash (DCT of a 32x32 grayscale thumbnail, 8x8 low frequencies vs. their median).
+
+    Robust to rescaling, JPEG re-encoding and small colour shifts between reproductions.
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    bits = low > np.median(low[1:])  # the DC term would dominate the median
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+
+def dhash(image: np.ndarray) -> int:
+    """64-bit difference hash (horizontal gradient signs of a 9x8 thumbnail); cheaper, less robust."""
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+
+def hamming_distances(hashes: np.ndarray, value: int) -> np.ndarray:
+    """Hamming distance between every uint64 hash and value."""
+    xor = np.bitwise_xor(hashes, np.uint64(value))
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(xor)
+    return np.unpackbits(xor.view(np.uint8)).reshape(-1, 64).sum(axis=1)
+
+
+def config_fingerprint(**config) -> str:
+    """Short stable hash of the settings that determine an image's segments (e.g. backend, model_type)."""
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+
+class PerceptualHashIndex:
+    """
+    Persistent index of perceptual hashes of extracted main images and their segments.
+
+    Stored as JSON: [{"hash": "<16 hex digits>", "config": fingerprint, "image": path, "size": [h, w],
+    "segments": [{"file", "bbox", "mask"}, ...]}, ...]
+    Entries made under another config (config_fingerprint of the segmentation settings)
+    are never returned, so changing the backend, SAM model or prompt grid re-segments.
+    """
+
+    def __init__(self, path: str, max_distance: int = MAX_DISTANCE, config: str = None):
+        self.path = path
+        self.max_distance = max_distance
+        self.config = config
+        self.entries = []
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        self._hashes = np.array([int(e["hash"], 16) for e in self.entries], dtype=np.uint64)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, value: int, wait=None):
+        """
+        Return the closest known entry within max_distance, made under the same config,
+        whose segment files still exist, else None.
+
+        wait (e.g. AsyncImageWriter.wait) is called with a candidate's segment files before
+        checking them, so crops still being written in the background are not missed.
+        """
+        if not self.entries:
+            return None
+        distances = hamming_distances(self._hashes, value)
+        for i in np.argsort(distances, kind="stable"):
+            if distances[i] > self.max_distance:
+                break
+            entry = self.entries[i]
+            if entry.get("config") != self.config:
+                continue
+            if wait is not None:
+                wait([s["file"] for s in entry["segments"]])
+            if entry["segments"] and all(os.path.exists(s["file"]) for s in entry["segments"]):
+                return entry
+        return None
+
+    def add(self, value: int, image_path: str, segments: list, size: list = None):
+        """Register a segmented image (ignored if it has no segments); size [h, w] is what its bboxes refer to."""
+        if not segments:
+            return
+        entry = {"hash": f"{value:016x}", "config": self.config, "image": image_path, "segments": segments}
+        if size is not None:
+            entry["size"] = list(size)
+        self.entries.append(entry)
+        self._hashes = np.append(self._hashes, np.uint64(value))
+
+    def save(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, indent=2, ensure_ascii=False)
+        print(f"🗂️ Perceptual-hash index ({len(self.entries)} images) saved to {self.path}")
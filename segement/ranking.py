@@ -0,0 +1,48 @@
+import torch
+
+MIN_PARAGRAPH_WORDS = 3  # find_best_paragraphs only considers paragraphs with more cleaned words
+
+
+def valid_paragraph_mask(cleaned_texts: list, min_words: int = MIN_PARAGRAPH_WORDS) -> torch.Tensor:
+    """Boolean tensor: True for paragraphs whose cleaned text has more than min_words words."""
+    return torch.tensor([len(text.split()) > min_words for text in cleaned_texts], dtype=torch.bool)
+
+
+def rank_paragraphs(similarities: torch.Tensor, paragraphs: list, top_k: int = None) -> list:
+    """
+    Rank the paragraphs for every image by similarity (highest first).
+
+    Without top_k every paragraph is ranked with a full sort, as before. With top_k,
+    paragraphs that find_best_paragraphs would ignore (<= MIN_PARAGRAPH_WORDS cleaned words)
+    are masked to -inf and only the torch.topk best remain, so the best valid paragraph
+    (and everything downstream) is unchanged. Equal scores keep paragraph order in both cases.
+
+    Args:
+        similarities (torch.Tensor): (images, paragraphs) similarity matrix.
+        paragraphs (list): (page, para_index, para, cleaned_text) tuples.
+        top_k (int): Number of paragraphs to keep per image (None = all).
+
+    Returns:
+        list: Per image, a list of (page, para_index, para, cleaned_text, similarity) tuples.
+    """
+    similarities = similarities.detach().float().cpu()
+    if top_k is None:
+        return [
+            sorted(
+                [(para[0], para[1], para[2], para[3], float(sims[i])) for i, para in enumerate(paragraphs)],
+                key=lambda x: x[4],
+                reverse=True
+            )
+            for sims in similarities.numpy()
+        ]
+
+    valid = valid_paragraph_mask([para[3] for para in paragraphs])
+    masked = similarities.masked_fill(~valid, float("-inf"))
+    values, indices = torch.topk(masked, min(top_k, int(valid.sum())), dim=1)
+
+    ranked = []
+    for row_values, row_indices in zip(values.tolist(), indices.tolist()):
+        # topk does not promise an order among equal scores; restore paragraph order
+        pairs = sorted(zip(row_values, row_indices), key=lambda x: (-x[0], x[1]))
+        ranked.append([(*paragraphs[i], score) for score, i in pairs])
+    return ranked
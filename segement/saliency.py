@@ -0,0 +1,115 @@
+import threading
+import cv2
+import numpy as np
+
+_local = threading.local()
+
+
+def create_saliency_detector():
+    """OpenCV spectral residual saliency detector (cheap, no model weights)."""
+    return cv2.saliency.StaticSaliencySpectralResidual_create()
+
+
+def get_thread_detector():
+    """The calling thread's saliency detector, created on first use and reused afterwards."""
+    if not hasattr(_local, "detector"):
+        _local.detector = create_saliency_detector()
+    return _local.detector
+
+
+def _spectral_residual(image: np.ndarray, detector=None) -> np.ndarray:
+    """Raw float32 saliency map in [0, 1]."""
+    if detector is None:
+        detector = get_thread_detector()
+    success, saliency_map = detector.computeSaliency(image)
+    if not success:
+        raise RuntimeError("Saliency computation failed.")
+    return saliency_map
+
+
+def compute_saliency_map(image: np.ndarray, detector=None) -> np.ndarray:
+    """
+    Spectral residual saliency of an image, normalized to [0, 1].
+
+    Args:
+        image (np.ndarray): BGR or RGB image (the detector works on intensity).
+        detector: Optional detector; by default the calling thread's detector is reused.
+
+    Returns:
+        np.ndarray: float32 (H, W) saliency map.
+    """
+    saliency_map = _spectral_residual(image, detector)
+    return cv2.normalize(saliency_map.astype(np.float32), None, 0, 1, cv2.NORM_MINMAX)
+
+
+def salient_mask(image: np.ndarray, detector=None):
+    """
+    Saliency map (uint8, 0–255) and its Otsu-thresholded binary mask.
+
+    Returns:
+        (saliency_uint8, mask): both (H, W) uint8 arrays.
+    """
+    saliency_map = _spectral_residual(image, detector)
+
+    # Convert saliency to 0–255 for thresholding
+    saliency_uint8 = (saliency_map * 255).astype("uint8")
+
+    # Threshold (Otsu automatically finds best threshold)
+    _, mask = cv2.threshold(saliency_uint8, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return saliency_uint8, mask
+
+
+def salient_components(image: np.ndarray, max_components: int = 5, min_area_ratio: float = 0.01,
+                       detector=None) -> list:
+    """
+    Connected components of the salient mask, largest first.
+
+    Nearby fragments are merged with a morphological closing before labelling, so a
+    figure yields one component rather than a cloud of specks.
+
+    Returns:
+        list[dict]: {"bbox": [x, y, w, h], "centroid": [x, y], "area": int} per component.
+    """
+    _, mask = salient_mask(image, detector)
+    h, w = mask.shape
+    kernel_size = max(3, (min(h, w) // 50) | 1)
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (kernel_size, kernel_size))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+
+    count, _, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    components = []
+    for label in range(1, count):  # label 0 is the background
+        x, y, bw, bh, area = stats[label]
+        if area < min_area_ratio * h * w:
+            continue
+        components.append({
+            "bbox": [int(x), int(y), int(bw), int(bh)],
+            "centroid": [float(centroids[label][0]), float(centroids[label][1])],
+            "area": int(area),
+        })
+    components.sort(key=lambda c: c["area"], reverse=True)
+    return components[:max_components]
+
+
+def saliency_segments(image: np.ndarray, max_components: int = 5, detector=None) -> list:
+    """
+    SAM-free segmentation: one rectangular segment per salient component.
+
+    Returns mask records in the SamAutomaticMaskGenerator format (segmentation, area,
+    bbox) so they can be saved like SAM masks; the whole image is returned as a single
+    segment when nothing salient is found.
+    """
+    h, w = image.shape[:2]
+    components = salient_components(image, max_components=max_components, detector=detector)
+    boxes = [c["bbox"] for c in components] or [[0, 0, w, h]]
+
+    records = []
+    for x, y, bw, bh in boxes:
+        segmentation = np.zeros((h, w), dtype=bool)
+        segmentation[y:y + bh, x:x + bw] = True
+        records.append({
+            "segmentation": segmentation,
+            "area": int(bw * bh),
+            "bbox": [x, y, bw - 1, bh - 1],
+        })
+    return records
@@ -0,0 +1,67 @@
+import time
+from segment_anything import SamAutomaticMaskGenerator
+from .prompt_density import MIN_POINTS_PER_SIDE
+
+# Fallback ladder, from full quality to no SAM at all
+FALLBACK_LEVELS = ("full", "lower_resolution", "fewer_prompts", "whole_image")
+FALLBACK_SIDE = 1024          # working resolution (longest side) of the lower levels
+FALLBACK_BUDGET_FRACTION = 0.5  # share of the image budget each fallback level gets
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised by DeadlineMaskGenerator when the image's time budget runs out."""
+
+
+class DeadlineMaskGenerator(SamAutomaticMaskGenerator):
+    """
+    SamAutomaticMaskGenerator that gives up once time.perf_counter() passes a deadline.
+
+    The deadline is checked before every crop (i.e. before the image encoder runs) and
+    before every batch of point prompts, so an image overshoots by at most one encoder
+    pass or one decoder batch.
+    """
+
+    def __init__(self, model, deadline: float, **kwargs):
+        super().__init__(model, **kwargs)
+        self.deadline = deadline
+
+    def _check_deadline(self):
+        if time.perf_counter() > self.deadline:
+            raise DeadlineExceeded("per-image time budget exceeded")
+
+    def _process_crop(self, *args, **kwargs):
+        self._check_deadline()
+        return super()._process_crop(*args, **kwargs)
+
+    def _process_batch(self, *args, **kwargs):
+        self._check_deadline()
+        return super()._process_batch(*args, **kwargs)
+
+
+def fallback_plan(settings: dict, generator_kwargs: dict, image_shape, time_budget_s: float) -> list:
+    """
+    The SAM attempts for one image under a time budget, in order.
+
+    'full' gets the whole budget; 'lower_resolution' (longest side <= FALLBACK_SIDE) and
+    'fewer_prompts' (same resolution, MIN_POINTS_PER_SIDE grid, no crop layers) get
+    FALLBACK_BUDGET_FRACTION of it each. 'whole_image' needs no SAM and is not listed.
+    A lower level that would not be cheaper than the previous one is skipped.
+
+    Returns:
+        list: (level, settings, generator_kwargs, seconds) tuples.
+    """
+    settings = dict(settings or {})
+    fallback_seconds = time_budget_s * FALLBACK_BUDGET_FRACTION
+    plan = [("full", settings, dict(generator_kwargs), time_budget_s)]
+
+    longest = settings.get("max_side") or max(image_shape[:2])
+    low_side = min(FALLBACK_SIDE, longest // 2)
+    low_settings = dict(settings, max_side=low_side)
+    if low_side < longest:
+        plan.append(("lower_resolution", low_settings, dict(generator_kwargs), fallback_seconds))
+
+    sparse_kwargs = {key: value for key, value in generator_kwargs.items() if key != "point_grids"}
+    sparse_kwargs.update(points_per_side=MIN_POINTS_PER_SIDE, crop_n_layers=0)
+    plan.append(("fewer_prompts", low_settings if low_side < longest else settings, sparse_kwargs,
+                 fallback_seconds))
+    return plan
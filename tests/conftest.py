@@ -0,0 +1,15 @@
+import pytest
+import torch
+
+from clip.model import CLIP
+
+
+@pytest.fixture
+def tiny_clip():
+    """Factory for a tiny, randomly initialised ViT CLIP (no weights download); defaults to 64 px, 16 px patches."""
+    def build(image_resolution=64, patch_size=16):
+        torch.manual_seed(0)
+        return CLIP(embed_dim=32, image_resolution=image_resolution, vision_layers=2, vision_width=64,
+                    vision_patch_size=patch_size, context_length=8, vocab_size=100, transformer_width=32,
+                    transformer_heads=2, transformer_layers=1).eval()
+    return build
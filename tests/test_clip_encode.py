@@ -0,0 +1,71 @@
+import numpy as np
+import torch
+from PIL import Image
+
+from clip.clip import _transform
+import segement.clip_encode as clip_encode
+from segement.clip_encode import (encode_images, encode_images_adaptive, encode_images_cached, open_image_cache,
+                                  resolution_bucket)
+
+
+def _crops(folder, count, size=(40, 30)):
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(count):
+        paths.append(str(folder / f"crop_{i}.png"))
+        Image.fromarray(rng.integers(0, 255, (size[1], size[0], 3), dtype=np.uint8)).save(paths[-1])
+    return paths
+
+
+def test_small_crops_are_encoded_at_their_bucket(tmp_path, tiny_clip):
+    model = tiny_clip(image_resolution=224, patch_size=32)  # ViT-B/32 geometry
+    rng = np.random.default_rng(0)
+    paths = []
+    for i, size in enumerate([(300, 250), (60, 80), (140, 400), (90, 90)]):
+        paths.append(str(tmp_path / f"crop_{i}.png"))
+        Image.fromarray(rng.integers(0, 255, (size[1], size[0], 3), dtype=np.uint8)).save(paths[-1])
+
+    assert [resolution_bucket(Image.open(p).size) for p in paths] == [224, 96, 160, 96]
+    features = encode_images_adaptive(paths, model, "cpu", batch_size=2, num_workers=0)
+
+    for path, n_px in zip(paths, [224, 96, 160, 96]):
+        expected = encode_images([path], model, _transform(n_px), "cpu", num_workers=0)[0]
+        assert torch.allclose(features[paths.index(path)], expected, atol=1e-5)
+    # the trained grid keeps the original positional embedding
+    assert model.visual.positional_embedding_for((7, 7)) is model.visual.positional_embedding
+    assert model.visual.positional_embedding_for((3, 3)).shape == (10, 64)
+
+
+def test_batches_keep_the_input_order(tmp_path, tiny_clip):
+    model, preprocess = tiny_clip(), _transform(64)
+    paths = _crops(tmp_path, 5)
+
+    one_by_one = torch.cat([encode_images([p], model, preprocess, "cpu", num_workers=0) for p in paths])
+    for batch_size, num_workers in [(2, 0), (3, 2), (8, 0)]:
+        batched = encode_images(paths, model, preprocess, "cpu", batch_size=batch_size, num_workers=num_workers)
+        assert batched.shape == (5, 32)
+        assert torch.allclose(batched, one_by_one, atol=1e-5)
+
+
+def test_changed_preprocess_misses_the_cache(tmp_path, tiny_clip, monkeypatch):
+    model = tiny_clip()
+    paths = _crops(tmp_path, 3)
+    encoded = []
+    encode = clip_encode.encode_images
+
+    def counting_encode(paths, *args, **kwargs):
+        encoded.extend(paths)
+        return encode(paths, *args, **kwargs)
+
+    monkeypatch.setattr(clip_encode, "encode_images", counting_encode)
+    cache_dir = str(tmp_path / "cache")
+    for preprocess, misses in [(_transform(64), 3), (_transform(64), 0), (_transform(48), 3)]:
+        encoded.clear()
+        cache = open_image_cache(cache_dir, "tiny", preprocess)
+        features = encode_images_cached(paths, model, preprocess, "cpu", cache, num_workers=0)
+        assert len(encoded) == misses and features.shape == (3, 32)
+
+    assert open_image_cache(cache_dir, "tiny", _transform(64)).index_path != \
+        open_image_cache(cache_dir, "tiny", _transform(48)).index_path
+    assert open_image_cache(cache_dir, "tiny", _transform(64)).index_path != \
+        open_image_cache(cache_dir, "tiny", _transform(64), resolution_buckets=(96, 224)).index_path
@@ -0,0 +1,29 @@
+import numpy as np
+
+from segement.embedding_cache import EmbeddingCache, content_key, encode_with_cache
+
+
+def test_cache_persists_and_encodes_only_misses(tmp_path):
+    rng = np.random.default_rng(0)
+    table = {t: rng.standard_normal(8) for t in ["a", "b", "c"]}
+    encoded = []
+
+    def encode(texts):
+        def fn(indices):
+            encoded.extend(texts[i] for i in indices)
+            return np.stack([table[texts[i]] for i in indices])
+        return fn
+
+    first = ["a", "b", "a"]
+    cache = EmbeddingCache(str(tmp_path), "text_test")
+    cold = encode_with_cache(cache, [content_key(t) for t in first], encode(first))
+    assert encoded == ["a", "b"]
+
+    second = ["b", "c", "a"]
+    cache = EmbeddingCache(str(tmp_path), "text_test")  # reloaded from disk (memory-mapped)
+    warm = encode_with_cache(cache, [content_key(t) for t in second], encode(second))
+    assert encoded == ["a", "b", "c"]
+
+    assert warm.dtype == np.float32
+    np.testing.assert_array_equal(cold[1], warm[0])  # the same float16 values on every run
+    np.testing.assert_allclose(warm[1], table["c"], rtol=1e-3, atol=1e-3)
@@ -0,0 +1,20 @@
+import numpy as np
+
+from segement.image_filter import classify_trivial_image, whole_image_mask
+
+
+def test_blank_and_tiny_images_are_trivial():
+    assert classify_trivial_image(np.full((600, 800, 3), 230, dtype=np.uint8)) == "uniform"
+    assert classify_trivial_image(np.random.default_rng(0).integers(0, 255, (90, 400, 3), dtype=np.uint8)) == "small"
+
+    gradient = np.repeat(np.linspace(0, 255, 800, dtype=np.uint8)[None, :, None], 600, axis=0).repeat(3, axis=2)
+    assert classify_trivial_image(gradient) == "few_edges"  # colour variance, but no structure
+
+
+def test_textured_image_goes_to_sam():
+    rng = np.random.default_rng(0)
+    image = np.kron(rng.integers(0, 255, (40, 50, 3), dtype=np.uint8), np.ones((15, 16, 1), dtype=np.uint8))
+
+    assert classify_trivial_image(image) is None
+    mask = whole_image_mask(image)
+    assert len(mask) == 1 and mask[0]["segmentation"].shape == image.shape[:2] and mask[0]["segmentation"].all()
@@ -0,0 +1,19 @@
+import json
+
+from segement.marge_json import add_rects_to_image_json, merge_rects
+
+
+def test_in_memory_merge_matches_file_merge(tmp_path):
+    summary = [{"Main Image": "a.jpeg", "Most Frequent Page": 1}, {"Main Image": "missing.jpeg"}]
+    details = {"images": [{"file": "a.jpeg", "rects": [[0, 0, 10, 10]]}], "paragraphs": []}
+    summary_path, details_path = tmp_path / "final.json", tmp_path / "book.json"
+    summary_path.write_text(json.dumps(summary))
+    details_path.write_text(json.dumps(details))
+
+    from_files = add_rects_to_image_json(str(summary_path), str(details_path), str(tmp_path / "out1.json"))
+    in_memory = add_rects_to_image_json(None, str(details_path), str(tmp_path / "out2.json"), summary_data=summary)
+
+    assert from_files == in_memory == merge_rects(summary, details)
+    assert in_memory[0]["rects"] == [[0, 0, 10, 10]] and in_memory[1]["rects"] == []
+    assert "rects" not in summary[0]  # the summary itself is left untouched
+    assert json.loads((tmp_path / "out2.json").read_text()) == in_memory
@@ -0,0 +1,41 @@
+import numpy as np
+
+from segement.mask_scoring import rank_masks, score_masks
+
+
+def _random_masks(rng, shape, count):
+    masks = []
+    for _ in range(count):
+        seg = np.zeros(shape, dtype=bool)
+        y, x = rng.integers(0, shape[0] - 10), rng.integers(0, shape[1] - 10)
+        h, w = rng.integers(1, shape[0] - y), rng.integers(1, shape[1] - x)
+        seg[y:y + h, x:x + w] = rng.random((h, w)) > 0.3
+        ys, xs = np.nonzero(seg)
+        bbox = [xs.min(), ys.min(), xs.max() - xs.min(), ys.max() - ys.min()]
+        masks.append({"segmentation": seg, "area": int(seg.sum()), "bbox": bbox})
+    return masks
+
+
+def test_score_masks_matches_loop():
+    rng = np.random.default_rng(0)
+    weight_map = rng.random((60, 80)).astype(np.float32)
+    masks = _random_masks(rng, weight_map.shape, 25)
+
+    expected = [weight_map[m["segmentation"]].mean() * m["area"] for m in masks]
+    assert np.allclose(score_masks(masks, weight_map), expected, rtol=1e-5)
+
+    # without bbox the full mask is scanned and must give the same scores
+    no_bbox = [{"segmentation": m["segmentation"], "area": m["area"]} for m in masks]
+    assert np.allclose(score_masks(no_bbox, weight_map), expected, rtol=1e-5)
+
+
+def test_rank_masks_top_n():
+    rng = np.random.default_rng(1)
+    weight_map = rng.random((40, 40))
+    masks = _random_masks(rng, weight_map.shape, 10)
+
+    ranked = rank_masks(masks, weight_map, top_n=3)
+    expected = sorted(((weight_map[m["segmentation"]].mean() * m["area"], i) for i, m in enumerate(masks)),
+                      reverse=True)[:3]
+    ids = {id(m): i for i, m in enumerate(masks)}
+    assert [ids[id(m)] for _, m in ranked] == [i for _, i in expected]
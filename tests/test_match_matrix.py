@@ -0,0 +1,112 @@
+import json
+
+import numpy as np
+import pytest
+import torch
+
+from segement.aggregate_most_fre_para import find_most_frequent_paragraphs
+from segement.find_best_paragraphs import find_best_paragraphs
+from segement.match_matrix import blocked_top_k, match_book, match_book_blocked, match_book_windowed
+from segement.ranking import rank_paragraphs
+
+
+def _book(seed):
+    rng = np.random.default_rng(seed)
+    words = ["madonna", "child", "angel", "gold", "panel", "saint", "altar", "piero"]
+    paragraphs = []
+    for i in range(40):
+        cleaned = " ".join(rng.choice(words, size=rng.integers(1, 8)))
+        paragraphs.append((1 + i // 8, 1 + i % 8, {"text": cleaned, "bbox": [0, i, 10, i + 1]}, cleaned))
+    image_to_subimages = {
+        f"input_book_page{m}_img1.jpeg": [f"book_page{m}_img1_object_{j:03d}.png" for j in range(rng.integers(0, 9))]
+        for m in range(1, 7)
+    }
+    num_segments = sum(len(v) for v in image_to_subimages.values())
+    # a few favoured paragraphs and coarse values, so that repeated votes and ties actually occur
+    favoured = np.zeros(len(paragraphs))
+    favoured[rng.choice(len(paragraphs), size=4, replace=False)] = 0.5
+    similarities = np.round(rng.random((num_segments, len(paragraphs))) * 0.6 + favoured, 1).astype(np.float32)
+    return image_to_subimages, similarities, paragraphs
+
+
+def _json_pipeline(image_to_subimages, similarities, paragraphs):
+    global_results, offset = [], 0
+    for main_img, sub_imgs in image_to_subimages.items():
+        rows = torch.from_numpy(similarities[offset:offset + len(sub_imgs)])
+        offset += len(sub_imgs)
+        images = [{"Image": name, "Ranked Paragraphs": [
+            {"Page": int(p), "Paragraph": int(n), "Original Text": str(o), "Cleaned Text": str(c),
+             "Similarity": float(s)} for p, n, o, c, s in ranked]}
+            for name, ranked in zip(sub_imgs, rank_paragraphs(rows, paragraphs))]
+        global_results.append({"main_image": main_img, "Images": images})
+
+    best = json.loads(json.dumps(find_best_paragraphs(json.loads(json.dumps(global_results)))))
+    return best, json.loads(json.dumps(find_most_frequent_paragraphs(best)))
+
+
+def test_matrix_engine_matches_json_pipeline():
+    for seed in range(5):
+        image_to_subimages, similarities, paragraphs = _book(seed)
+        expected_best, expected_final = _json_pipeline(image_to_subimages, similarities, paragraphs)
+        best, final = match_book(image_to_subimages, similarities, paragraphs)
+
+        assert best == expected_best
+        assert final == expected_final
+
+
+def _features(image_to_subimages, paragraphs, seed):
+    # small integer features: every dot product is exact, whatever the matmul blocking
+    rng = np.random.default_rng(seed)
+    num_segments = sum(len(v) for v in image_to_subimages.values())
+    return (rng.integers(-3, 4, (num_segments, 16)).astype(np.float32),
+            rng.integers(-3, 4, (len(paragraphs), 16)).astype(np.float32))
+
+
+def test_page_window_restricts_and_widens():
+    image_to_subimages, _, paragraphs = _book(1)
+    image_features, text_features = _features(image_to_subimages, paragraphs, 1)
+    dense = match_book(image_to_subimages, image_features @ text_features.T, paragraphs)
+
+    assert match_book_windowed(image_to_subimages, image_features, text_features, paragraphs, window=10) == dense
+    # an unreachable threshold widens every segment to the whole book
+    assert match_book_windowed(image_to_subimages, image_features, text_features, paragraphs, window=0,
+                               widen_below=1e9) == dense
+
+    best, _ = match_book_windowed(image_to_subimages, image_features, text_features, paragraphs, window=0)
+    for record in best:
+        page = int(record["Image"].split("_page")[1].split("_")[0])
+        if page <= paragraphs[-1][0]:
+            assert record["Best Paragraph Page"] == page
+        else:  # no paragraphs on that page: widened to the nearest pages
+            assert record["Best Paragraph Page"] >= page - 2
+
+
+def test_blocked_top_k_matches_dense_scoring():
+    image_to_subimages, _, paragraphs = _book(2)
+    image_features, text_features = _features(image_to_subimages, paragraphs, 2)
+    dense = image_features @ text_features.T  # coarse integer scores: many ties
+    valid = np.array([len(p[3].split()) > 3 for p in paragraphs])
+
+    expected = np.argsort(-np.where(valid, dense, -np.inf), axis=1, kind="stable")[:, :5]
+    for tile_size in (1, 3, 7, 1000):
+        scores, indices = blocked_top_k(image_features, text_features, 5, valid, tile_size=tile_size)
+        assert np.array_equal(indices, expected)
+        assert np.array_equal(scores, np.take_along_axis(dense, expected, axis=1))
+
+    assert match_book_blocked(image_to_subimages, image_features, text_features, paragraphs, tile_size=4) == \
+        match_book(image_to_subimages, dense, paragraphs)
+
+
+@pytest.mark.parametrize("k", [1, 2, 3, 8])
+def test_blocked_top_k_breaks_ties_like_a_stable_sort(k):
+    rng = np.random.default_rng(k)
+    image_features = rng.integers(0, 3, (40, 4)).astype(np.float32)  # few distinct scores
+    text_features = rng.integers(0, 3, (57, 4)).astype(np.float32)
+    dense = image_features @ text_features.T
+    valid = rng.random(57) > 0.2
+
+    expected = np.argsort(-np.where(valid, dense, -np.inf), axis=1, kind="stable")[:, :k]
+    for tile_size in (1, 5, 16, 64):
+        scores, indices = blocked_top_k(image_features, text_features, k, valid, tile_size=tile_size)
+        assert np.array_equal(indices, expected)
+        assert np.array_equal(scores, np.take_along_axis(dense, expected, axis=1))
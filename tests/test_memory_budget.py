@@ -0,0 +1,54 @@
+import numpy as np
+
+import segement.object_extract as object_extract
+from segement.memory_budget import DEFAULT_SETTINGS, oom_retry_settings
+
+
+def test_oom_retry_lowers_every_knob_until_exhausted():
+    settings = dict(DEFAULT_SETTINGS, crop_n_layers=1)
+    retries = []
+    while settings is not None:
+        retries.append(settings)
+        settings = oom_retry_settings(settings, (3000, 2000, 3))
+
+    assert retries[1] == {"points_per_batch": 32, "max_side": 1500, "crop_n_layers": 0}
+    assert retries[-1]["points_per_batch"] == 8 and retries[-1]["max_side"] == 750
+    assert len(retries) == 4
+
+
+def test_oom_is_retried_then_kept_as_whole_image(monkeypatch):
+    calls = []
+
+    def out_of_memory(image, sam_model, deadline=None, **kwargs):
+        calls.append(kwargs)
+        raise RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB")
+
+    monkeypatch.setattr(object_extract, "generate_masks", out_of_memory)
+    record = {}
+    masks = object_extract.generate_masks_within_budget(np.zeros((1200, 1600, 3), dtype=np.uint8), None,
+                                                        DEFAULT_SETTINGS, record, crop_n_layers=1)
+
+    assert calls[0]["crop_n_layers"] == 1 and calls[1]["crop_n_layers"] == 0
+    assert record["oom_retries"] == len(calls) - 1
+    assert record["fallback_level"] == "whole_image"
+    assert len(masks) == 1
+
+
+def test_deadline_path_records_the_settings_that_succeeded(monkeypatch):
+    calls = []
+
+    def oom_once(image, sam_model, deadline=None, **kwargs):
+        calls.append(kwargs)
+        if len(calls) == 1:
+            raise RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB")
+        h, w = image.shape[:2]
+        return [{"segmentation": np.ones((h, w), dtype=bool), "bbox": [0, 0, w, h], "area": h * w}]
+
+    monkeypatch.setattr(object_extract, "generate_masks", oom_once)
+    record = {}
+    object_extract.generate_masks_with_deadline(np.zeros((1200, 1600, 3), dtype=np.uint8), None, 60.0,
+                                                DEFAULT_SETTINGS, record, points_per_side=32)
+
+    assert record["oom_retries"] == 1 and record["fallback_level"] == "full"
+    assert record["settings"] == oom_retry_settings(DEFAULT_SETTINGS, (1200, 1600, 3))
+    assert calls[1]["points_per_batch"] == record["settings"]["points_per_batch"]
@@ -0,0 +1,30 @@
+import pytest
+import torch
+
+from segement.onnx_sam import OnnxMaskDecoder, create_session, export_mask_decoder, mask_iou
+
+pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+
+
+def test_decoder_graph_matches_pytorch_for_any_prompt_batch(tmp_path):
+    from segment_anything import sam_model_registry
+
+    torch.manual_seed(0)
+    sam = sam_model_registry["vit_b"]().eval()
+    embed_dim, size = sam.prompt_encoder.embed_dim, sam.prompt_encoder.image_embedding_size
+    path = str(tmp_path / "decoder.onnx")
+    export_mask_decoder(sam.mask_decoder, embed_dim, size, path)
+    decoder = OnnxMaskDecoder(create_session(path, cpu_mem_arena=False))
+
+    embeddings, image_pe = torch.randn(1, embed_dim, *size), sam.prompt_encoder.get_dense_pe()
+    for prompts, tokens in [(1, 2), (3, 3), (4, 2), (17, 2)]:  # traced with 4 prompts, 2 tokens
+        sparse, dense = torch.randn(prompts, tokens, embed_dim), torch.randn(prompts, embed_dim, *size)
+        for multimask in (True, False):
+            with torch.no_grad():
+                expected, expected_iou = sam.mask_decoder(embeddings, image_pe, sparse, dense, multimask)
+            masks, iou = decoder(embeddings, image_pe, sparse, dense, multimask)
+
+            assert masks.shape == expected.shape
+            assert torch.allclose(iou, expected_iou, atol=1e-4)
+            assert min(mask_iou((m > 0).numpy(), (e > 0).numpy()) for m, e in zip(masks, expected)) > 0.999
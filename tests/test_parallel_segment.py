@@ -0,0 +1,49 @@
+from segement.parallel_segment import partition_cores
+
+
+def test_uneven_split_gives_leftover_cores_to_the_first_workers():
+    slices = partition_cores(list(range(10)), 4)
+
+    assert slices == [[0, 1, 2], [3, 4, 5], [6, 7], [8, 9]]
+    assert partition_cores([4, 5, 6, 7], 2) == [[4, 5], [6, 7]]
+
+
+def test_more_workers_than_cores_gets_one_core_each():
+    assert partition_cores([0, 1, 2], 8) == [[0], [1], [2]]
+    assert partition_cores([0, 1], 0) == [[0, 1]]
+
+
+def test_failed_async_writes_are_dropped_from_the_worker_records(tmp_path, monkeypatch):
+    import json
+    import os
+
+    import cv2
+    import numpy as np
+    from segement.parallel_segment import process_folder_parallel
+
+    rng = np.random.default_rng(0)
+    for name in ("input_book_page1_img1.png", "input_book_page2_img1.png"):
+        image = np.full((200, 300, 3), 235, dtype=np.uint8)
+        image[40:120, 50:150] = rng.integers(0, 255, (80, 100, 3), dtype=np.uint8)
+        cv2.imwrite(str(tmp_path / name), image)
+    imwrite = cv2.imwrite
+
+    def failing_imwrite(path, image, *args):
+        return False if "page2" in os.path.basename(path) else imwrite(path, image, *args)
+
+    # forked workers inherit the patched function
+    monkeypatch.setattr(cv2, "imwrite", failing_imwrite)
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    records = process_folder_parallel(str(tmp_path), str(output_dir), None, num_workers=2, start_method="fork",
+                                      backend="saliency", async_write=True)
+
+    with open(output_dir / "segmentation_manifest.json", encoding="utf-8") as f:
+        manifest = json.load(f)
+    by_page = {os.path.basename(r["image"]): r for r in manifest["images"]}
+    failed, written = by_page["input_book_page2_img1.png"], by_page["input_book_page1_img1.png"]
+    assert failed["objects"] == 0 and failed["segments"] == [] and failed["write_failed"] >= 1
+    assert written["objects"] == len(written["segments"]) >= 1
+    assert all(os.path.exists(s["file"]) for s in written["segments"])
+    assert manifest["summary"]["writer"]["failed"] == failed["write_failed"]
+    assert len(records) == 2
@@ -0,0 +1,100 @@
+import json
+
+import numpy as np
+import torch
+from PIL import Image
+
+from clip.clip import _transform
+from segement.clip_encode import encode_images
+from segement.patch_pooling import encode_image_patches, encode_segments_pooled
+
+
+def test_patch_api_keeps_the_class_token(tiny_clip):
+    model = tiny_clip()
+    images = torch.randn(3, 3, 64, 64)
+    with torch.no_grad():
+        cls, patches = model.encode_image_patches(images)
+        assert torch.allclose(cls, model.encode_image(images), atol=1e-5)
+    assert patches.shape == (3, 4, 4, 32)
+
+
+def test_segments_pool_the_patches_inside_their_mask(tmp_path, tiny_clip):
+    model, preprocess = tiny_clip(), _transform(64)
+    rng = np.random.default_rng(0)
+    main = tmp_path / "input_book_page1_img1.jpeg"
+    Image.fromarray(rng.integers(1, 255, (128, 128, 3), dtype=np.uint8)).save(main)
+
+    # the mask covers exactly the top-left patch (32 px of the 128 px image = 16 px of 64)
+    inside, outside = tmp_path / "book_page1_img1_object_001.png", tmp_path / "book_page1_img1_object_002.png"
+    Image.fromarray(np.full((32, 32, 3), 200, dtype=np.uint8)).save(inside)
+    Image.fromarray(np.full((20, 20, 3), 90, dtype=np.uint8)).save(outside)
+    manifest = tmp_path / "segmentation_manifest.json"
+    manifest.write_text(json.dumps({"summary": {}, "images": [
+        {"image": str(main), "size": [128, 128], "segments": [{"file": str(inside), "bbox": [0, 0, 32, 32]}]}]}))
+
+    image_to_subimages = {str(main): [str(inside), str(outside)]}
+    features = encode_segments_pooled(image_to_subimages, str(manifest), model, preprocess, "cpu", num_workers=0)
+
+    patch = encode_image_patches([str(main)], model, "cpu", num_workers=0)[0, 0, 0]
+    assert torch.allclose(features[0], patch / patch.norm(), atol=1e-5)
+    # not in the manifest: encoded from its crop as before
+    crop = encode_images([str(outside)], model, preprocess, "cpu", num_workers=0)[0]
+    assert torch.allclose(features[1], crop, atol=1e-5)
+
+
+def test_stored_masks_survive_black_pixels_and_rescaled_duplicates(tmp_path, monkeypatch, tiny_clip):
+    import cv2
+
+    import segement.object_extract as object_extract
+    from segement.phash_index import PerceptualHashIndex
+
+    def two_patches(image, sam_model, deadline=None, **kwargs):
+        h, w = image.shape[:2]
+        mask = np.zeros((h, w), dtype=bool)
+        mask[:h // 4 + 1, :w // 2 + 1] = True  # the bbox (end-exclusive) covers the top-left 2 × 1 patches
+        return [{"segmentation": mask, "area": int(mask.sum()), "predicted_iou": 1.0}]
+
+    monkeypatch.setattr(object_extract, "generate_masks", two_patches)
+    rng = np.random.default_rng(0)
+    artwork = cv2.resize(rng.integers(1, 255, (16, 16, 3), dtype=np.uint8), (128, 128),
+                         interpolation=cv2.INTER_NEAREST)
+    artwork[:32, 32:64] = 0  # a black area inside the mask
+    paths = [tmp_path / "input_book_page1_img1.png", tmp_path / "input_book_page2_img1.png"]
+    cv2.imwrite(str(paths[0]), artwork)
+    cv2.imwrite(str(paths[1]), cv2.resize(artwork, (64, 64), interpolation=cv2.INTER_NEAREST))
+
+    index, records = PerceptualHashIndex(str(tmp_path / "index.json")), []
+    for path in paths:
+        records.append(object_extract.segment_and_save_objects(str(path), None, str(tmp_path), hash_index=index))
+        object_extract.register_in_hash_index(index, records[-1])
+    manifest = object_extract.write_manifest(records, str(tmp_path))
+    assert records[1]["duplicate_of"] == str(paths[0]) and records[1]["segments"][0]["bbox"] == [0, 0, 32, 16]
+
+    model = tiny_clip()
+    image_to_subimages = {str(path): [record["segments"][0]["file"]] for path, record in zip(paths, records)}
+    features = encode_segments_pooled(image_to_subimages, manifest, model, _transform(64), "cpu", num_workers=0)
+
+    patches = encode_image_patches([str(p) for p in paths], model, "cpu", num_workers=0)
+    for feature, image_patches in zip(features, patches):
+        expected = image_patches[0, :2].mean(dim=0)  # both patches, including the black one
+        assert torch.allclose(feature, expected / expected.norm(), atol=1e-5)
+
+
+def test_pooled_features_follow_the_model_dtype(tmp_path, tiny_clip):
+    from clip.model import convert_weights
+
+    model = tiny_clip()
+    convert_weights(model)  # fp16 weights, as clip.load on CUDA
+    main, crop = tmp_path / "input_book_page1_img1.jpeg", tmp_path / "book_page1_img1_object_001.png"
+    Image.fromarray(np.full((64, 64, 3), 120, dtype=np.uint8)).save(main)
+    Image.fromarray(np.full((16, 16, 3), 200, dtype=np.uint8)).save(crop)
+    manifest = tmp_path / "segmentation_manifest.json"
+    manifest.write_text(json.dumps({"summary": {}, "images": [
+        {"image": str(main), "size": [64, 64], "segments": [{"file": str(crop), "bbox": [0, 0, 16, 16]}]}]}))
+
+    features = encode_segments_pooled({str(main): [str(crop)]}, str(manifest), model, _transform(64), "cpu",
+                                      num_workers=0)
+    text_features = torch.randn(5, 32, dtype=model.dtype)
+
+    assert features.dtype == model.dtype
+    assert (features @ text_features.T).shape == (1, 5)
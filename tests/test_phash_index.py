@@ -0,0 +1,105 @@
+import cv2
+import numpy as np
+
+import segement.object_extract as object_extract
+from segement.phash_index import PerceptualHashIndex
+
+
+def _artwork(path, size):
+    rng = np.random.default_rng(0)
+    image = cv2.resize(rng.integers(0, 255, (16, 16, 3), dtype=np.uint8), (size, size),
+                       interpolation=cv2.INTER_NEAREST)
+    cv2.imwrite(str(path), image)
+
+
+def test_rescaled_duplicate_gets_rescaled_bboxes(tmp_path, monkeypatch):
+    def one_square(image, sam_model, deadline=None, **kwargs):
+        mask = np.zeros(image.shape[:2], dtype=bool)
+        mask[40:120, 20:100] = True
+        return [{"segmentation": mask, "area": int(mask.sum()), "predicted_iou": 1.0}]
+
+    monkeypatch.setattr(object_extract, "generate_masks", one_square)
+    original, copy = tmp_path / "input_book_page1_img1.jpeg", tmp_path / "input_book_page2_img1.jpeg"
+    _artwork(original, 256)
+    _artwork(copy, 128)
+    index = PerceptualHashIndex(str(tmp_path / "index.json"))
+
+    first = object_extract.segment_and_save_objects(str(original), None, str(tmp_path), hash_index=index)
+    object_extract.register_in_hash_index(index, first)
+    second = object_extract.segment_and_save_objects(str(copy), None, str(tmp_path), hash_index=index)
+
+    assert second["duplicate_of"] == str(original)
+    assert first["segments"][0]["bbox"] == [20, 40, 79, 79]
+    assert second["segments"][0]["bbox"] == [10, 20, 40, 40]
+
+
+def test_duplicate_waits_for_crops_still_in_the_writer(tmp_path, monkeypatch):
+    import time
+    from segement.async_writer import AsyncImageWriter
+
+    imwrite = cv2.imwrite
+
+    def slow_imwrite(*args, **kwargs):
+        time.sleep(0.3)
+        return imwrite(*args, **kwargs)
+
+    def one_square(image, sam_model, deadline=None, **kwargs):
+        mask = np.zeros(image.shape[:2], dtype=bool)
+        mask[10:60, 10:60] = True
+        return [{"segmentation": mask, "area": int(mask.sum()), "predicted_iou": 1.0}]
+
+    monkeypatch.setattr(cv2, "imwrite", slow_imwrite)
+    monkeypatch.setattr(object_extract, "generate_masks", one_square)
+    original, copy = tmp_path / "input_book_page1_img1.jpeg", tmp_path / "input_book_page2_img1.jpeg"
+    _artwork(original, 128)
+    _artwork(copy, 128)
+    index, writer = PerceptualHashIndex(str(tmp_path / "index.json")), AsyncImageWriter()
+
+    first = object_extract.segment_and_save_objects(str(original), None, str(tmp_path), hash_index=index,
+                                                    writer=writer)
+    object_extract.register_in_hash_index(index, first)
+    second = object_extract.segment_and_save_objects(str(copy), None, str(tmp_path), hash_index=index,
+                                                     writer=writer)
+    writer.close()
+
+    assert second.get("duplicate_of") == str(original)
+    reused = cv2.imread(second["segments"][0]["file"])
+    assert reused is not None and reused.shape[:2] == (49, 49)
+
+
+def test_config_change_misses(tmp_path, monkeypatch):
+    def one_square(image, sam_model, deadline=None, **kwargs):
+        mask = np.zeros(image.shape[:2], dtype=bool)
+        mask[40:120, 20:100] = True
+        return [{"segmentation": mask, "area": int(mask.sum()), "predicted_iou": 1.0}]
+
+    monkeypatch.setattr(object_extract, "generate_masks", one_square)
+    original, copy = tmp_path / "input_book_page1_img1.jpeg", tmp_path / "input_book_page2_img1.jpeg"
+    _artwork(original, 256)
+    _artwork(copy, 256)
+    path = str(tmp_path / "index.json")
+    index = PerceptualHashIndex(path, config=object_extract.segmentation_fingerprint("vit_h"))
+    object_extract.register_in_hash_index(
+        index, object_extract.segment_and_save_objects(str(original), None, str(tmp_path), hash_index=index))
+    index.save()
+
+    same = PerceptualHashIndex(path, config=object_extract.segmentation_fingerprint("vit_h"))
+    for config in (object_extract.segmentation_fingerprint("vit_b"),
+                   object_extract.segmentation_fingerprint("vit_h", prompt_density="sparse"),
+                   object_extract.segmentation_fingerprint("vit_h", time_budget_s=30)):
+        changed = PerceptualHashIndex(path, config=config)
+        record = object_extract.segment_and_save_objects(str(copy), None, str(tmp_path), hash_index=changed)
+        assert "duplicate_of" not in record
+    record = object_extract.segment_and_save_objects(str(copy), None, str(tmp_path), hash_index=same)
+    assert record["duplicate_of"] == str(original)
+
+
+def test_fallback_images_are_not_registered(tmp_path):
+    index = PerceptualHashIndex(str(tmp_path / "index.json"))
+    segments = [{"file": str(tmp_path / "a.png"), "bbox": [0, 0, 4, 4]}]
+    object_extract.register_in_hash_index(index, {"image": "a", "phash": "00ff", "segments": segments,
+                                                  "fallback_level": "whole_image"})
+    assert len(index) == 0
+    object_extract.register_in_hash_index(index, {"image": "a", "phash": "00ff", "segments": segments,
+                                                  "fallback_level": "full"})
+    assert len(index) == 1
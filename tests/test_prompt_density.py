@@ -0,0 +1,77 @@
+import cv2
+import numpy as np
+import pytest
+import torch
+
+from segement.prompt_density import (MAX_POINTS_PER_SIDE, MIN_POINTS_PER_SIDE, MIN_SPARSE_POINTS,
+                                     choose_points_per_side, count_prompts, prompt_generator_kwargs,
+                                     salient_point_grid)
+
+
+def _busy(size, seed=0):
+    rng = np.random.default_rng(seed)
+    return cv2.resize(rng.integers(0, 255, (size // 8, size // 8, 3), dtype=np.uint8), (size, size),
+                      interpolation=cv2.INTER_NEAREST)
+
+
+def _blob(height, width):
+    image = np.full((height, width, 3), 240, dtype=np.uint8)
+    cv2.circle(image, (width // 4, height // 3), min(height, width) // 8, (200, 20, 20), -1)
+    return image
+
+
+def test_points_per_side_bounds():
+    assert choose_points_per_side(np.full((300, 300, 3), 255, dtype=np.uint8)) == MIN_POINTS_PER_SIDE
+    assert choose_points_per_side(_busy(2048)) == MAX_POINTS_PER_SIDE
+    assert choose_points_per_side(_busy(4096)) == MAX_POINTS_PER_SIDE  # size factor saturates
+    small, large = choose_points_per_side(_busy(256)), choose_points_per_side(_busy(1024))
+    assert MIN_POINTS_PER_SIDE < small < large < MAX_POINTS_PER_SIDE
+    assert choose_points_per_side(_busy(1024), min_points=4, max_points=4) == 4
+
+
+@pytest.mark.parametrize("shape", [(120, 400), (400, 120), (97, 97)])
+def test_salient_point_grid_stays_inside_the_image(shape):
+    points = salient_point_grid(_blob(*shape), 16)
+
+    assert points.ndim == 2 and points.shape[1] == 2
+    assert MIN_SPARSE_POINTS <= len(points) <= 16 * 16
+    assert (points >= 0).all() and (points <= 1).all()
+
+
+def test_salient_point_grid_is_a_subset_of_the_grid():
+    from segment_anything.utils.amg import build_point_grid
+
+    grid = {tuple(p) for p in build_point_grid(8)}
+    points = salient_point_grid(_blob(200, 300), 8)
+    assert len(points) <= len(grid) // 2 + 1
+    assert all(tuple(p) in grid for p in points)
+
+
+def test_count_prompts_per_mode():
+    image = _blob(300, 300)
+    fixed = prompt_generator_kwargs(image, "fixed")
+    adaptive = prompt_generator_kwargs(image, "adaptive")
+    sparse = prompt_generator_kwargs(image, "sparse")
+
+    assert count_prompts(fixed) == MAX_POINTS_PER_SIDE ** 2
+    assert count_prompts(adaptive) == adaptive["points_per_side"] ** 2
+    assert count_prompts(sparse) == len(sparse["point_grids"][0]) <= count_prompts(adaptive)
+    with pytest.raises(ValueError):
+        prompt_generator_kwargs(image, "dense")
+
+
+def test_generate_masks_prompted_records():
+    from segment_anything import sam_model_registry
+    from segement.object_extract import generate_masks_prompted
+
+    torch.manual_seed(0)
+    sam = sam_model_registry["vit_b"]().eval()
+    image = _blob(240, 320)
+    records = generate_masks_prompted(image, sam, max_prompts=3)
+
+    assert len(records) <= 3
+    for record in records:
+        x, y, w, h = record["bbox"]
+        assert record["segmentation"].shape == image.shape[:2]
+        assert record["area"] == int(record["segmentation"].sum()) > 0
+        assert 0 <= x and 0 <= y and x + w <= image.shape[1] and y + h <= image.shape[0]
@@ -0,0 +1,36 @@
+import torch
+
+from segement.find_best_paragraphs import find_best_paragraphs
+from segement.ranking import rank_paragraphs
+
+
+def _paragraphs(count, generator):
+    words = ["madonna", "child", "angel", "gold", "panel", "saint", "altar"]
+    paragraphs = []
+    for i in range(count):
+        n = int(torch.randint(1, 7, (1,), generator=generator))
+        cleaned = " ".join(words[(i + j) % len(words)] for j in range(n))
+        paragraphs.append((1 + i // 10, 1 + i % 10, {"text": cleaned}, cleaned))
+    return paragraphs
+
+
+def _as_json(sub_imgs, ranked):
+    return [{"main_image": "main.jpeg", "Images": [
+        {"Image": name, "Ranked Paragraphs": [
+            {"Page": p, "Paragraph": n, "Original Text": str(o), "Cleaned Text": c, "Similarity": s}
+            for p, n, o, c, s in rows]}
+        for name, rows in zip(sub_imgs, ranked)]}]
+
+
+def test_top_k_keeps_the_best_valid_paragraph():
+    generator = torch.Generator().manual_seed(0)
+    paragraphs = _paragraphs(60, generator)
+    similarities = torch.rand(12, 60, generator=generator)
+    similarities[0, 5:9] = 0.99  # ties between paragraphs
+    sub_imgs = [f"seg_{i}.png" for i in range(12)]
+
+    full = rank_paragraphs(similarities, paragraphs)
+    top = rank_paragraphs(similarities, paragraphs, top_k=3)
+
+    assert all(len(rows) == 3 for rows in top)
+    assert find_best_paragraphs(_as_json(sub_imgs, top)) == find_best_paragraphs(_as_json(sub_imgs, full))
@@ -0,0 +1,63 @@
+import numpy as np
+
+from segement.saliency import salient_components, saliency_segments
+
+BLOBS = [(40, 50, 80), (270, 180, 60)]  # x, y, side: the larger blob first
+
+
+def _two_blobs():
+    rng = np.random.default_rng(0)
+    image = np.full((300, 400, 3), 235, dtype=np.uint8)
+    for x, y, side in BLOBS:
+        image[y:y + side, x:x + side] = rng.integers(0, 255, (side, side, 3), dtype=np.uint8)
+    return image
+
+
+def _iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    iw = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    ih = max(0, min(ay + ah, by + bh) - max(ay, by))
+    return iw * ih / (aw * ah + bw * bh - iw * ih)
+
+
+def test_two_blobs_give_two_components():
+    components = salient_components(_two_blobs())
+
+    assert len(components) == 2
+    assert components[0]["area"] >= components[1]["area"]
+    for component, (x, y, side) in zip(components, BLOBS):
+        cx, cy = component["centroid"]
+        assert x <= cx <= x + side and y <= cy <= y + side
+        assert _iou(component["bbox"], [x, y, side, side]) > 0.5
+
+
+def test_min_area_and_max_components():
+    image = _two_blobs()
+    areas = [c["area"] for c in salient_components(image)]
+
+    between = (areas[0] + areas[1]) / 2 / (image.shape[0] * image.shape[1])
+    assert [c["area"] for c in salient_components(image, min_area_ratio=between)] == areas[:1]
+    assert salient_components(image, min_area_ratio=1.0) == []
+    assert [c["area"] for c in salient_components(image, max_components=1)] == areas[:1]
+
+
+def test_saliency_segments_match_components():
+    image = _two_blobs()
+    components = salient_components(image)
+    segments = saliency_segments(image)
+
+    assert len(segments) == len(components)
+    for segment, component in zip(segments, components):
+        x, y, w, h = component["bbox"]
+        assert segment["bbox"] == [x, y, w - 1, h - 1]
+        assert segment["area"] == w * h == int(segment["segmentation"].sum())
+
+
+def test_saliency_segments_fall_back_to_the_whole_image(monkeypatch):
+    import segement.saliency as saliency
+
+    monkeypatch.setattr(saliency, "salient_components", lambda image, **kwargs: [])
+    segments = saliency.saliency_segments(np.zeros((50, 60, 3), dtype=np.uint8))
+    assert len(segments) == 1
+    assert segments[0]["bbox"] == [0, 0, 59, 49] and segments[0]["segmentation"].all()
@@ -0,0 +1,63 @@
+import os
+
+import cv2
+import numpy as np
+
+import SaliencyBasedExtraction as extraction
+
+
+def _images(folder, names):
+    rng = np.random.default_rng(0)
+    for name in names:
+        image = np.full((120, 160, 3), 235, dtype=np.uint8)
+        image[30:90, 40:110] = rng.integers(0, 255, (60, 70, 3), dtype=np.uint8)
+        cv2.imwrite(str(folder / name), image)
+
+
+def test_failing_writes_are_counted_and_the_rest_written(tmp_path, monkeypatch):
+    input_dir, output_dir = tmp_path / "in", tmp_path / "out"
+    input_dir.mkdir()
+    _images(input_dir, [f"{c}.png" for c in "abcd"])
+    imwrite = cv2.imwrite
+
+    def flaky_imwrite(path, image, *args):
+        if os.path.basename(path).startswith("b_"):
+            raise OSError("disk full")
+        if os.path.basename(path).startswith("c_"):
+            return False
+        return imwrite(path, image, *args)
+
+    monkeypatch.setattr(extraction.cv2, "imwrite", flaky_imwrite)
+    counts = extraction.process_all_images_parallel(str(input_dir), str(output_dir), num_threads=2,
+                                                    num_writers=1, queue_size=1)
+
+    assert counts == {"processed": 4, "failed": 0, "write_failed": 6}
+    assert sorted(os.listdir(output_dir)) == sorted(f"{c}_{kind}.png" for c in "ad"
+                                                    for kind in ("saliency", "mask", "segment"))
+
+
+def test_failing_producers_do_not_stall_the_pipeline(tmp_path, monkeypatch):
+    input_dir, output_dir = tmp_path / "in", tmp_path / "out"
+    input_dir.mkdir()
+    _images(input_dir, [f"{c}.png" for c in "abc"])
+    imread, extract = cv2.imread, extraction.extract_salient_region
+
+    def failing_imread(path, *args):
+        if os.path.basename(path) == "a.png":
+            raise RuntimeError("corrupt file")
+        return imread(path, *args)
+
+    def failing_extract(img, detector=None):
+        if img.shape[0] == 120 and failing_extract.calls == 0:
+            failing_extract.calls += 1
+            raise RuntimeError("saliency failed")
+        return extract(img, detector)
+    failing_extract.calls = 0
+
+    monkeypatch.setattr(extraction.cv2, "imread", failing_imread)
+    monkeypatch.setattr(extraction, "extract_salient_region", failing_extract)
+    counts = extraction.process_all_images_parallel(str(input_dir), str(output_dir), num_threads=1,
+                                                    save_debug=False)
+
+    assert counts == {"processed": 1, "failed": 1, "write_failed": 0}
+    assert len(os.listdir(output_dir)) == 1
@@ -0,0 +1,69 @@
+import time
+
+import numpy as np
+import pytest
+
+import segement.object_extract as object_extract
+from segement.time_budget import DeadlineExceeded, DeadlineMaskGenerator, fallback_plan
+
+
+def test_fallback_plan_degrades_resolution_then_prompts():
+    plan = fallback_plan(None, {"points_per_side": 32}, (3000, 2000, 3), time_budget_s=60)
+
+    assert [level for level, *_ in plan] == ["full", "lower_resolution", "fewer_prompts"]
+    assert plan[0][3] == 60 and plan[1][3] == plan[2][3] == 30
+    assert plan[1][1]["max_side"] == 1024
+    assert plan[2][2] == {"points_per_side": 8, "crop_n_layers": 0}
+
+
+def test_deadline_generator_stops_before_the_encoder():
+    from segment_anything import sam_model_registry
+
+    generator = DeadlineMaskGenerator(sam_model_registry["vit_b"](), deadline=time.perf_counter() - 1)
+    with pytest.raises(DeadlineExceeded):
+        generator.generate(np.zeros((64, 64, 3), dtype=np.uint8))
+
+
+def test_exhausted_ladder_returns_whole_image(monkeypatch):
+    def always_late(image, sam_model, deadline=None, **kwargs):
+        raise DeadlineExceeded()
+
+    monkeypatch.setattr(object_extract, "generate_masks", always_late)
+    record = {}
+    masks = object_extract.generate_masks_with_deadline(np.zeros((600, 800, 3), dtype=np.uint8), None,
+                                                        1.0, None, record, points_per_side=32)
+
+    assert record["fallback_level"] == "whole_image"
+    assert len(masks) == 1 and masks[0]["segmentation"].all()
+
+
+@pytest.mark.parametrize("late_levels", [1, 2])
+def test_deadline_fallback_does_not_leak_into_the_next_image(monkeypatch, late_levels):
+    calls = []
+
+    def late_first(image, sam_model, deadline=None, **kwargs):
+        calls.append(kwargs)
+        if len(calls) <= late_levels:
+            raise DeadlineExceeded()
+        mask = np.zeros(image.shape[:2], dtype=bool)
+        mask[10:50, 10:50] = True
+        return [{"segmentation": mask, "area": int(mask.sum()), "bbox": [10, 10, 40, 40]}]
+
+    monkeypatch.setattr(object_extract, "generate_masks", late_first)
+    settings = dict(object_extract.DEFAULT_SETTINGS)
+    slow = {"size": [2400, 3000]}
+    object_extract.generate_masks_with_deadline(np.zeros((2400, 3000, 3), dtype=np.uint8), None, 60.0,
+                                                settings, slow, points_per_side=32)
+
+    assert slow["fallback_level"] == ["lower_resolution", "fewer_prompts"][late_levels - 1]
+    assert slow["fallback_settings"]["max_side"] == 1024
+    assert slow["settings"] == settings
+    settings = object_extract.next_image_settings(settings, slow, memory_budget_mb=1.0)
+    assert settings == object_extract.DEFAULT_SETTINGS
+
+    normal = {"size": [2400, 3000]}
+    object_extract.generate_masks_with_deadline(np.zeros((2400, 3000, 3), dtype=np.uint8), None, 60.0,
+                                                settings, normal, points_per_side=32)
+    assert normal["fallback_level"] == "full" and "fallback_settings" not in normal
+    assert normal["settings"] == object_extract.DEFAULT_SETTINGS
+    assert calls[-1] == {"points_per_batch": 64, "points_per_side": 32}